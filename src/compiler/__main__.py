@@ -1,64 +1,105 @@
-from base64 import b64encode
-import json
+import os
 import re
 import sys
-from socketserver import ForkingTCPServer, StreamRequestHandler
-from traceback import format_exception
-from typing import Any
-
-from compiler.tokenizer import tokenize
-from compiler.parser import parse
-from compiler.type_checker import typecheck
-from compiler.ir_generator import generate_ir, root_types
-from compiler.assembly_generator import generate_assembly
-from compiler.assembler import assemble_and_get_executable
-
-
-def call_compiler(source_code: str, input_file_name: str) -> bytes:
-    # *** TODO ***
-    # Call your compiler here and return the compiled executable.
-    # Raise an exception on compilation error.
-    #
-    # The input file name is informational only: you can optionally include in your source locations and error messages,
-    # or you can ignore it.
-    tokenized = tokenize(source_code)
-    parsed = parse(tokenized)
-    type_checked = typecheck(parsed)
-    ir_gen = generate_ir(root_types, parsed)
-    assembly_gen = generate_assembly(ir_gen)
-
-    print(assembly_gen)
-    return assemble_and_get_executable(assembly_gen)
+from pathlib import Path
+
+from compiler import trace
+from compiler.cache import CompilationCache
+from compiler.instrumentation import CompileProfile, StageStats
+from compiler.pipeline import (
+    CompilerOptions,
+    call_compiler_to_file,
+    compile_file,
+    compile_batch,
+    configure_cache,
+    configure_stats,
+    make_process_pool,
+)
+from compiler.server import ServerOptions, run_async_server, run_server
 
 
 def main() -> int:
     # === Option parsing ===
     command: str | None = None
-    input_file: str | None = None
+    input_files: list[str] = []
     output_file: str | None = None
+    output_dir: str | None = None
+    jobs = os.cpu_count() or 1
     host = "127.0.0.1"
     port = 3000
+    server_options = ServerOptions()
+    use_cache = True
+    cache_dir: str | None = None
+    cache_memory = 64 * 1024 * 1024
+    assembler = "binutils"
+    timings = False
+    optimize = True
     for arg in sys.argv[1:]:
         if (m := re.fullmatch(r"--output=(.+)", arg)) is not None:
             output_file = m[1]
+        elif (m := re.fullmatch(r"--output-dir=(.+)", arg)) is not None:
+            output_dir = m[1]
+        elif (m := re.fullmatch(r"--jobs=(\d+)", arg)) is not None:
+            jobs = int(m[1])
+        elif (m := re.fullmatch(r"--batch-jobs=(\d+)", arg)) is not None:
+            server_options.batch_jobs = int(m[1])
         elif (m := re.fullmatch(r"--host=(.+)", arg)) is not None:
             host = m[1]
         elif (m := re.fullmatch(r"--port=(.+)", arg)) is not None:
             port = int(m[1])
+        elif (m := re.fullmatch(r"--workers=(\d+)", arg)) is not None:
+            server_options.workers = int(m[1])
+        elif (m := re.fullmatch(r"--max-requests=(\d+)", arg)) is not None:
+            server_options.max_requests = int(m[1])
+        elif (m := re.fullmatch(r"--max-worker-age=(.+)", arg)) is not None:
+            server_options.max_worker_age = float(m[1])
+        elif arg == "--reuse-port":
+            server_options.reuse_port = True
+        elif (m := re.fullmatch(r"--frontend=(prefork|async)", arg)) is not None:
+            server_options.frontend = m[1]
+        elif (m := re.fullmatch(r"--executor=(process|thread)", arg)) is not None:
+            server_options.executor = m[1]
+        elif (m := re.fullmatch(r"--max-inflight=(\d+)", arg)) is not None:
+            server_options.max_inflight = int(m[1])
+        elif (m := re.fullmatch(r"--max-queued=(\d+)", arg)) is not None:
+            server_options.max_queued = int(m[1])
+        elif (m := re.fullmatch(r"--read-timeout=(.+)", arg)) is not None:
+            server_options.read_timeout = float(m[1])
+        elif (m := re.fullmatch(r"--max-request-size=(\d+)", arg)) is not None:
+            server_options.max_request_size = int(m[1])
+        elif (m := re.fullmatch(r"--cache-dir=(.+)", arg)) is not None:
+            cache_dir = m[1]
+        elif (m := re.fullmatch(r"--cache-memory=(\d+)", arg)) is not None:
+            cache_memory = int(m[1])
+        elif (m := re.fullmatch(r"--assembler=(binutils|builtin)", arg)) is not None:
+            assembler = m[1]
+        elif (m := re.fullmatch(r"--trace=(.+)", arg)) is not None:
+            trace.enable(m[1].split(","))
+        elif arg == "--timings":
+            timings = True
+        elif arg == "--no-cache":
+            use_cache = False
+        elif arg == "--no-optimize":
+            optimize = False
         elif arg.startswith("-"):
             raise Exception(f"Unknown argument: {arg}")
         elif command is None:
             command = arg
-        elif input_file is None:
-            input_file = arg
         else:
-            raise Exception("Multiple input files not supported")
+            input_files.append(arg)
 
     if command is None:
         print(f"Error: command argument missing", file=sys.stderr)
         return 1
 
-    def read_source_code() -> str:
+    compiler_options = CompilerOptions(assembler=assembler, optimize=optimize)
+    server_options.compiler_options = compiler_options
+    # A one-shot compile can only hit the cache on disk, so without a cache
+    # directory only the server keeps one.
+    if use_cache and (command == "serve" or cache_dir is not None):
+        configure_cache(CompilationCache(cache_memory, cache_dir))
+
+    def read_source_code(input_file: str | None) -> str:
         if input_file is not None:
             with open(input_file) as f:
                 return f.read()
@@ -67,16 +108,63 @@ def main() -> int:
 
     # === Command implementations ===
 
-    if command == "compile":
-        source_code = read_source_code()
+    if command == "compile" and output_dir is not None:
+        # Each input file is compiled to an executable of the same
+        # name, without the suffix, in the output directory.
+        outputs = [
+            os.path.join(output_dir, Path(input_file).stem)
+            for input_file in input_files
+        ]
+        if len(set(outputs)) != len(outputs):
+            raise Exception("Input files must have distinct names")
+        programs = [
+            (read_source_code(input_file), input_file) for input_file in input_files
+        ]
+        if len(programs) > 1 and jobs > 1:
+            with make_process_pool(min(jobs, len(programs))) as executor:
+                results = compile_batch(
+                    programs, compiler_options, executor, jobs, timings
+                )
+        else:
+            results = compile_batch(programs, compiler_options, profile=timings)
+        os.makedirs(output_dir, exist_ok=True)
+        failed = False
+        for input_file, output, result in zip(input_files, outputs, results):
+            if result.profile is not None:
+                print(f"{input_file}:\n{result.profile.format()}", file=sys.stderr)
+            if result.executable is None:
+                print(f"{input_file}: {result.error}", file=sys.stderr)
+                failed = True
+                continue
+            with open(output, "wb") as f:
+                f.write(result.executable)
+            os.chmod(output, 0o755)
+        return 1 if failed else 0
+    elif command == "compile":
+        if len(input_files) > 1:
+            raise Exception("Multiple input files require --output-dir=...")
         if output_file is None:
             raise Exception("Output file flag --output=... required")
-        executable = call_compiler(source_code, input_file or "(source code)")
-        with open(output_file, "wb") as f:
-            f.write(executable)
+        profile = CompileProfile(track_memory=True) if timings else None
+        if input_files:
+            compile_file(input_files[0], output_file, compiler_options, profile)
+        else:
+            call_compiler_to_file(
+                read_source_code(None),
+                "(source code)",
+                output_file,
+                compiler_options,
+                profile,
+            )
+        if profile is not None:
+            print(profile.format(), file=sys.stderr)
     elif command == "serve":
+        configure_stats(StageStats())
         try:
-            run_server(host, port)
+            if server_options.frontend == "async":
+                run_async_server(host, port, server_options)
+            else:
+                run_server(host, port, server_options)
         except KeyboardInterrupt:
             pass
     else:
@@ -85,34 +173,5 @@ def main() -> int:
     return 0
 
 
-def run_server(host: str, port: int) -> None:
-    class Server(ForkingTCPServer):
-        allow_reuse_address = True
-        request_queue_size = 32
-
-    class Handler(StreamRequestHandler):
-        def handle(self) -> None:
-            result: dict[str, Any] = {}
-            try:
-                input_str = self.rfile.read().decode()
-                input = json.loads(input_str)
-                if input["command"] == "compile":
-                    source_code = input["code"]
-                    executable = call_compiler(source_code, "(source code)")
-                    result["program"] = b64encode(executable).decode()
-                elif input["command"] == "ping":
-                    pass
-                else:
-                    result["error"] = "Unknown command: " + input["command"]
-            except Exception as e:
-                result["error"] = "".join(format_exception(e))
-            result_str = json.dumps(result)
-            self.request.sendall(str.encode(result_str))
-
-    print(f"Starting TCP server at {host}:{port}")
-    with Server((host, port), Handler) as server:
-        server.serve_forever()
-
-
 if __name__ == "__main__":
     sys.exit(main())
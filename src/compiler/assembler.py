@@ -1,11 +1,20 @@
+import errno
+import functools
+import hashlib
+import os
 import subprocess
 import tempfile
+import threading
 from contextlib import nullcontext
 from os import path
 from typing import Any, Callable, ContextManager, TypeVar
 import shutil
+import stat
 from pathlib import Path
 
+from compiler.encoder import EncodingError, assemble_executable
+from compiler.instrumentation import add_child_cpu_time
+
 T = TypeVar("T")
 
 
@@ -16,18 +25,27 @@ def assemble(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    builtin: bool = False,
 ) -> None:
     """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
 
     The file is written to the given path.
+    With `builtin`, the built-in encoder is tried first (see `_try_builtin`).
     """
+    if builtin:
+        executable = _try_builtin(assembly_code, link_with_c, extra_libraries)
+        if executable is not None:
+            with open(output_file, "wb") as f:
+                f.write(executable)
+            os.chmod(output_file, 0o755)
+            return
     _assemble(
         assembly_code=assembly_code,
         workdir=workdir,
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
-        take_output=lambda f: shutil.move(f, output_file),
+        take_output=lambda f: _move_file(f, output_file),
     )
 
 
@@ -37,11 +55,17 @@ def assemble_and_get_executable(
     tempfile_basename: str = "program",
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    builtin: bool = False,
 ) -> bytes:
     """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
 
     The file is returned.
+    With `builtin`, the built-in encoder is tried first (see `_try_builtin`).
     """
+    if builtin:
+        executable = _try_builtin(assembly_code, link_with_c, extra_libraries)
+        if executable is not None:
+            return executable
     return _assemble(
         assembly_code=assembly_code,
         workdir=workdir,
@@ -52,6 +76,23 @@ def assemble_and_get_executable(
     )
 
 
+def _try_builtin(
+    assembly_code: str, link_with_c: bool, extra_libraries: list[str]
+) -> bytes | None:
+    """Encodes the program and the stdlib in-process into a static executable.
+
+    Returns None if that is not possible, in which case binutils must be used:
+    when linking with C or other libraries, or when the assembly uses
+    something the built-in encoder does not support.
+    """
+    if link_with_c or extra_libraries:
+        return None
+    try:
+        return assemble_executable([stdlib_asm_code, assembly_code])
+    except EncodingError:
+        return None
+
+
 def _assemble(
     assembly_code: str,
     workdir: str | None,
@@ -71,7 +112,9 @@ def _assemble(
             take_output,
         )
     else:
-        with tempfile.TemporaryDirectory(prefix="compiler_") as wd:
+        with tempfile.TemporaryDirectory(
+            prefix="compiler_", dir=scratch_directory()
+        ) as wd:
             return _assemble_impl(
                 assembly_code,
                 wd,
@@ -90,41 +133,160 @@ def _assemble_impl(
     extra_libraries: list[str],
     take_output: Callable[[str], T],
 ) -> T:
-    stdlib_asm = path.join(workdir, "stdlib.s")
-    stdlib_obj = path.join(workdir, "stdlib.o")
-    program_asm = path.join(workdir, f"{tempfile_basename}.s")
+    stdlib_obj = stdlib_object(link_with_c)
     program_obj = path.join(workdir, f"{tempfile_basename}.o")
     output_file = path.join(workdir, "a.out")
 
-    if link_with_c:
-        final_stdlib_asm_code = drop_start_symbol(stdlib_asm_code)
-    else:
-        final_stdlib_asm_code = stdlib_asm_code
-
-    with open(stdlib_asm, "w") as f:
-        f.write(final_stdlib_asm_code)
-    with open(program_asm, "w") as f:
-        f.write(assembly_code)
-    subprocess.run(["as", "-g", "-o" + stdlib_obj, stdlib_asm], check=True)
-    subprocess.run(["as", "-g", "-o" + program_obj, program_asm], check=True)
+    # The assembly is piped to 'as' instead of going through a file.
+    if not assembly_code.endswith("\n"):
+        assembly_code += "\n"
+    _run_tool(["as", "-g", "-o" + program_obj], input=assembly_code)
     linker_flags = ["-static", *[f"-l{lib}" for lib in extra_libraries]]
     if link_with_c:
         # Linking with the C standard library correctly is complicated,
         # as evidenced by the complicated linker command shown by `cc -v something.c`.
         # Instead of trying to build the right `ld` command ourselves, we use the C compiler
         # to do the linking.
-        subprocess.run(
-            ["cc", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
-            check=True,
-        )
+        _run_tool(["cc", "-o" + output_file, *linker_flags, stdlib_obj, program_obj])
     else:
-        subprocess.run(
-            ["ld", "-o" + output_file, *linker_flags, stdlib_obj, program_obj],
-            check=True,
-        )
+        _run_tool(["ld", "-o" + output_file, *linker_flags, stdlib_obj, program_obj])
     return take_output(output_file)
 
 
+def _run_tool(args: list[str], input: str | None = None) -> None:
+    """Like `subprocess.run(args, input=input, text=True, check=True)`.
+
+    The CPU time the command used is added to this thread's, see
+    `add_child_cpu_time`.
+    """
+    stdin = subprocess.PIPE if input is not None else None
+    with subprocess.Popen(args, stdin=stdin, text=True) as process:
+        if process.stdin is not None:
+            try:
+                process.stdin.write(input or "")
+                process.stdin.close()
+            except BrokenPipeError:
+                # The command exited early. Its exit status says why.
+                pass
+        # Reaping the process ourselves gives the resources it used,
+        # which Popen.wait() doesn't.
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    add_child_cpu_time(usage.ru_utime + usage.ru_stime)
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, args)
+
+
+@functools.cache
+def scratch_directory() -> str | None:
+    """Returns the directory for temporary build files.
+
+    This is `$COMPILER_WORKDIR` if set, otherwise `/dev/shm` if it is
+    usable, so that intermediate files never touch the disk.
+    None means the system default temp directory.
+    """
+    for candidate in [os.environ.get("COMPILER_WORKDIR"), "/dev/shm"]:
+        if candidate and path.isdir(candidate) and os.access(candidate, os.W_OK):
+            return candidate
+    return None
+
+
+def _move_file(source: str, destination: str) -> None:
+    """Moves a file without reading it into memory.
+
+    A rename if possible, otherwise an in-kernel copy.
+    """
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    try:
+        _copy_file_range(source, destination)
+    except (AttributeError, OSError):
+        # copy_file_range is missing or not supported between these file
+        # systems. shutil.copyfile still copies in the kernel (sendfile).
+        shutil.copyfile(source, destination)
+    shutil.copymode(source, destination)
+    os.unlink(source)
+
+
+def _copy_file_range(source: str, destination: str) -> None:
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if n == 0:
+                break
+            remaining -= n
+
+
+_stdlib_objects: dict[bool, str] = {}
+_stdlib_lock = threading.Lock()
+
+
+def stdlib_object(link_with_c: bool = False) -> str:
+    """Returns the path to the assembled stdlib, assembling it if needed.
+
+    The stdlib never changes, so it is assembled at most once per process.
+    The object file is kept in a cache directory (`$COMPILER_STDLIB_CACHE`,
+    or a per-user directory under the system temp directory) under a name
+    derived from the hash of its source, so other processes and later runs
+    can reuse it as well. A cache directory that other users can write to
+    is not trusted; the object is then assembled in a new private one.
+    """
+    with _stdlib_lock:
+        obj = _stdlib_objects.get(link_with_c)
+        if obj is None or not path.exists(obj):
+            obj = _build_stdlib_object(link_with_c)
+            _stdlib_objects[link_with_c] = obj
+        return obj
+
+
+def _build_stdlib_object(link_with_c: bool) -> str:
+    code = drop_start_symbol(stdlib_asm_code) if link_with_c else stdlib_asm_code
+    digest = hashlib.sha256(code.encode()).hexdigest()[:16]
+
+    cache_dir = os.environ.get("COMPILER_STDLIB_CACHE") or path.join(
+        tempfile.gettempdir(), f"compiler_stdlib_{os.getuid()}"
+    )
+    if not _make_private_directory(cache_dir):
+        # Anyone else who can write there could plant an object file
+        # that gets linked into our executables.
+        cache_dir = tempfile.mkdtemp(prefix="compiler_stdlib_")
+    obj = path.join(cache_dir, f"stdlib-{digest}.o")
+    if path.exists(obj):
+        return obj
+
+    # Assemble under a temporary name and rename into place, so concurrent
+    # compiler processes never link against a half-written object file.
+    with tempfile.TemporaryDirectory(prefix="compiler_", dir=cache_dir) as wd:
+        stdlib_asm = path.join(wd, "stdlib.s")
+        stdlib_obj = path.join(wd, "stdlib.o")
+        with open(stdlib_asm, "w") as f:
+            f.write(code)
+        _run_tool(["as", "-g", "-o" + stdlib_obj, stdlib_asm])
+        os.replace(stdlib_obj, obj)
+    return obj
+
+
+def _make_private_directory(directory: str) -> bool:
+    """Creates `directory` if needed. Returns whether it is a directory
+    that only the current user can write to.
+    """
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.getuid()
+        and st.st_mode & (stat.S_IWGRP | stat.S_IWOTH) == 0
+    )
+
+
 def drop_start_symbol(code: str) -> str:
     return code.split("# BEGIN START")[0] + code.split("# END START")[1]
 
@@ -364,7 +526,7 @@ read_int:
     neg %r10
 .Lfinal_negation_done:
     # Restore stack registers and return the result
-    popq %r12
+    movq -8(%rbp), %r12  # Restore r12 from below the input buffer
     movq %rbp, %rsp
     popq %rbp
     movq %r10, %rax
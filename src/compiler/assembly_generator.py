@@ -1,7 +1,9 @@
 import compiler.ir as ir
 import dataclasses
 
-from compiler.intrinsics import all_intrinsics, IntrinsicArgs
+from compiler.instruction_selector import select_instructions
+from compiler.intrinsics import all_intrinsics, comparison_conditions, IntrinsicArgs
+from compiler.register_allocator import Allocation, allocate_registers
 
 
 def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
@@ -26,29 +28,94 @@ def get_all_ir_variables(instructions: list[ir.Instruction]) -> list[ir.IRVar]:
 
 
 class Locals:
+    """Where each IR variable lives: in a register, in a stack slot or,
+    for constants, in the instructions that read it.
+    Also has a stack slot for each register that gets saved.
+    """
+
     _var_to_location: dict[ir.IRVar, str]
+    _register_slots: dict[str, str]
     _stack_used: int
 
-    def __init__(self, variables: list[ir.IRVar]) -> None:
-        self._var_to_location = {}
-        self._stack_used = len(variables) * 8
-        for i, var in enumerate(variables):
-            self._var_to_location[var] = f"-{(i+1)*8}(%rbp)"
+    def __init__(self, allocation: Allocation, immediates: dict[ir.IRVar, int]) -> None:
+        self._var_to_location = dict(allocation.registers)
+        for var, value in immediates.items():
+            self._var_to_location[var] = f"${value}"
+        for var, slot in allocation.stack_slots.items():
+            self._var_to_location[var] = f"-{(slot + 1) * 8}(%rbp)"
+        slots = allocation.slot_count()
+        self._register_slots = {}
+        for register in allocation.callee_saved + allocation.caller_saved():
+            slots += 1
+            self._register_slots[register] = f"-{slots * 8}(%rbp)"
+        # Keep the stack 16-byte aligned for calls, as the ABI requires.
+        self._stack_used = (slots * 8 + 15) // 16 * 16
 
     def get_ref(self, v: ir.IRVar) -> str:
         return self._var_to_location[v]
 
+    def get_save_slot(self, register: str) -> str:
+        return self._register_slots[register]
+
     def stack_used(self) -> int:
         return self._stack_used
 
 
-def generate_assembly(instructions: list[ir.Instruction]) -> str:
+def _in_memory(ref: str) -> bool:
+    return not ref.startswith(("%", "$"))
+
+
+# The condition code that is true exactly when the given one is false.
+_NEGATED_CONDITIONS = {
+    "e": "ne",
+    "ne": "e",
+    "l": "ge",
+    "ge": "l",
+    "le": "g",
+    "g": "le",
+}
+
+# The condition code that is true when the given one is true of the
+# operands in the other order.
+_SWAPPED_CONDITIONS = {
+    "e": "e",
+    "ne": "ne",
+    "l": "g",
+    "g": "l",
+    "le": "ge",
+    "ge": "le",
+}
+
+# Instructions that can add to or subtract from memory.
+_MEMORY_UPDATES = {"+": "addq", "-": "subq"}
+
+
+def generate_assembly(
+    instructions: list[ir.Instruction], use_registers: bool = True
+) -> str:
+    """Generates assembly for the program `instructions`.
+
+    With `use_registers`, variables are kept in registers as far as
+    they fit, see `register_allocator`. Otherwise every variable is
+    kept in a stack slot. Either way, the patterns that
+    `instruction_selector` finds get their own instructions.
+    """
     lines = []
 
     def emit(line: str) -> None:
         lines.append(line)
 
-    locals = Locals(variables=get_all_ir_variables(instructions))
+    selection = select_instructions(instructions)
+    if use_registers:
+        allocation = allocate_registers(instructions, unallocated=selection.unallocated)
+    else:
+        allocation = allocate_registers(
+            instructions,
+            callee_saved=[],
+            caller_saved=[],
+            unallocated=selection.unallocated,
+        )
+    locals = Locals(allocation, selection.immediates)
 
     # ... Emit initial declarations and stack setup here ...
 
@@ -64,9 +131,44 @@ def generate_assembly(instructions: list[ir.Instruction]) -> str:
     emit("pushq %rbp")
     emit("movq %rsp, %rbp")
     emit(f"subq ${locals.stack_used()}, %rsp")
+    for register in allocation.callee_saved:
+        emit(f"movq {register}, {locals.get_save_slot(register)}")
 
-    for insn in instructions:
+    def fallthrough_label(i: int) -> str | None:
+        """Returns the label right after instruction `i`, if any."""
+        if i + 1 < len(instructions):
+            next_insn = instructions[i + 1]
+            if isinstance(next_insn, ir.Label):
+                return next_insn.name
+        return None
+
+    def emit_branch(condition: str, insn: ir.CondJump, fallthrough: str | None) -> None:
+        # Jumping to the next instruction is left out.
+        then_name, else_name = insn.then_label.name, insn.else_label.name
+        if fallthrough == else_name:
+            emit(f"j{condition} .L{then_name}")
+        elif fallthrough == then_name:
+            emit(f"j{_NEGATED_CONDITIONS[condition]} .L{else_name}")
+        else:
+            emit(f"j{condition} .L{then_name}")
+            emit(f"jmp .L{else_name}")
+
+    def register_for(ref: str, scratch: str) -> str:
+        """Returns `ref` if it's a register, else loads it into `scratch`."""
+        if ref.startswith("%"):
+            return ref
+        emit(f"movq {ref}, {scratch}")
+        return scratch
+
+    # The instructions that are emitted as part of another one.
+    skipped = set(selection.folded)
+    skipped.update(i + 1 for i in selection.fused_comparisons)
+    skipped.update(i + 1 for i in selection.results)
+
+    for i, insn in enumerate(instructions):
         emit("# " + str(insn))
+        if i in skipped:
+            continue
         match insn:
             case ir.Label():
                 emit("")
@@ -74,9 +176,17 @@ def generate_assembly(instructions: list[ir.Instruction]) -> str:
                 # This makes GDB backtraces look nicer too:
                 # https://stackoverflow.com/a/26065570/965979
                 emit(f".L{insn.name}:")
+            case ir.LoadIntConst() | ir.LoadBoolConst() if (
+                insn.dest in selection.immediates
+            ):
+                # Read as an immediate operand instead.
+                pass
             case ir.LoadIntConst():
+                dest_ref = locals.get_ref(insn.dest)
                 if -(2**31) <= insn.value < 2**31:
-                    emit(f"movq ${insn.value}, {locals.get_ref(insn.dest)}")
+                    emit(f"movq ${insn.value}, {dest_ref}")
+                elif not _in_memory(dest_ref):
+                    emit(f"movabsq ${insn.value}, {dest_ref}")
                 else:
                     # Due to a quirk of x86-64, we must use
                     # a different instruction for large integers.
@@ -84,32 +194,98 @@ def generate_assembly(instructions: list[ir.Instruction]) -> str:
                     # not a memory location, so we use %rax
                     # as a temporary.
                     emit(f"movabsq ${insn.value}, %rax")
-                    emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                    emit(f"movq %rax, {dest_ref}")
             case ir.Jump():
-                emit(f"jmp .L{insn.label.name}")
+                if fallthrough_label(i) != insn.label.name:
+                    emit(f"jmp .L{insn.label.name}")
             case ir.LoadBoolConst():
                 emit(f"movq ${int(insn.value)}, {locals.get_ref(insn.dest)}")
             case ir.Copy():
-                emit(f"movq {locals.get_ref(insn.source)}, %rax")
-                emit(f"movq %rax, {locals.get_ref(insn.dest)}")
+                source_ref = locals.get_ref(insn.source)
+                dest_ref = locals.get_ref(insn.dest)
+                if source_ref == dest_ref:
+                    pass
+                elif _in_memory(source_ref) and _in_memory(dest_ref):
+                    emit(f"movq {source_ref}, %rax")
+                    emit(f"movq %rax, {dest_ref}")
+                else:
+                    emit(f"movq {source_ref}, {dest_ref}")
+            case ir.Call() if i in selection.fused_comparisons:
+                # The result is only needed to choose the branch, so
+                # branch on the flags of the comparison instead.
+                branch = instructions[i + 1]
+                assert isinstance(branch, ir.CondJump)
+                condition = comparison_conditions[insn.fun.name]
+                left, right = map(locals.get_ref, insn.args)
+                if left.startswith("$"):
+                    left, right = right, left
+                    condition = _SWAPPED_CONDITIONS[condition]
+                elif _in_memory(left) and _in_memory(right):
+                    left = register_for(left, "%rax")
+                emit(f"cmpq {right}, {left}")
+                emit_branch(condition, branch, fallthrough_label(i + 1))
+            case ir.Call() if i in selection.addresses:
+                address = selection.addresses[i]
+                base = locals.get_ref(address.base)
+                index = register_for(locals.get_ref(address.index), "%rdx")
+                if base.startswith("$"):
+                    operand = f"{base[1:]}(,{index},{address.scale})"
+                else:
+                    base = register_for(base, "%rax")
+                    operand = f"({base},{index},{address.scale})"
+                dest_ref = locals.get_ref(selection.results.get(i, insn.dest))
+                if _in_memory(dest_ref):
+                    emit(f"leaq {operand}, %rdi")
+                    emit(f"movq %rdi, {dest_ref}")
+                else:
+                    emit(f"leaq {operand}, {dest_ref}")
             case ir.Call():
                 mIntrinsic = all_intrinsics.get(insn.fun.name, None)
                 arg_refs = list(map(locals.get_ref, insn.args))
-                dest_ref = locals.get_ref(insn.dest)
-                if mIntrinsic is not None:
+                dest_ref = locals.get_ref(selection.results.get(i, insn.dest))
+                update = _MEMORY_UPDATES.get(insn.fun.name)
+                if (
+                    update is not None
+                    and _in_memory(dest_ref)
+                    and arg_refs[0] == dest_ref
+                    and not _in_memory(arg_refs[1])
+                ):
+                    # Update the variable in place, as in 'x = x + 1'.
+                    emit(f"{update} {arg_refs[1]}, {dest_ref}")
+                elif mIntrinsic is not None and not _in_memory(dest_ref):
+                    mIntrinsic(IntrinsicArgs(arg_refs, dest_ref, emit))
+                elif mIntrinsic is not None:
                     mIntrinsic(IntrinsicArgs(arg_refs, "%rdi", emit))
                     emit(f"movq %rdi, {dest_ref}")
                 else:
+                    saved = allocation.saved_across_call.get(i, [])
+                    for register in saved:
+                        emit(f"movq {register}, {locals.get_save_slot(register)}")
                     registers = ["%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"]
-                    for i, arg_ref in enumerate(arg_refs):
-                        emit(f"movq {arg_ref}, {registers[i]}")
+                    if len(arg_refs) == 1:
+                        emit(f"movq {arg_refs[0]}, %rdi")
+                    else:
+                        # An argument can be in another argument's register,
+                        # so pass them through the stack to not overwrite any.
+                        for arg_ref in arg_refs:
+                            emit(f"pushq {arg_ref}")
+                        for register in reversed(registers[: len(arg_refs)]):
+                            emit(f"popq {register}")
                     emit(f"callq {insn.fun.name}")
+                    for register in saved:
+                        emit(f"movq {locals.get_save_slot(register)}, {register}")
+                    emit(f"movq %rax, {dest_ref}")
 
             case ir.CondJump():
-                emit(f"cmpq $0, {locals.get_ref(insn.cond)}")
-                emit(f"jne .L{insn.then_label.name}")
-                emit(f"jmp .L{insn.else_label.name}")
+                cond_ref = locals.get_ref(insn.cond)
+                if _in_memory(cond_ref):
+                    emit(f"cmpq $0, {cond_ref}")
+                else:
+                    emit(f"testq {cond_ref}, {cond_ref}")
+                emit_branch("ne", insn, fallthrough_label(i))
 
+    for register in allocation.callee_saved:
+        emit(f"movq {locals.get_save_slot(register)}, {register}")
     emit("movq %rbp, %rsp")
     emit("popq %rbp")
     emit("ret")
@@ -3,7 +3,7 @@ from compiler.tokenizer import Location, L
 from compiler.types import Unit, Type
 
 
-@dataclass
+@dataclass(slots=True)
 class Expression:
     """Base class for AST nodes representing expressions."""
 
@@ -11,23 +11,26 @@ class Expression:
     type: Type = field(kw_only=True, default=Unit())
 
 
-@dataclass
+@dataclass(slots=True)
 class Literal(Expression):
     value: int | bool | None
 
 
-@dataclass
+@dataclass(slots=True)
 class Identifier(Expression):
     name: str
+    # The variable the name refers to, set by compiler.resolver.
+    # -1 means a global.
+    symbol: int = field(kw_only=True, default=-1, compare=False)
 
 
-@dataclass
+@dataclass(slots=True)
 class Assignment(Expression):
     identifier: Identifier
     expression: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class UnaryOp(Expression):
     """AST node for a unary operator, '-' or 'not'"""
 
@@ -35,7 +38,7 @@ class UnaryOp(Expression):
     parameter: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class BinaryOp(Expression):
     """
     AST node for a binary operation.
@@ -57,37 +60,37 @@ class BinaryOp(Expression):
     right: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class Branch(Expression):
     condition: Expression
     then: Expression
     otherwise: Expression | None = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Loop(Expression):
     condition: Expression
     loop: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class Block(Expression):
     expressions: list[Expression | None]
 
 
-@dataclass
+@dataclass(slots=True)
 class VarDeclaration(Expression):
     identifier: Identifier
     expression: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class TypedVarDeclaration(Expression):
     identifier: Identifier
     expression: Expression
 
 
-@dataclass
+@dataclass(slots=True)
 class FuncCall(Expression):
     identifier: Identifier
     arguments: list[Expression]
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import functools
+import hashlib
+import multiprocessing
+import os
+from pathlib import Path
+import tempfile
+import threading
+from typing import Any, Iterable
+
+# Names of the shared counters, in the order they are stored.
+COUNTERS = ("memory_hits", "disk_hits", "misses", "evictions", "stores")
+
+
+@functools.cache
+def compiler_version() -> str:
+    """Returns a fingerprint of the compiler's own source code.
+
+    Any change to the compiler invalidates all cached executables.
+    """
+    h = hashlib.sha256()
+    package_dir = Path(__file__).parent
+    for source_file in sorted(package_dir.glob("*.py")):
+        h.update(source_file.name.encode())
+        h.update(source_file.read_bytes())
+    return h.hexdigest()
+
+
+class CompilationCache:
+    """Content-addressed cache of finished executables.
+
+    Executables are keyed by a hash of the source code, the compiler version
+    and the compiler options. The cache has two tiers:
+
+    - an in-memory LRU tier limited to `memory_budget` bytes of executables,
+    - an optional on-disk tier in `directory`, which any number of processes
+      may share. Entries are written to a temporary file and renamed into
+      place, so readers never see partial files.
+
+    Hit, miss and eviction counters live in shared memory, so the numbers
+    reported by any process cover all processes forked from (or handed a
+    pickled copy of) the same cache. They are allocated for the
+    "forkserver" start method, which pickled copies are sent with.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = 64 * 1024 * 1024,
+        directory: str | None = None,
+        counters: Any = None,
+    ) -> None:
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.counters = (
+            counters
+            if counters is not None
+            else multiprocessing.get_context("forkserver").Array("q", len(COUNTERS))
+        )
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # A copy sent to another process starts with an empty memory tier
+        # but shares the disk tier and the counters.
+        return (CompilationCache, (self.memory_budget, self.directory, self.counters))
+
+    @staticmethod
+    def key(source_code: str, options: str) -> str:
+        return CompilationCache.key_chunks([source_code], options)
+
+    @staticmethod
+    def key_chunks(source_chunks: Iterable[str], options: str) -> str:
+        """Like `key`, for source code given as consecutive chunks."""
+        h = hashlib.sha256()
+        for part in (compiler_version(), options):
+            data = part.encode()
+            h.update(len(data).to_bytes(8, "little"))
+            h.update(data)
+        # The source comes last, so it needs no length prefix.
+        for chunk in source_chunks:
+            h.update(chunk.encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        if data is not None:
+            self._count("memory_hits")
+            return data
+
+        if self.directory is not None:
+            try:
+                data = self._disk_path(key).read_bytes()
+            except FileNotFoundError:
+                data = None
+            if data is not None:
+                self._count("disk_hits")
+                self._remember(key, data)
+                return data
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self._count("stores")
+        self._remember(key, data)
+        if self.directory is not None:
+            path = self._disk_path(key)
+            path.parent.mkdir(exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def stats(self) -> dict[str, int]:
+        with self.counters.get_lock():
+            result = dict(zip(COUNTERS, self.counters[:]))
+        result["hits"] = result["memory_hits"] + result["disk_hits"]
+        with self._lock:
+            result["memory_entries"] = len(self._entries)
+            result["memory_bytes"] = self._memory_used
+        return result
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_budget:
+            return
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._memory_used -= len(old)
+            while self._memory_used + len(data) > self.memory_budget:
+                _, dropped = self._entries.popitem(last=False)
+                self._memory_used -= len(dropped)
+                evicted += 1
+            self._entries[key] = data
+            self._memory_used += len(data)
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _disk_path(self, key: str) -> Path:
+        assert self.directory is not None
+        return Path(self.directory) / key[:2] / key
+
+    def _count(self, counter: str, amount: int = 1) -> None:
+        i = COUNTERS.index(counter)
+        with self.counters.get_lock():
+            self.counters[i] += amount
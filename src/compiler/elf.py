@@ -0,0 +1,70 @@
+"""Writes minimal static ELF64 executables for x86-64 Linux."""
+
+import struct
+
+BASE_ADDRESS = 0x400000
+
+_ELF_HEADER_SIZE = 64
+_PROGRAM_HEADER_SIZE = 56
+_PROGRAM_HEADER_COUNT = 2
+
+# Address where the code passed to `write_static_executable` is loaded.
+# The code immediately follows the headers in the same segment.
+TEXT_ADDRESS = (
+    BASE_ADDRESS + _ELF_HEADER_SIZE + _PROGRAM_HEADER_COUNT * _PROGRAM_HEADER_SIZE
+)
+
+_PT_LOAD = 1
+_PT_GNU_STACK = 0x6474E551
+_PF_X = 1
+_PF_W = 2
+_PF_R = 4
+
+
+def write_static_executable(code: bytes, entry: int) -> bytes:
+    """Returns an executable that maps `code` at `TEXT_ADDRESS`
+    and starts executing at address `entry`.
+
+    The whole file is mapped as one read-only, executable segment,
+    and a PT_GNU_STACK header asks for a non-executable stack.
+    There are no section headers or symbols.
+    """
+    file_size = TEXT_ADDRESS - BASE_ADDRESS + len(code)
+
+    elf_header = struct.pack(
+        "<4sBBBBB7xHHIQQQIHHHHHH",
+        b"\x7fELF",
+        2,  # 64-bit
+        1,  # little endian
+        1,  # ELF version
+        0,  # System V ABI
+        0,  # ABI version
+        2,  # ET_EXEC
+        0x3E,  # x86-64
+        1,  # ELF version
+        entry,
+        _ELF_HEADER_SIZE,  # program header table offset
+        0,  # section header table offset
+        0,  # flags
+        _ELF_HEADER_SIZE,
+        _PROGRAM_HEADER_SIZE,
+        _PROGRAM_HEADER_COUNT,
+        64,  # section header entry size
+        0,  # section header count
+        0,  # section name string table index
+    )
+    load_header = struct.pack(
+        "<IIQQQQQQ",
+        _PT_LOAD,
+        _PF_R | _PF_X,
+        0,  # file offset
+        BASE_ADDRESS,
+        BASE_ADDRESS,
+        file_size,
+        file_size,
+        0x1000,
+    )
+    stack_header = struct.pack(
+        "<IIQQQQQQ", _PT_GNU_STACK, _PF_R | _PF_W, 0, 0, 0, 0, 0, 16
+    )
+    return elf_header + load_header + stack_header + code
@@ -0,0 +1,744 @@
+"""A small in-process x86-64 assembler for AT&T syntax.
+
+It understands the subset of GNU assembler syntax that the assembly
+generator, the intrinsics and the stdlib produce, and encodes it straight
+into machine code. Anything outside that subset raises `EncodingError`,
+so callers can fall back to the real binutils.
+"""
+
+from dataclasses import dataclass
+import functools
+import re
+from typing import Callable
+
+from compiler.elf import TEXT_ADDRESS, write_static_executable
+
+
+class EncodingError(Exception):
+    """Raised for assembly the built-in encoder does not support."""
+
+
+_REGISTERS_64 = [
+    "rax",
+    "rcx",
+    "rdx",
+    "rbx",
+    "rsp",
+    "rbp",
+    "rsi",
+    "rdi",
+    *[f"r{i}" for i in range(8, 16)],
+]
+_REGISTERS_8 = [
+    "al",
+    "cl",
+    "dl",
+    "bl",
+    "spl",
+    "bpl",
+    "sil",
+    "dil",
+    *[f"r{i}b" for i in range(8, 16)],
+]
+
+_CONDITION_CODES = {
+    "o": 0,
+    "no": 1,
+    "b": 2,
+    "c": 2,
+    "nae": 2,
+    "ae": 3,
+    "nb": 3,
+    "nc": 3,
+    "e": 4,
+    "z": 4,
+    "ne": 5,
+    "nz": 5,
+    "be": 6,
+    "na": 6,
+    "a": 7,
+    "nbe": 7,
+    "s": 8,
+    "ns": 9,
+    "p": 10,
+    "pe": 10,
+    "np": 11,
+    "po": 11,
+    "l": 12,
+    "nge": 12,
+    "ge": 13,
+    "nl": 13,
+    "le": 14,
+    "ng": 14,
+    "g": 15,
+    "nle": 15,
+}
+
+# Opcode extensions of the classic two-operand ALU instructions.
+_ALU_OPS = {
+    "add": 0,
+    "or": 1,
+    "adc": 2,
+    "sbb": 3,
+    "and": 4,
+    "sub": 5,
+    "xor": 6,
+    "cmp": 7,
+}
+
+# (opcode for 8-bit operands, opcode for 64-bit operands, opcode extension)
+_UNARY_OPS = {
+    "inc": (0xFE, 0xFF, 0),
+    "dec": (0xFE, 0xFF, 1),
+    "not": (0xF6, 0xF7, 2),
+    "neg": (0xF6, 0xF7, 3),
+    "mul": (0xF6, 0xF7, 4),
+    "div": (0xF6, 0xF7, 6),
+    "idiv": (0xF6, 0xF7, 7),
+}
+
+_NO_OPERANDS = {
+    "cqto": b"\x48\x99",
+    "cqo": b"\x48\x99",
+    "ret": b"\xc3",
+    "syscall": b"\x0f\x05",
+    "leave": b"\xc9",
+    "nop": b"\x90",
+}
+
+_SUFFIX_SIZES = {"q": 64, "b": 8}
+
+_BASE_MNEMONICS = {
+    *_ALU_OPS,
+    *_UNARY_OPS,
+    "mov",
+    "movabs",
+    "lea",
+    "test",
+    "imul",
+    "push",
+    "pop",
+    "call",
+}
+
+
+# === Operands ===
+
+
+@dataclass(frozen=True)
+class Expr:
+    """A sum of signed terms: integers, symbol names or "." (the current address)."""
+
+    terms: tuple[tuple[int, int | str], ...]
+
+    def is_constant(self) -> bool:
+        return all(isinstance(term, int) for _, term in self.terms)
+
+    def evaluate(self, resolve: Callable[[str], int], dot: int) -> int:
+        total = 0
+        for sign, term in self.terms:
+            if isinstance(term, int):
+                value = term
+            elif term == ".":
+                value = dot
+            else:
+                value = resolve(term)
+            total += sign * value
+        return total
+
+
+@dataclass(frozen=True)
+class Reg:
+    num: int
+    size: int
+
+    @property
+    def needs_rex(self) -> bool:
+        # spl, bpl, sil and dil are only addressable with a REX prefix.
+        return self.size == 8 and 4 <= self.num < 8
+
+
+@dataclass(frozen=True)
+class Imm:
+    value: Expr
+
+
+@dataclass(frozen=True)
+class Mem:
+    disp: Expr
+    base: Reg | None
+    index: Reg | None
+    scale: int
+
+
+Operand = Reg | Imm | Mem
+
+_SYMBOL = r"[A-Za-z_.$][\w.$]*"
+_EXPR_TERM = re.compile(rf"\s*([+-]?)\s*(0x[0-9a-fA-F]+|\d+|{_SYMBOL})\s*")
+_MEM = re.compile(r"^(.*?)\(\s*(%\w+)?\s*(?:,\s*(%\w+)\s*(?:,\s*(\d+))?)?\s*\)$")
+
+
+def _parse_expr(text: str) -> Expr:
+    terms: list[tuple[int, int | str]] = []
+    pos = 0
+    text = text.strip()
+    if text == "":
+        raise EncodingError("empty expression")
+    while pos < len(text):
+        m = _EXPR_TERM.match(text, pos)
+        if m is None or (terms and m[1] == ""):
+            raise EncodingError(f"unsupported expression: {text}")
+        sign = -1 if m[1] == "-" else 1
+        atom = m[2]
+        if atom[0].isdigit():
+            terms.append((sign, int(atom, 0)))
+        else:
+            terms.append((sign, atom))
+        pos = m.end()
+    return Expr(tuple(terms))
+
+
+def _parse_register(text: str) -> Reg:
+    name = text.removeprefix("%")
+    if name in _REGISTERS_64:
+        return Reg(_REGISTERS_64.index(name), 64)
+    if name in _REGISTERS_8:
+        return Reg(_REGISTERS_8.index(name), 8)
+    raise EncodingError(f"unsupported register: {text}")
+
+
+def _parse_operand(text: str) -> Operand:
+    text = text.strip()
+    if text.startswith("%"):
+        return _parse_register(text)
+    if text.startswith("$"):
+        return Imm(_parse_expr(text[1:]))
+    if text.startswith("*"):
+        raise EncodingError(f"indirect operands are not supported: {text}")
+    m = _MEM.match(text)
+    if m is not None:
+        disp = _parse_expr(m[1]) if m[1].strip() else Expr(((1, 0),))
+        base = _parse_register(m[2]) if m[2] else None
+        index = _parse_register(m[3]) if m[3] else None
+        scale = int(m[4]) if m[4] else 1
+        if scale not in (1, 2, 4, 8):
+            raise EncodingError(f"invalid scale: {text}")
+        for r in (base, index):
+            if r is not None and r.size != 64:
+                raise EncodingError(f"invalid address register: {text}")
+        return Mem(disp, base, index, scale)
+    # A bare expression is an absolute memory reference,
+    # or a jump/call target.
+    return Mem(_parse_expr(text), None, None, 1)
+
+
+def _split_operands(text: str) -> list[str]:
+    operands: list[str] = []
+    depth = 0
+    current = ""
+    for c in text:
+        if c == "," and depth == 0:
+            operands.append(current)
+            current = ""
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        current += c
+    if current.strip():
+        operands.append(current)
+    return operands
+
+
+# === Encoding ===
+
+
+def _fits_int8(value: int) -> bool:
+    return -128 <= value < 128
+
+
+def _fits_int32(value: int) -> bool:
+    return -(2**31) <= value < 2**31
+
+
+def _int(value: int, size: int) -> bytes:
+    if size == 1 and not _fits_int8(value) and not 0 <= value < 256:
+        raise EncodingError(f"value does not fit in a byte: {value}")
+    if size == 4 and not _fits_int32(value):
+        raise EncodingError(f"value does not fit in 32 bits: {value}")
+    return (value & ((1 << (8 * size)) - 1)).to_bytes(size, "little")
+
+
+class _Encoder:
+    """Encodes single instructions at a known address."""
+
+    def __init__(self, resolve: Callable[[str], int], address: int) -> None:
+        self.resolve = resolve
+        self.address = address
+
+    def value(self, expr: Expr) -> int:
+        return expr.evaluate(self.resolve, self.address)
+
+    def modrm(self, reg: int, rm: Reg | Mem) -> tuple[int, bytes]:
+        """Returns the REX.RXB bits and the ModRM, SIB and displacement bytes."""
+        rex = 0x04 if reg & 8 else 0
+        reg_bits = (reg & 7) << 3
+        if isinstance(rm, Reg):
+            if rm.num & 8:
+                rex |= 0x01
+            return rex, bytes([0xC0 | reg_bits | (rm.num & 7)])
+
+        if rm.index is not None:
+            if rm.index.num == 4:
+                raise EncodingError("%rsp cannot be an index register")
+            if rm.index.num & 8:
+                rex |= 0x02
+        index_bits = (rm.index.num & 7 if rm.index is not None else 4) << 3
+        scale_bits = {1: 0, 2: 1, 4: 2, 8: 3}[rm.scale] << 6
+        disp = self.value(rm.disp)
+
+        if rm.base is None:
+            # Absolute address: SIB with no base and a 32-bit displacement.
+            # (ModRM.rm = 101 on its own would mean RIP-relative.)
+            return rex, bytes([0x04 | reg_bits, scale_bits | index_bits | 5]) + _int(
+                disp, 4
+            )
+
+        if rm.base.num & 8:
+            rex |= 0x01
+        base_low = rm.base.num & 7
+        if rm.disp.is_constant() and disp == 0 and base_low != 5:
+            mod, disp_bytes = 0x00, b""
+        elif rm.disp.is_constant() and _fits_int8(disp):
+            mod, disp_bytes = 0x40, _int(disp, 1)
+        else:
+            mod, disp_bytes = 0x80, _int(disp, 4)
+
+        if rm.index is not None or base_low == 4:
+            return (
+                rex,
+                bytes([mod | reg_bits | 4, scale_bits | index_bits | base_low])
+                + disp_bytes,
+            )
+        return rex, bytes([mod | reg_bits | base_low]) + disp_bytes
+
+    def instruction(
+        self,
+        opcode: bytes,
+        reg: int,
+        rm: Reg | Mem,
+        size: int,
+        tail: bytes = b"",
+        regs: tuple[Operand, ...] = (),
+    ) -> bytes:
+        """Encodes an instruction with a ModRM byte.
+
+        `size` is the operand size in bits; 64 sets REX.W.
+        `regs` lists register operands besides `rm` that may need a REX prefix.
+        """
+        rex_bits, modrm = self.modrm(reg, rm)
+        rex = rex_bits | (0x08 if size == 64 else 0)
+        needs_rex = any(isinstance(r, Reg) and r.needs_rex for r in (rm, *regs))
+        prefix = bytes([0x40 | rex]) if rex or needs_rex else b""
+        return prefix + opcode + modrm + tail
+
+    def immediate(self, imm: Imm, size: int) -> bytes:
+        return _int(self.value(imm.value), size)
+
+    def short_immediate(self, imm: Imm) -> bool:
+        # Symbolic immediates always get 32 bits, so that instruction sizes
+        # never depend on symbol values.
+        return imm.value.is_constant() and _fits_int8(self.value(imm.value))
+
+    def relative(self, target: Mem, size: int) -> bytes:
+        if target.base is not None or target.index is not None:
+            raise EncodingError("indirect jumps are not supported")
+        return _int(self.value(target.disp) - (self.address + size), 4)
+
+    def encode(self, mnemonic: str, operands: list[Operand]) -> bytes:
+        if mnemonic in _NO_OPERANDS and not operands:
+            return _NO_OPERANDS[mnemonic]
+
+        if mnemonic == "jmp":
+            target = _target(operands)
+            return b"\xe9" + self.relative(target, 5)
+        if mnemonic[0] == "j" and mnemonic[1:] in _CONDITION_CODES:
+            target = _target(operands)
+            cc = _CONDITION_CODES[mnemonic[1:]]
+            return bytes([0x0F, 0x80 | cc]) + self.relative(target, 6)
+        if mnemonic.startswith("set") and mnemonic[3:] in _CONDITION_CODES:
+            (dest,) = operands
+            if isinstance(dest, Imm) or (isinstance(dest, Reg) and dest.size != 8):
+                raise EncodingError(f"invalid operand for {mnemonic}")
+            cc = _CONDITION_CODES[mnemonic[3:]]
+            return self.instruction(bytes([0x0F, 0x90 | cc]), 0, dest, 8)
+        if mnemonic == "movzbq":
+            src, dest = operands
+            if not isinstance(dest, Reg) or dest.size != 64:
+                raise EncodingError("movzbq needs a 64-bit register destination")
+            if isinstance(src, Imm) or (isinstance(src, Reg) and src.size != 8):
+                raise EncodingError("movzbq needs an 8-bit source")
+            return self.instruction(b"\x0f\xb6", dest.num, src, 64, regs=(src,))
+
+        base, size = _split_mnemonic(mnemonic, operands)
+
+        if base == "call":
+            target = _target(operands)
+            return b"\xe8" + self.relative(target, 5)
+
+        if base in _ALU_OPS:
+            src, dest = operands
+            ext = _ALU_OPS[base]
+            if isinstance(dest, Imm):
+                raise EncodingError(f"immediate destination in {mnemonic}")
+            if isinstance(src, Imm):
+                if size == 8:
+                    return self.instruction(
+                        b"\x80", ext, dest, 8, self.immediate(src, 1)
+                    )
+                if self.short_immediate(src):
+                    return self.instruction(
+                        b"\x83", ext, dest, 64, self.immediate(src, 1)
+                    )
+                return self.instruction(b"\x81", ext, dest, 64, self.immediate(src, 4))
+            alu_opcode = ext * 8 + (1 if size == 64 else 0)
+            if isinstance(src, Reg):
+                return self.instruction(
+                    bytes([alu_opcode]), src.num, dest, size, regs=(src,)
+                )
+            if isinstance(dest, Reg):
+                return self.instruction(
+                    bytes([alu_opcode + 2]), dest.num, src, size, regs=(dest,)
+                )
+            raise EncodingError(f"two memory operands in {mnemonic}")
+
+        if base == "mov":
+            src, dest = operands
+            if isinstance(dest, Imm):
+                raise EncodingError("immediate destination in mov")
+            if isinstance(src, Imm):
+                if size == 8:
+                    return self.instruction(b"\xc6", 0, dest, 8, self.immediate(src, 1))
+                return self.instruction(b"\xc7", 0, dest, 64, self.immediate(src, 4))
+            if isinstance(src, Reg):
+                opcode = b"\x89" if size == 64 else b"\x88"
+                return self.instruction(opcode, src.num, dest, size, regs=(src,))
+            if isinstance(dest, Reg):
+                opcode = b"\x8b" if size == 64 else b"\x8a"
+                return self.instruction(opcode, dest.num, src, size, regs=(dest,))
+            raise EncodingError("two memory operands in mov")
+
+        if base == "movabs":
+            src, dest = operands
+            if not isinstance(src, Imm) or not isinstance(dest, Reg) or size != 64:
+                raise EncodingError("unsupported movabs form")
+            rex = 0x48 | (0x01 if dest.num & 8 else 0)
+            return bytes([rex, 0xB8 | (dest.num & 7)]) + _int(
+                self.value(src.value) & (2**64 - 1), 8
+            )
+
+        if base == "lea":
+            src, dest = operands
+            if not isinstance(src, Mem) or not isinstance(dest, Reg) or size != 64:
+                raise EncodingError("unsupported lea form")
+            return self.instruction(b"\x8d", dest.num, src, 64)
+
+        if base == "test":
+            src, dest = operands
+            if isinstance(dest, Imm):
+                raise EncodingError("immediate destination in test")
+            if isinstance(src, Imm):
+                if size == 8:
+                    return self.instruction(b"\xf6", 0, dest, 8, self.immediate(src, 1))
+                return self.instruction(b"\xf7", 0, dest, 64, self.immediate(src, 4))
+            if isinstance(src, Reg):
+                opcode = b"\x85" if size == 64 else b"\x84"
+                return self.instruction(opcode, src.num, dest, size, regs=(src,))
+            raise EncodingError("unsupported test form")
+
+        if base in _UNARY_OPS:
+            (dest,) = operands
+            if isinstance(dest, Imm):
+                raise EncodingError(f"immediate operand in {mnemonic}")
+            opcode8, opcode64, ext = _UNARY_OPS[base]
+            unary_opcode = opcode64 if size == 64 else opcode8
+            return self.instruction(bytes([unary_opcode]), ext, dest, size)
+
+        if base == "imul":
+            if size != 64:
+                raise EncodingError("only 64-bit imul is supported")
+            if len(operands) == 2 and isinstance(operands[0], Imm):
+                operands = [operands[0], operands[1], operands[1]]
+            if len(operands) == 2:
+                src, dest = operands
+                if not isinstance(dest, Reg) or isinstance(src, Imm):
+                    raise EncodingError("unsupported imul form")
+                return self.instruction(b"\x0f\xaf", dest.num, src, 64)
+            if len(operands) == 3:
+                imm, src, dest = operands
+                if (
+                    not isinstance(imm, Imm)
+                    or not isinstance(dest, Reg)
+                    or isinstance(src, Imm)
+                ):
+                    raise EncodingError("unsupported imul form")
+                if self.short_immediate(imm):
+                    return self.instruction(
+                        b"\x6b", dest.num, src, 64, self.immediate(imm, 1)
+                    )
+                return self.instruction(
+                    b"\x69", dest.num, src, 64, self.immediate(imm, 4)
+                )
+            raise EncodingError("unsupported imul form")
+
+        if base in ("push", "pop"):
+            (operand,) = operands
+            if size != 64:
+                raise EncodingError(f"only 64-bit {base} is supported")
+            if isinstance(operand, Reg):
+                prefix = b"\x41" if operand.num & 8 else b""
+                stack_opcode = 0x50 if base == "push" else 0x58
+                return prefix + bytes([stack_opcode | (operand.num & 7)])
+            if isinstance(operand, Imm):
+                if base == "pop":
+                    raise EncodingError("cannot pop into an immediate")
+                if self.short_immediate(operand):
+                    return b"\x6a" + self.immediate(operand, 1)
+                return b"\x68" + self.immediate(operand, 4)
+            # push and pop default to 64-bit operands without REX.W.
+            if base == "push":
+                return self.instruction(b"\xff", 6, operand, 32)
+            return self.instruction(b"\x8f", 0, operand, 32)
+
+        raise EncodingError(f"unsupported instruction: {mnemonic}")
+
+
+def _target(operands: list[Operand]) -> Mem:
+    if len(operands) != 1 or not isinstance(operands[0], Mem):
+        raise EncodingError("unsupported jump target")
+    return operands[0]
+
+
+def _split_mnemonic(mnemonic: str, operands: list[Operand]) -> tuple[str, int]:
+    """Splits a mnemonic into its base and operand size in bits."""
+    if mnemonic in _BASE_MNEMONICS:
+        base, suffix_size = mnemonic, None
+    elif mnemonic[:-1] in _BASE_MNEMONICS and mnemonic[-1] in _SUFFIX_SIZES:
+        base, suffix_size = mnemonic[:-1], _SUFFIX_SIZES[mnemonic[-1]]
+    else:
+        raise EncodingError(f"unsupported instruction: {mnemonic}")
+
+    if base in ("call", "push", "pop", "movabs", "lea"):
+        return base, suffix_size or 64
+
+    register_sizes = {op.size for op in operands if isinstance(op, Reg)}
+    if len(register_sizes) > 1:
+        raise EncodingError(f"mismatched operand sizes in {mnemonic}")
+    if suffix_size is not None:
+        if register_sizes and register_sizes != {suffix_size}:
+            raise EncodingError(f"operand size does not match suffix in {mnemonic}")
+        return base, suffix_size
+    if not register_sizes:
+        raise EncodingError(f"ambiguous operand size in {mnemonic}")
+    return base, register_sizes.pop()
+
+
+# === Assembly units ===
+
+
+@dataclass
+class _Instruction:
+    mnemonic: str
+    operands: list[Operand]
+    offset: int
+    size: int
+
+
+@dataclass
+class _Data:
+    data: bytes
+    offset: int
+
+
+@dataclass
+class _Assignment:
+    name: str
+    value: Expr
+    offset: int
+
+
+@dataclass
+class Unit:
+    """One parsed assembly source with instruction offsets laid out.
+
+    Labels are local to the unit unless declared with `.global`.
+    """
+
+    items: list[_Instruction | _Data | _Assignment]
+    labels: dict[str, int]
+    assignments: dict[str, _Assignment]
+    global_names: set[str]
+    size: int
+
+
+_LABEL = re.compile(rf"^\s*({_SYMBOL})\s*:")
+_ASSIGNMENT = re.compile(rf"^\s*({_SYMBOL})\s*=\s*(.+)$")
+_STRING_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "0": "\0"}
+
+
+def _strip_comment(line: str) -> str:
+    in_string = False
+    escaped = False
+    for i, c in enumerate(line):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "#":
+            return line[:i]
+    return line
+
+
+def _parse_string(text: str) -> bytes:
+    text = text.strip()
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        raise EncodingError(f"unsupported string: {text}")
+    result = ""
+    i = 1
+    while i < len(text) - 1:
+        c = text[i]
+        if c == "\\":
+            i += 1
+            if text[i] not in _STRING_ESCAPES:
+                raise EncodingError(f"unsupported escape in string: {text}")
+            c = _STRING_ESCAPES[text[i]]
+        result += c
+        i += 1
+    return result.encode()
+
+
+def _zero_resolver(name: str) -> int:
+    return 0
+
+
+@functools.lru_cache(maxsize=8)
+def parse_unit(source: str) -> Unit:
+    """Parses assembly source and computes the offset of every item.
+
+    Instruction sizes never depend on symbol values, so they can be
+    computed by encoding with every symbol set to zero.
+    """
+    items: list[_Instruction | _Data | _Assignment] = []
+    labels: dict[str, int] = {}
+    assignments: dict[str, _Assignment] = {}
+    global_names: set[str] = set()
+    offset = 0
+
+    for raw_line in source.splitlines():
+        line = _strip_comment(raw_line).strip()
+        while (m := _LABEL.match(line)) is not None:
+            labels[m[1]] = offset
+            line = line[m.end() :].strip()
+        if not line:
+            continue
+
+        if (m := _ASSIGNMENT.match(line)) is not None:
+            assignment = _Assignment(m[1], _parse_expr(m[2]), offset)
+            assignments[m[1]] = assignment
+            items.append(assignment)
+            continue
+
+        head, _, rest = line.partition(" ")
+        rest = rest.strip()
+        if head.startswith("."):
+            if head in (".global", ".globl"):
+                global_names.update(n.strip() for n in rest.split(","))
+            elif head in (".extern", ".type", ".text"):
+                pass
+            elif head == ".section":
+                if rest.split(",")[0].strip() != ".text":
+                    raise EncodingError(f"unsupported section: {rest}")
+            elif head in (".ascii", ".asciz"):
+                data = _parse_string(rest) + (b"\0" if head == ".asciz" else b"")
+                items.append(_Data(data, offset))
+                offset += len(data)
+            elif head in (".byte", ".quad"):
+                width = 1 if head == ".byte" else 8
+                data = b"".join(
+                    _int(_parse_expr(v).evaluate(_zero_resolver, 0), width)
+                    for v in rest.split(",")
+                )
+                items.append(_Data(data, offset))
+                offset += len(data)
+            else:
+                raise EncodingError(f"unsupported directive: {head}")
+            continue
+
+        operands = [_parse_operand(op) for op in _split_operands(rest)]
+        size = len(_Encoder(_zero_resolver, offset).encode(head, operands))
+        items.append(_Instruction(head, operands, offset, size))
+        offset += size
+
+    return Unit(items, labels, assignments, global_names, offset)
+
+
+def link(units: list[Unit], base_address: int) -> tuple[bytes, dict[str, int]]:
+    """Places the units one after another at `base_address` and encodes them.
+
+    Returns the machine code and the addresses of all global symbols.
+    """
+    unit_bases: list[int] = []
+    address = base_address
+    for unit in units:
+        address = (address + 15) & ~15
+        unit_bases.append(address)
+        address += unit.size
+
+    global_symbols: dict[str, int] = {}
+    for unit, unit_base in zip(units, unit_bases):
+        for name in unit.global_names:
+            if name in unit.labels:
+                if name in global_symbols:
+                    raise EncodingError(f"duplicate global symbol: {name}")
+                global_symbols[name] = unit_base + unit.labels[name]
+
+    code = bytearray()
+    for unit, unit_base in zip(units, unit_bases):
+        code += bytes(unit_base - base_address - len(code))
+
+        def resolve(name: str, unit: Unit = unit, unit_base: int = unit_base) -> int:
+            if name in unit.labels:
+                return unit_base + unit.labels[name]
+            if name in unit.assignments:
+                a = unit.assignments[name]
+                return a.value.evaluate(resolve, unit_base + a.offset)
+            if name in global_symbols:
+                return global_symbols[name]
+            raise EncodingError(f"undefined symbol: {name}")
+
+        for item in unit.items:
+            if isinstance(item, _Instruction):
+                encoded = _Encoder(resolve, unit_base + item.offset).encode(
+                    item.mnemonic, item.operands
+                )
+                assert len(encoded) == item.size
+                code += encoded
+            elif isinstance(item, _Data):
+                code += item.data
+
+    return bytes(code), global_symbols
+
+
+def assemble_executable(sources: list[str], entry: str = "_start") -> bytes:
+    """Assembles and links the given sources into a static ELF executable."""
+    units = [parse_unit(source) for source in sources]
+    code, symbols = link(units, TEXT_ADDRESS)
+    if entry not in symbols:
+        raise EncodingError(f"entry point {entry} not defined")
+    return write_static_executable(code, symbols[entry])
@@ -0,0 +1,186 @@
+"""Instruction selection for the assembly generator.
+
+`select_instructions` finds the patterns in the IR of a program that
+x86-64 has better instructions for than translating each IR
+instruction on its own:
+
+- A constant that fits in 32 bits and is only read where an immediate
+  operand is allowed isn't loaded at all. The instructions that read it
+  use it directly, as in 'addq $5, %rbx'.
+- A comparison whose result only chooses the branch of the CondJump
+  right after it sets the flags for a conditional jump, instead of
+  storing a bool to test.
+- `a + b * s`, where `s` is 2, 4 or 8, is a single 'leaq (a, b, s)'.
+- A call whose result is only copied to a variable right after it
+  computes the result into that variable, so that e.g. `x = x + 1` is
+  'addq $1' to where `x` is, even in memory.
+
+Variables that these patterns compute without storing them need no
+location, so the register allocator leaves them out.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+
+from compiler.intrinsics import comparison_conditions
+from compiler.ir import (
+    Call,
+    CondJump,
+    Copy,
+    Instruction,
+    IRVar,
+    LoadBoolConst,
+    LoadIntConst,
+    defined_variable,
+    used_variables,
+)
+
+# The scales of an index register that an address can have.
+# A scale of 1 is just an addition.
+_SCALES = (2, 4, 8)
+
+
+@dataclass
+class Address:
+    """`base + index * scale`, as computed by a 'leaq'."""
+
+    base: IRVar
+    index: IRVar
+    scale: int
+
+
+@dataclass
+class Selection:
+    """How `generate_assembly` emits the instructions of a program."""
+
+    # The value of each variable that is only read as an immediate
+    # operand. The instruction that loads it is left out.
+    immediates: dict[IRVar, int]
+    # The comparisons, by index, that are emitted together with the
+    # CondJump after them, which branches on their result.
+    fused_comparisons: set[int]
+    # The additions, by index, that are emitted as a 'leaq'.
+    addresses: dict[int, Address]
+    # The multiplications, by index, that are part of an address.
+    # They are left out.
+    folded: set[int]
+    # The calls, by index, whose result goes to the variable that the
+    # Copy after them assigns it to. The Copy is left out.
+    results: dict[int, IRVar]
+    # The variables that are never stored anywhere.
+    unallocated: set[IRVar]
+
+
+def select_instructions(instructions: list[Instruction]) -> Selection:
+    """Finds the patterns in `instructions` that have better instructions."""
+    definitions = Counter(
+        dest for insn in instructions if (dest := defined_variable(insn)) is not None
+    )
+    read_counts = Counter(var for insn in instructions for var in used_variables(insn))
+
+    def defined_once(var: IRVar) -> bool:
+        return definitions[var] == 1
+
+    constants: dict[IRVar, int] = {}
+    for insn in instructions:
+        if isinstance(insn, LoadIntConst) and -(2**31) <= insn.value < 2**31:
+            constants[insn.dest] = insn.value
+        elif isinstance(insn, LoadBoolConst):
+            constants[insn.dest] = int(insn.value)
+    constants = {var: value for var, value in constants.items() if defined_once(var)}
+
+    fused_comparisons = set()
+    for i, insn in enumerate(instructions[:-1]):
+        branch = instructions[i + 1]
+        if (
+            isinstance(insn, Call)
+            and insn.fun.name in comparison_conditions
+            and isinstance(branch, CondJump)
+            and branch.cond == insn.dest
+            and read_counts[insn.dest] == 1
+            and defined_once(insn.dest)
+        ):
+            fused_comparisons.add(i)
+
+    immediates = dict(constants)
+    for i, insn in enumerate(instructions):
+        match insn:
+            case CondJump():
+                immediates.pop(insn.cond, None)
+            case Call() if insn.fun.name in ("/", "%"):
+                # 'idivq' can't divide by an immediate.
+                immediates.pop(insn.args[1], None)
+            case Call() if i in fused_comparisons:
+                # 'cmpq' can compare an immediate to a register or memory,
+                # but not to another immediate.
+                left, right = insn.args
+                if left in immediates and right in immediates:
+                    del immediates[left]
+
+    # The instructions that emit nothing.
+    skipped = {
+        i
+        for i, insn in enumerate(instructions)
+        if isinstance(insn, (LoadIntConst, LoadBoolConst)) and insn.dest in immediates
+    }
+    products = {
+        insn.dest: i
+        for i, insn in enumerate(instructions)
+        if isinstance(insn, Call) and insn.fun.name == "*"
+    }
+
+    def scaled_index(var: IRVar, reader: int) -> tuple[int, IRVar, int] | None:
+        """Returns the multiplication by a scale that computes `var` for
+        `reader` only, with its index and scale.
+        """
+        j = products.get(var)
+        if j is None or j > reader or read_counts[var] != 1 or not defined_once(var):
+            return None
+        # The index must still hold its value at the reader, and the
+        # allocator must not see it die before then, so only skipped
+        # instructions may be in between.
+        if any(k not in skipped for k in range(j + 1, reader)):
+            return None
+        product = instructions[j]
+        assert isinstance(product, Call)
+        a, b = product.args
+        for index, scale in ((a, b), (b, a)):
+            if constants.get(scale) in _SCALES:
+                return j, index, constants[scale]
+        return None
+
+    addresses: dict[int, Address] = {}
+    folded: set[int] = set()
+    unallocated = set(immediates)
+    for i, insn in enumerate(instructions):
+        if not isinstance(insn, Call):
+            continue
+        if i in fused_comparisons:
+            unallocated.add(insn.dest)
+        elif insn.fun.name == "+":
+            left, right = insn.args
+            for base, product in ((left, right), (right, left)):
+                found = scaled_index(product, i)
+                if found is not None:
+                    j, index, scale = found
+                    addresses[i] = Address(base, index, scale)
+                    folded.add(j)
+                    unallocated.add(product)
+                    break
+
+    results: dict[int, IRVar] = {}
+    for i, insn in enumerate(instructions[:-1]):
+        copy = instructions[i + 1]
+        if (
+            isinstance(insn, Call)
+            and isinstance(copy, Copy)
+            and copy.source == insn.dest
+            and read_counts[insn.dest] == 1
+            and defined_once(insn.dest)
+        ):
+            results[i] = copy.dest
+            unallocated.add(insn.dest)
+
+    return Selection(
+        immediates, fused_comparisons, addresses, folded, results, unallocated
+    )
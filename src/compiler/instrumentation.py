@@ -0,0 +1,259 @@
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+import multiprocessing
+import threading
+import time
+import tracemalloc
+from typing import Any, ContextManager, Iterator
+
+# Stages of the compiler pipeline, in the order they run.
+# "ir" includes type checking, which is done in the same pass.
+# "total" covers the whole compilation, including cache lookups.
+STAGES = (
+    "tokenize",
+    "parse",
+    "ir",
+    "optimize",
+    "assembly",
+    "assemble",
+    "total",
+)
+
+# Histogram bucket i counts wall times below 2**i microseconds.
+# The last bucket also counts everything longer.
+_BUCKETS = 26
+# Per stage: count, total wall time (ns), total CPU time (ns), buckets.
+_STAGE_FIELDS = 3 + _BUCKETS
+
+
+@dataclass
+class StageTiming:
+    """Resources used by one stage of one compilation.
+
+    The CPU time includes the CPU time of the subprocesses ('as', 'ld')
+    the stage waited for, but not of other threads' subprocesses. The peak memory is the largest amount of memory
+    the stage allocated at once on top of what was allocated before it,
+    or None if memory was not tracked, or not on its own (see
+    `CompileProfile`).
+    """
+
+    stage: str
+    wall_time: float
+    cpu_time: float
+    peak_memory: int | None = None
+
+
+@dataclass(eq=False)
+class _OpenStage:
+    name: str
+    wall_start: float = 0.0
+    cpu_start: float = 0.0
+    memory_base: int = 0
+    peak_memory: int = 0
+    # Whether another profile had a stage open at the same time.
+    overlapped: bool = False
+
+
+# tracemalloc is process-wide and has a single peak counter, so all
+# profiles that track memory share them. tracemalloc runs while any of
+# them has a stage open, and a peak is credited to the open stages of
+# all of them before the counter is reset.
+_memory_lock = threading.Lock()
+_memory_stages: list[_OpenStage] = []
+# The number of profiles that have stages in _memory_stages.
+_memory_profiles = 0
+_started_tracemalloc = False
+
+
+# The CPU time of the subprocesses each thread has waited for.
+# os.times() only has the total of all threads' subprocesses.
+_children = threading.local()
+
+
+def add_child_cpu_time(seconds: float) -> None:
+    """Adds the CPU time of a subprocess the current thread waited for
+    to the stages open on this thread.
+    """
+    _children.cpu_time = getattr(_children, "cpu_time", 0.0) + seconds
+
+
+def _cpu_time() -> float:
+    return time.thread_time() + getattr(_children, "cpu_time", 0.0)
+
+
+class CompileProfile:
+    """Records a `StageTiming` for every stage of a compilation.
+
+    With `track_memory`, peak allocations are measured with tracemalloc,
+    which is started while any profile has a stage open if it isn't
+    running already. This makes compilation several times slower, so it
+    should only be enabled when asked for. tracemalloc can't tell apart
+    the allocations of different threads, so a stage that is open at the
+    same time as a stage of another profile gets no peak memory.
+    """
+
+    def __init__(self, track_memory: bool = False) -> None:
+        self.track_memory = track_memory
+        self.timings: list[StageTiming] = []
+        self._open: list[_OpenStage] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measures the code run inside the `with` block as stage `name`.
+
+        Stages may be nested. An outer stage's peak memory includes the
+        peaks of its inner stages.
+        """
+        stage = _OpenStage(name)
+        if self.track_memory:
+            _open_memory_stage(stage, first=not self._open)
+        stage.wall_start = time.perf_counter()
+        stage.cpu_start = _cpu_time()
+        self._open.append(stage)
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - stage.wall_start
+            cpu_time = _cpu_time() - stage.cpu_start
+            self._open.pop()
+            peak_memory: int | None = None
+            if self.track_memory:
+                peak_memory = _close_memory_stage(stage, last=not self._open)
+            self.timings.append(StageTiming(name, wall_time, cpu_time, peak_memory))
+
+    def to_json(self) -> list[dict[str, Any]]:
+        return [asdict(t) for t in self.timings]
+
+    def format(self) -> str:
+        lines = [f"{'stage':<10} {'wall ms':>9} {'cpu ms':>9} {'peak KiB':>9}"]
+        for t in self.timings:
+            peak = f"{t.peak_memory / 1024:9.1f}" if t.peak_memory is not None else ""
+            lines.append(
+                f"{t.stage:<10} {t.wall_time * 1000:9.3f} {t.cpu_time * 1000:9.3f} "
+                + f"{peak:>9}"
+            )
+        return "\n".join(lines)
+
+
+def _open_memory_stage(stage: _OpenStage, first: bool) -> None:
+    global _memory_profiles, _started_tracemalloc
+    with _memory_lock:
+        if first:
+            if _memory_profiles == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracemalloc = True
+            _memory_profiles += 1
+        _fold_peak_memory()
+        stage.memory_base = tracemalloc.get_traced_memory()[0]
+        _memory_stages.append(stage)
+        if _memory_profiles > 1:
+            for open_stage in _memory_stages:
+                open_stage.overlapped = True
+
+
+def _close_memory_stage(stage: _OpenStage, last: bool) -> int | None:
+    global _memory_profiles, _started_tracemalloc
+    with _memory_lock:
+        _fold_peak_memory()
+        _memory_stages.remove(stage)
+        if last:
+            _memory_profiles -= 1
+            if _memory_profiles == 0 and _started_tracemalloc:
+                tracemalloc.stop()
+                _started_tracemalloc = False
+    return None if stage.overlapped else stage.peak_memory
+
+
+def _fold_peak_memory() -> None:
+    # tracemalloc has only one peak counter, so the peak seen so far is
+    # credited to every open stage before the counter is reset.
+    _, peak = tracemalloc.get_traced_memory()
+    for stage in _memory_stages:
+        stage.peak_memory = max(stage.peak_memory, peak - stage.memory_base)
+    tracemalloc.reset_peak()
+
+
+def stage(profile: CompileProfile | None, name: str) -> ContextManager[None]:
+    """Returns `profile.stage(name)`, or a no-op if `profile` is None."""
+    if profile is None:
+        return nullcontext()
+    return profile.stage(name)
+
+
+class StageStats:
+    """Histograms of the wall time of each compiler stage.
+
+    Like the counters of `CompilationCache`, the histograms live in shared
+    memory, so every process forked from (or handed a pickled copy of)
+    the same object adds to and reports the same numbers.
+    """
+
+    def __init__(self, data: Any = None) -> None:
+        self.data = (
+            data
+            if data is not None
+            else multiprocessing.get_context("forkserver").Array(
+                "q", len(STAGES) * _STAGE_FIELDS
+            )
+        )
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        return (StageStats, (self.data,))
+
+    def record(self, profile: CompileProfile) -> None:
+        with self.data.get_lock():
+            for t in profile.timings:
+                if t.stage not in STAGES:
+                    continue
+                base = STAGES.index(t.stage) * _STAGE_FIELDS
+                microseconds = int(t.wall_time * 1_000_000)
+                bucket = min(microseconds.bit_length(), _BUCKETS - 1)
+                self.data[base] += 1
+                self.data[base + 1] += int(t.wall_time * 1e9)
+                self.data[base + 2] += int(t.cpu_time * 1e9)
+                self.data[base + 3 + bucket] += 1
+
+    def stats(self) -> dict[str, Any]:
+        """Returns the totals, estimated percentiles and histogram of
+        every stage that has run. Times are in seconds.
+
+        The histogram is a list of [upper bound, count] pairs of its
+        non-empty buckets, where an upper bound of None means unbounded.
+        Percentiles are the upper bounds of the buckets they fall into.
+        """
+        with self.data.get_lock():
+            data = self.data[:]
+        result: dict[str, Any] = {}
+        for i, name in enumerate(STAGES):
+            count, wall_ns, cpu_ns, *buckets = data[
+                i * _STAGE_FIELDS : (i + 1) * _STAGE_FIELDS
+            ]
+            if count == 0:
+                continue
+            result[name] = {
+                "count": count,
+                "wall_time": wall_ns / 1e9,
+                "cpu_time": cpu_ns / 1e9,
+                "p50": _percentile(buckets, count, 0.50),
+                "p90": _percentile(buckets, count, 0.90),
+                "p99": _percentile(buckets, count, 0.99),
+                "histogram": [
+                    [_bucket_bound(b), n] for b, n in enumerate(buckets) if n > 0
+                ],
+            }
+        return result
+
+
+def _bucket_bound(bucket: int) -> float | None:
+    if bucket == _BUCKETS - 1:
+        return None
+    return 2**bucket / 1_000_000
+
+
+def _percentile(buckets: list[int], count: int, fraction: float) -> float | None:
+    seen = 0
+    for bucket, n in enumerate(buckets):
+        seen += n
+        if seen >= fraction * count:
+            return _bucket_bound(bucket)
+    return None
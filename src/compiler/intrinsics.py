@@ -4,7 +4,10 @@ from typing import Callable
 
 @dataclass
 class IntrinsicArgs:
+    # Each argument is in a register, in memory or, where the intrinsic
+    # allows it, an immediate ("$5").
     arg_refs: list[str]
+    # May be the register of an argument.
     result_register: str
     emit: Callable[[str], None]
 
@@ -25,51 +28,102 @@ def _intrinsic(name: str) -> Callable[[Intrinsic], Intrinsic]:
     return wrapper
 
 
+def _is_register(ref: str) -> bool:
+    return ref.startswith("%")
+
+
+def _immediate(ref: str) -> int | None:
+    return int(ref[1:]) if ref.startswith("$") else None
+
+
+def _in_memory(ref: str) -> bool:
+    return not ref.startswith(("%", "$"))
+
+
 @_intrinsic("unary_-")
 def unary_minus(a: IntrinsicArgs) -> None:
-    a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
+    if a.result_register != a.arg_refs[0]:
+        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
     a.emit(f"negq {a.result_register}")
 
 
 @_intrinsic("unary_not")
 def unary_not(a: IntrinsicArgs) -> None:
-    a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
+    if a.result_register != a.arg_refs[0]:
+        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
     a.emit(f"xorq $1, {a.result_register}")
 
 
+def _commutative(a: IntrinsicArgs, insn: str) -> None:
+    x, y = a.arg_refs
+    if a.result_register == y:
+        x, y = y, x
+    if a.result_register != x:
+        a.emit(f"movq {x}, {a.result_register}")
+    a.emit(f"{insn} {y}, {a.result_register}")
+
+
 @_intrinsic("+")
 def plus(a: IntrinsicArgs) -> None:
-    if a.result_register != a.arg_refs[0]:
-        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
-    a.emit(f"addq {a.arg_refs[1]}, {a.result_register}")
+    x, y = a.arg_refs
+    r = a.result_register
+    if r not in (x, y):
+        # 'leaq' adds into another register without a 'movq' first.
+        if _is_register(x) and _is_register(y):
+            a.emit(f"leaq ({x},{y}), {r}")
+            return
+        for base, offset in ((x, y), (y, x)):
+            if _is_register(base) and _immediate(offset) is not None:
+                a.emit(f"leaq {_immediate(offset)}({base}), {r}")
+                return
+    _commutative(a, "addq")
 
 
 @_intrinsic("or")
 def intor(a: IntrinsicArgs) -> None:
-    if a.result_register != a.arg_refs[0]:
-        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
-    a.emit(f"or {a.result_register}, {a.arg_refs[1]}")
+    _commutative(a, "orq")
 
 
 @_intrinsic("and")
 def intand(a: IntrinsicArgs) -> None:
-    if a.result_register != a.arg_refs[0]:
-        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
-    a.emit(f"and {a.result_register}, {a.arg_refs[1]}")
+    _commutative(a, "andq")
 
 
 @_intrinsic("-")
 def minus(a: IntrinsicArgs) -> None:
-    if a.result_register != a.arg_refs[0]:
-        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
-    a.emit(f"subq {a.arg_refs[1]}, {a.result_register}")
+    x, y = a.arg_refs
+    r = a.result_register
+    offset = _immediate(y)
+    if r == x:
+        a.emit(f"subq {y}, {r}")
+    elif r == y:
+        # x - y = -y + x
+        a.emit(f"negq {r}")
+        a.emit(f"addq {x}, {r}")
+    elif _is_register(x) and offset is not None and offset != -(2**31):
+        a.emit(f"leaq {-offset}({x}), {r}")
+    else:
+        a.emit(f"movq {x}, {r}")
+        a.emit(f"subq {y}, {r}")
 
 
 @_intrinsic("*")
 def multiply(a: IntrinsicArgs) -> None:
-    if a.result_register != a.arg_refs[0]:
-        a.emit(f"movq {a.arg_refs[0]}, {a.result_register}")
-    a.emit(f"imulq {a.arg_refs[1]}, {a.result_register}")
+    x, y = a.arg_refs
+    r = a.result_register
+    if _immediate(x) is not None and _immediate(y) is None:
+        x, y = y, x
+    factor = _immediate(y)
+    if factor is None or _immediate(x) is not None:
+        _commutative(a, "imulq")
+    elif _is_register(x) and factor in (2, 3, 5, 9):
+        # x * 3 = x + x * 2
+        scale = factor - 1
+        a.emit(f"leaq ({x},{x},{scale}), {r}")
+    elif _is_register(x) and factor in (4, 8):
+        a.emit(f"leaq (,{x},{factor}), {r}")
+    else:
+        a.emit(f"imulq {y}, {x}, {r}")
 
 
 @_intrinsic("/")
@@ -91,6 +145,17 @@ def remainder(a: IntrinsicArgs) -> None:
         a.emit(f"movq %rdx, {a.result_register}")
 
 
+# The condition code ('e' as in 'sete' or 'je') of each comparison.
+comparison_conditions = {
+    "==": "e",
+    "!=": "ne",
+    "<": "l",
+    "<=": "le",
+    ">": "g",
+    ">=": "ge",
+}
+
+
 @_intrinsic("==")
 def eq(a: IntrinsicArgs) -> None:
     _int_comparison(a, "sete")
@@ -124,8 +189,12 @@ def ge(a: IntrinsicArgs) -> None:
 def _int_comparison(a: IntrinsicArgs, setcc_insn: str) -> None:
     # We use 'al' and 'eax' below, which means the lower bytes of 'rax'
     a.emit("xor %rax, %rax")  # Clear all bits of rax
-    a.emit(f"movq {a.arg_refs[0]}, %rdx")
-    a.emit(f"cmpq {a.arg_refs[1]}, %rdx")
+    left, right = a.arg_refs
+    # 'cmpq' can't compare to an immediate, or memory to memory.
+    if _immediate(left) is not None or (_in_memory(left) and _in_memory(right)):
+        a.emit(f"movq {left}, %rdx")
+        left = "%rdx"
+    a.emit(f"cmpq {right}, {left}")
     # Set lowest byte of 'rax' to comparison result
     a.emit(f"{setcc_insn} %al")
     if a.result_register != "%rax":
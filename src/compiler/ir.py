@@ -1,5 +1,5 @@
-from dataclasses import dataclass, fields
-from typing import Any, Self
+from dataclasses import dataclass, field, fields
+from typing import Any
 
 from compiler.tokenizer import Location
 
@@ -12,23 +12,6 @@ class IRVar:
         return self.name
 
 
-@dataclass
-class SymTab:
-    parent: None | Self
-    locals: dict[str, IRVar]
-
-    def require(self, str: str) -> IRVar:
-        mVar: IRVar | None = self.locals.get(str, None)
-        par = self.parent
-        while mVar is None and par is not None:
-            mVar = par.locals.get(str, None)
-            par = par.parent
-
-        if mVar is None:
-            raise Exception(f"IR Symtab Error: Could not find {str} in symtab")
-        return mVar
-
-
 @dataclass(frozen=True)
 class Instruction:
     location: Location
@@ -103,3 +86,219 @@ class CondJump(Instruction):
     cond: IRVar
     then_label: Label
     else_label: Label
+
+
+def defined_variable(insn: Instruction) -> IRVar | None:
+    """Returns the variable that `insn` assigns, if any."""
+    match insn:
+        case LoadIntConst() | LoadBoolConst() | Copy() | Call():
+            return insn.dest
+    return None
+
+
+def used_variables(insn: Instruction) -> list[IRVar]:
+    """Returns the variables whose values `insn` reads."""
+    match insn:
+        case Copy():
+            return [insn.source]
+        case Call():
+            return insn.args
+        case CondJump():
+            return [insn.cond]
+    return []
+
+
+@dataclass(eq=False)
+class BasicBlock:
+    """A sequence of instructions that only runs from start to end.
+
+    Only the start of a block can be jumped to: `label` is the block's
+    label, or None for a block that is only reached by falling through
+    (or not at all). Only the last instruction can be a Jump or CondJump.
+    A block that doesn't end in one falls through to the next block in
+    the graph's order, or out of the program if it is the last block.
+
+    `instructions` doesn't include the label.
+    """
+
+    label: Label | None
+    instructions: list[Instruction] = field(default_factory=list)
+    successors: list["BasicBlock"] = field(default_factory=list)
+    predecessors: list["BasicBlock"] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return self.label.name if self.label is not None else f"<block {id(self)}>"
+
+
+@dataclass(eq=False)
+class NaturalLoop:
+    """A loop: the blocks from which `header` can be reached again
+    without leaving the loop. Every block of the loop is dominated by
+    the header, and `blocks` includes it.
+    """
+
+    header: BasicBlock
+    blocks: set[BasicBlock]
+    # The blocks inside the loop that jump back to the header.
+    latches: list[BasicBlock]
+
+
+class ControlFlowGraph:
+    """The basic blocks of a program and the jumps between them.
+
+    `blocks` are in program order, and the first one is the entry.
+    Converting a list of instructions to a graph and back gives the same
+    list, so passes can work on either form.
+    """
+
+    def __init__(self, blocks: list[BasicBlock]) -> None:
+        self.blocks = blocks
+        self.link()
+
+    @staticmethod
+    def from_instructions(instructions: list[Instruction]) -> "ControlFlowGraph":
+        blocks: list[BasicBlock] = []
+        current: BasicBlock | None = None
+        for insn in instructions:
+            if isinstance(insn, Label):
+                current = BasicBlock(insn)
+                blocks.append(current)
+                continue
+            if current is None:
+                current = BasicBlock(None)
+                blocks.append(current)
+            current.instructions.append(insn)
+            if isinstance(insn, (Jump, CondJump)):
+                current = None
+        if not blocks:
+            blocks.append(BasicBlock(None))
+        return ControlFlowGraph(blocks)
+
+    def to_instructions(self) -> list[Instruction]:
+        instructions: list[Instruction] = []
+        for block in self.blocks:
+            if block.label is not None:
+                instructions.append(block.label)
+            instructions.extend(block.instructions)
+        return instructions
+
+    @property
+    def entry(self) -> BasicBlock:
+        return self.blocks[0]
+
+    def link(self) -> None:
+        """Computes the successors and predecessors of every block from
+        the jumps at their ends. Passes that change the blocks or their
+        jumps call this afterwards.
+        """
+        by_label = {b.label.name: b for b in self.blocks if b.label is not None}
+        for block in self.blocks:
+            block.successors = []
+            block.predecessors = []
+        for i, block in enumerate(self.blocks):
+            last = block.instructions[-1] if block.instructions else None
+            match last:
+                case Jump():
+                    targets = [by_label[last.label.name]]
+                case CondJump():
+                    targets = [
+                        by_label[last.then_label.name],
+                        by_label[last.else_label.name],
+                    ]
+                case _:
+                    targets = self.blocks[i + 1 : i + 2]
+            for target in targets:
+                if target not in block.successors:
+                    block.successors.append(target)
+                    target.predecessors.append(block)
+
+    def reverse_postorder(self) -> list[BasicBlock]:
+        """Returns the blocks reachable from the entry, each one before
+        its successors except along loops' back edges.
+        """
+        order: list[BasicBlock] = []
+        visited = {self.entry}
+        stack = [(self.entry, iter(self.entry.successors))]
+        while stack:
+            block, successors = stack[-1]
+            for succ in successors:
+                if succ not in visited:
+                    visited.add(succ)
+                    stack.append((succ, iter(succ.successors)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def immediate_dominators(self) -> dict[BasicBlock, BasicBlock]:
+        """Maps each reachable block to its immediate dominator, the
+        closest block that every path from the entry to it passes through.
+        The entry maps to itself.
+
+        Uses the algorithm of Cooper, Harvey and Kennedy,
+        "A Simple, Fast Dominance Algorithm".
+        """
+        order = self.reverse_postorder()
+        index = {block: i for i, block in enumerate(order)}
+        idom: dict[BasicBlock, BasicBlock] = {self.entry: self.entry}
+
+        def intersect(a: BasicBlock, b: BasicBlock) -> BasicBlock:
+            while a is not b:
+                while index[a] > index[b]:
+                    a = idom[a]
+                while index[b] > index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in order[1:]:
+                new_idom: BasicBlock | None = None
+                for pred in block.predecessors:
+                    if pred in idom:
+                        new_idom = (
+                            pred if new_idom is None else intersect(pred, new_idom)
+                        )
+                assert new_idom is not None
+                if idom.get(block) is not new_idom:
+                    idom[block] = new_idom
+                    changed = True
+        return idom
+
+    def dominators(self) -> dict[BasicBlock, set[BasicBlock]]:
+        """Maps each reachable block to the set of blocks that dominate it,
+        including itself.
+        """
+        idom = self.immediate_dominators()
+        result: dict[BasicBlock, set[BasicBlock]] = {}
+        for block in self.reverse_postorder():
+            parent = idom[block]
+            result[block] = {block} | (result[parent] if parent is not block else set())
+        return result
+
+    def loops(self) -> list[NaturalLoop]:
+        """Finds the natural loops, one per loop header, in program order.
+        A loop nested in another is listed separately, and its blocks are
+        also blocks of the outer loop.
+        """
+        dominators = self.dominators()
+        loops: dict[BasicBlock, NaturalLoop] = {}
+        for block in dominators:
+            for succ in block.successors:
+                if succ not in dominators[block]:
+                    continue
+                # 'block' -> 'succ' is a back edge.
+                loop = loops.setdefault(succ, NaturalLoop(succ, {succ}, []))
+                loop.latches.append(block)
+                stack = [block]
+                while stack:
+                    b = stack.pop()
+                    if b not in loop.blocks:
+                        loop.blocks.add(b)
+                        stack.extend(p for p in b.predecessors if p in dominators)
+        position = {block: i for i, block in enumerate(self.blocks)}
+        return sorted(loops.values(), key=lambda loop: position[loop.header])
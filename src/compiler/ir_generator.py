@@ -1,7 +1,12 @@
 from compiler import ast
+from compiler import trace
 from compiler.ir import *
+from compiler import type_checker
+from compiler import types
 from compiler.types import Bool, Int, Type, Unit, FunType
+from compiler.resolver import GLOBAL, resolve
 from compiler.tokenizer import L
+from compiler.traversal import Visit, run
 
 root_types: dict[IRVar, Type] = {
     IRVar("or"): FunType([Bool(), Bool()], Bool()),
@@ -10,6 +15,9 @@ root_types: dict[IRVar, Type] = {
     IRVar("-"): FunType([Int(), Int()], Int()),
     IRVar("/"): FunType([Int(), Int()], Int()),
     IRVar("*"): FunType([Int(), Int()], Int()),
+    IRVar("%"): FunType([Int(), Int()], Int()),
+    IRVar("=="): FunType([types.Any(), types.Any()], Bool()),
+    IRVar("!="): FunType([types.Any(), types.Any()], Bool()),
     IRVar("<="): FunType([Int(), Int()], Bool()),
     IRVar(">="): FunType([Int(), Int()], Bool()),
     IRVar("<"): FunType([Int(), Int()], Bool()),
@@ -27,7 +35,14 @@ def generate_ir(
     # like 'print_int' and '+' to their types.
     root_types: dict[IRVar, Type],
     root_expr: ast.Expression,
+    check_types: bool = False,
 ) -> list[Instruction]:
+    """Generates IR for `root_expr`, which must have been typechecked.
+
+    With `check_types`, the type checking is done in the same walk over
+    the AST: this sets the type of every node and raises the same errors
+    as `typecheck` with the types of 'root_types' as globals.
+    """
     var_types: dict[IRVar, Type] = root_types.copy()
 
     # 'var_unit' is used when an expression's type is 'Unit'.
@@ -57,15 +72,37 @@ def generate_ir(
     # and returns the IR variable where
     # the emitted IR instructions put the result.
     #
-    # It uses a symbol table to map local variables
-    # (which may be shadowed) to unique IR variables.
-    # The symbol table will be updated in the same way as
-    # in the interpreter and type checker.
-    def visit(st: SymTab, expr: ast.Expression) -> IRVar:
+    # It's a generator driven by 'run', so that deep ASTs don't
+    # hit the recursion limit: visiting a child node is written
+    # as '(yield visit(...))'.
+    #
+    # Names were resolved by the type checker. Globals map to IR
+    # variables of the same name; in the Assembly generator stage,
+    # we will give definitions for them. Each declared variable gets
+    # a fresh IR variable, stored in 'variables' at its symbol.
+    globals = {v.name: v for v in root_types.keys()}
+    variables: list[IRVar] = []
+
+    # With 'check_types', the types of the variables, by symbol.
+    env: type_checker.TypeEnv | None = None
+    if check_types:
+        variable_count = resolve(root_expr)
+        env = type_checker.TypeEnv(
+            {v.name: t for v, t in root_types.items()}, [Unit()] * variable_count
+        )
+
+    def lookup(identifier: ast.Identifier) -> IRVar:
+        if identifier.symbol == GLOBAL:
+            return globals[identifier.name]
+        return variables[identifier.symbol]
+
+    def visit(expr: ast.Expression) -> Visit[IRVar]:
         loc = expr.location
 
         match expr:
             case ast.Literal():
+                if env is not None:
+                    expr.type = type_checker.literal_type(expr)
                 # Create an IR variable to hold the value,
                 # and emit the correct instruction to
                 # load the constant value.
@@ -90,41 +127,70 @@ def generate_ir(
             case ast.Identifier():
                 # Look up the IR variable that corresponds to
                 # the source code variable.
-                return st.require(expr.name)
+                if env is not None:
+                    expr.type = type_checker.identifier_type(expr, env.lookup(expr))
+                return lookup(expr)
 
             case ast.VarDeclaration():
-                var = visit(st, expr.expression)
-                st.locals[expr.identifier.name] = var
+                var_value = yield visit(expr.expression)
+                if env is not None:
+                    env.declare(expr.identifier, expr.expression.type)
+                    expr.identifier.type = expr.expression.type
+                    expr.type = expr.expression.type
+                var = new_var(expr.expression.type)
+                ins.append(Copy(loc, var_value, var))
+                symbol = expr.identifier.symbol
+                variables.extend([var_unit] * (symbol + 1 - len(variables)))
+                variables[symbol] = var
                 return var
 
-            case ast.BinaryOp():
-                # Ask the symbol table to return the variable that refers
-                # to the operator to call.
-                var_op = st.require(expr.op)
-                # Recursively emit instructions to calculate the operands.
-                var_left = visit(st, expr.left)
-                if expr.op == "or":
-                    if expr.left == ast.Literal(L, True, type=Bool()):
-                        var_result = var_left
-                    else:
-                        var_result = visit(st, expr.right)
-                elif expr.op == "and":
-                    if expr.left == ast.Literal(L, False, type=Bool()):
-                        var_result = var_left
-                    else:
-                        var_result = visit(st, expr.right)
+            case ast.BinaryOp(op="and" | "or"):
+                # The right side is only evaluated if the left side
+                # doesn't decide the result.
+                l_right = new_label()
+                l_end = new_label()
+
+                var_left = yield visit(expr.left)
+                var_result = new_var(Bool())
+                ins.append(Copy(loc, var_left, var_result))
+                if expr.op == "and":
+                    ins.append(CondJump(loc, var_left, l_right, l_end))
                 else:
-                    var_right = visit(st, expr.right)
-                    # Generate variable to hold the result.
-                    var_result = new_var(expr.type)
-                    # Emit a Call instruction that writes to that variable.
-                    ins.append(Call(loc, var_op, [var_left, var_right], var_result))
+                    ins.append(CondJump(loc, var_left, l_end, l_right))
+
+                ins.append(l_right)
+                var_right = yield visit(expr.right)
+                if env is not None:
+                    expr.type = type_checker.binary_type(
+                        expr, env.globals.get(expr.op), expr.left.type, expr.right.type
+                    )
+                ins.append(Copy(loc, var_right, var_result))
+
+                ins.append(l_end)
+                return var_result
 
+            case ast.BinaryOp():
+                # Recursively emit instructions to calculate the operands.
+                var_left = yield visit(expr.left)
+                var_right = yield visit(expr.right)
+                if env is not None:
+                    expr.type = type_checker.binary_type(
+                        expr, env.globals.get(expr.op), expr.left.type, expr.right.type
+                    )
+
+                # Generate variable to hold the result.
+                var_result = new_var(expr.type)
+                # Emit a Call instruction that writes to that variable.
+                ins.append(
+                    Call(loc, globals[expr.op], [var_left, var_right], var_result)
+                )
                 return var_result
 
             case ast.UnaryOp():
-                var_op = st.require("unary_" + expr.op)
-                var_arg = visit(st, expr.parameter)
+                var_op = globals["unary_" + expr.op]
+                var_arg = yield visit(expr.parameter)
+                if env is not None:
+                    expr.type = type_checker.unary_type(expr, expr.parameter.type)
 
                 var_result = new_var(expr.type)
                 ins.append(Call(loc, var_op, [var_arg], var_result))
@@ -136,13 +202,17 @@ def generate_ir(
                     l_then = new_label()
                     l_end = new_label()
 
-                    var_cond = visit(st, expr.condition)
+                    var_cond = yield visit(expr.condition)
+                    if env is not None:
+                        type_checker.check_branch_condition(expr, expr.condition.type)
 
                     ins.append(CondJump(loc, var_cond, l_then, l_end))
 
                     ins.append(l_then)
 
-                    visit(st, expr.then)
+                    yield visit(expr.then)
+                    if env is not None:
+                        expr.type = expr.then.type
 
                     ins.append(l_end)
 
@@ -151,22 +221,30 @@ def generate_ir(
                     l_then = new_label()
                     l_otherwise = new_label()
                     l_end = new_label()
-                    var_res = new_var(expr.then.type)
+                    # The type of the result is known once 'then' is visited.
+                    var_res = new_var(Unit())
 
-                    var_cond = visit(st, expr.condition)
+                    var_cond = yield visit(expr.condition)
+                    if env is not None:
+                        type_checker.check_branch_condition(expr, expr.condition.type)
 
                     ins.append(CondJump(loc, var_cond, l_then, l_otherwise))
 
                     ins.append(l_then)
 
-                    var_then = visit(st, expr.then)
+                    var_then = yield visit(expr.then)
+                    var_types[var_res] = expr.then.type
                     ins.append(Copy(loc, var_then, var_res))
 
                     ins.append(Jump(loc, l_end))
 
                     ins.append(l_otherwise)
 
-                    var_otherwise = visit(st, expr.otherwise)
+                    var_otherwise = yield visit(expr.otherwise)
+                    if env is not None:
+                        expr.type = type_checker.branch_type(
+                            expr, expr.then.type, expr.otherwise.type
+                        )
                     ins.append(Copy(loc, var_otherwise, var_res))
 
                     ins.append(l_end)
@@ -178,15 +256,19 @@ def generate_ir(
                 l_start = new_label()
                 l_end = new_label()
 
-                var_cond = visit(st, expr.condition)
-
+                # The condition is evaluated again on every iteration.
                 ins.append(l_check_cond)
 
+                var_cond = yield visit(expr.condition)
+                if env is not None:
+                    type_checker.check_loop_condition(expr, expr.condition.type)
+                    expr.type = Unit()
+
                 ins.append(CondJump(loc, var_cond, l_start, l_end))
 
                 ins.append(l_start)
 
-                visit(st, expr.loop)
+                yield visit(expr.loop)
 
                 ins.append(Jump(loc, l_check_cond))
 
@@ -197,23 +279,41 @@ def generate_ir(
             case ast.Block():
                 final_var = var_unit
                 for exp in expr.expressions:
-                    print(f"looking at {exp}")
-                    final_var = visit(st, exp) if exp is not None else var_unit
-                    print(f"type is: {var_types[final_var]}")
+                    final_var = (yield visit(exp)) if exp is not None else var_unit
+                    if trace.on.ir:
+                        trace.emit("ir", f"{exp} : {var_types[final_var]}")
+                if env is not None:
+                    last = expr.expressions[-1] if expr.expressions else None
+                    expr.type = last.type if last is not None else Unit()
                 return final_var
 
             case ast.Assignment():
-                target = st.require(expr.identifier.name)
-
-                right_side = visit(st, expr.expression)
+                if env is not None:
+                    expr.identifier.type = type_checker.identifier_type(
+                        expr.identifier, env.lookup(expr.identifier)
+                    )
+                target = lookup(expr.identifier)
+
+                right_side = yield visit(expr.expression)
+                if env is not None:
+                    expr.type = type_checker.assignment_type(
+                        expr, expr.identifier.type, expr.expression.type
+                    )
 
                 ins.append(Copy(loc, right_side, target))
+                return target
 
             case ast.FuncCall():
-                var_fun = st.require(expr.identifier.name)
                 arg_vars = []
                 for arg in expr.arguments:
-                    arg_vars.append(visit(st, arg))
+                    arg_vars.append((yield visit(arg)))
+                if env is not None:
+                    expr.type = type_checker.call_type(
+                        expr,
+                        env.lookup(expr.identifier),
+                        [arg.type for arg in expr.arguments],
+                    )
+                var_fun = lookup(expr.identifier)
 
                 res_var = new_var(expr.type)
 
@@ -225,28 +325,11 @@ def generate_ir(
 
         # Other AST node cases (see below)
 
-    # Convert 'root_types' into a SymTab
-    # that maps all available global names to
-    # IR variables of the same name.
-    # In the Assembly generator stage, we will give
-    # definitions for these globals. For now,
-    # they just need to exist.
-    root_symtab = SymTab(parent=None, locals={})
-    for v in root_types.keys():
-        root_symtab.locals[v.name] = v
-
-    root_symtab.locals["=="] = IRVar("==")
-    root_symtab.locals["!="] = IRVar("!=")
-
     # Start visiting the AST from the root.
-    var_final_result = visit(root_symtab, root_expr)
+    var_final_result = run(visit(root_expr))
 
-    if var_types[var_final_result] == Int():
-        ins.append(
-            Call(L, root_symtab.require("print_int"), [var_final_result], var_unit)
-        )
-    elif var_types[var_final_result] == Bool():
-        ins.append(
-            Call(L, root_symtab.require("print_bool"), [var_final_result], var_unit)
-        )
+    if var_types[var_final_result] is Int():
+        ins.append(Call(L, globals["print_int"], [var_final_result], var_unit))
+    elif var_types[var_final_result] is Bool():
+        ins.append(Call(L, globals["print_bool"], [var_final_result], var_unit))
     return ins
@@ -0,0 +1,500 @@
+"""Optimizations of the IR.
+
+Each pass works on a `ControlFlowGraph` in place. `optimize` runs all of
+them on a list of instructions.
+"""
+
+from collections import Counter
+from dataclasses import replace
+import heapq
+
+from compiler.ir import (
+    BasicBlock,
+    Call,
+    CondJump,
+    ControlFlowGraph,
+    Copy,
+    Instruction,
+    IRVar,
+    Jump,
+    LoadBoolConst,
+    LoadIntConst,
+    defined_variable,
+    used_variables,
+)
+
+
+def optimize(instructions: list[Instruction]) -> list[Instruction]:
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    propagate_constants(cfg)
+    propagate_copies(cfg)
+    eliminate_dead_code(cfg)
+    return cfg.to_instructions()
+
+
+# A value known at compile time.
+Constant = int | bool
+
+
+class _Varying:
+    """The value of a variable that isn't a compile-time constant."""
+
+    def __repr__(self) -> str:
+        return "VARYING"
+
+
+VARYING = _Varying()
+
+# What is known about the value of a variable.
+Value = Constant | _Varying
+# The variables that are known to be constants at some point of the
+# program. Variables that aren't in it can have any value.
+State = dict[IRVar, Constant]
+
+
+def _wrap(value: int) -> int:
+    """Wraps `value` to a signed 64-bit integer, like the machine does."""
+    return (value + 2**63) % 2**64 - 2**63
+
+
+def _divide(a: int, b: int) -> int:
+    # 'idivq' rounds towards zero.
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+
+def fold_call(fun: str, args: list[Constant]) -> Constant | None:
+    """Returns the result of the built-in `fun` with constant arguments,
+    or None if it can't be computed at compile time.
+
+    Division by zero and division overflow are left for the program to
+    trap on at runtime.
+    """
+    match fun, args:
+        case "unary_-", [int(a)]:
+            return _wrap(-a)
+        case "unary_not", [bool(a)]:
+            return not a
+        case "and", [bool(a), bool(b)]:
+            return a and b
+        case "or", [bool(a), bool(b)]:
+            return a or b
+        case "==", [a, b]:
+            return a == b
+        case "!=", [a, b]:
+            return a != b
+        case "+", [int(a), int(b)]:
+            return _wrap(a + b)
+        case "-", [int(a), int(b)]:
+            return _wrap(a - b)
+        case "*", [int(a), int(b)]:
+            return _wrap(a * b)
+        case "/" | "%", [int(a), int(b)]:
+            if b == 0 or _divide(a, b) != _wrap(_divide(a, b)):
+                return None
+            quotient = _divide(a, b)
+            return quotient if fun == "/" else a - b * quotient
+        case "<", [int(a), int(b)]:
+            return a < b
+        case "<=", [int(a), int(b)]:
+            return a <= b
+        case ">", [int(a), int(b)]:
+            return a > b
+        case ">=", [int(a), int(b)]:
+            return a >= b
+    return None
+
+
+def _meet(a: Value, b: Value) -> Value:
+    if a is VARYING or b is VARYING:
+        return VARYING
+    if type(a) is type(b) and a == b:
+        return a
+    return VARYING
+
+
+def _load_constant(insn: Instruction, value: Constant, dest: IRVar) -> Instruction:
+    if isinstance(value, bool):
+        return LoadBoolConst(insn.location, value, dest)
+    return LoadIntConst(insn.location, value, dest)
+
+
+def propagate_constants(cfg: ControlFlowGraph) -> None:
+    """Replaces computations of constant values with loads of constants.
+
+    This is conditional constant propagation (Wegman and Zadeck): blocks
+    are only analyzed once a jump to them is known to be possible, so a
+    branch on a constant condition doesn't spoil the constants of the
+    code after it. Such branches become plain jumps, and the blocks that
+    can never run are removed.
+    """
+    analysis = _ConstantAnalysis(cfg)
+    analysis.run()
+
+    for block in cfg.blocks:
+        if block not in analysis.out_states:
+            continue
+        state = analysis.entry_state(block)
+        folded: list[Instruction] = []
+        for insn in block.instructions:
+            value = analysis.transfer(insn, state)
+            if value is not None and not isinstance(
+                insn, (LoadIntConst, LoadBoolConst)
+            ):
+                assert isinstance(insn, (Copy, Call))
+                folded.append(_load_constant(insn, value, insn.dest))
+            elif isinstance(insn, CondJump) and isinstance(
+                cond := analysis.value(insn.cond, state), bool
+            ):
+                target = insn.then_label if cond else insn.else_label
+                folded.append(Jump(insn.location, target))
+            else:
+                folded.append(insn)
+        block.instructions = folded
+
+    cfg.blocks = [block for block in cfg.blocks if block in analysis.out_states]
+    cfg.link()
+
+
+class _ConstantAnalysis:
+    """Finds the constants of a program for `propagate_constants`.
+
+    Most variables are assigned in only one place, like the temporaries
+    of expressions. Such a variable has one value for the whole program,
+    kept in `values`. Only the variables that are assigned in several
+    places are tracked per block, so the states stay small.
+    """
+
+    def __init__(self, cfg: ControlFlowGraph) -> None:
+        self.cfg = cfg
+        # The blocks that read each variable.
+        self.users: dict[IRVar, list[BasicBlock]] = {}
+        for block in cfg.blocks:
+            for insn in block.instructions:
+                for var in used_variables(insn):
+                    self.users.setdefault(var, []).append(block)
+        assignments = _assignment_counts(cfg)
+        self.assigned_once = {var for var, n in assignments.items() if n == 1}
+        self.values: dict[IRVar, Value] = {}
+        # Variables in 'values' that have changed since the last check.
+        self.changed: list[IRVar] = []
+        # The state at the end of each block that has been analyzed.
+        # Blocks that aren't in it can never run.
+        self.out_states: dict[BasicBlock, State] = {}
+        # Predecessors that are known to jump to each block.
+        self.live_predecessors: dict[BasicBlock, list[BasicBlock]] = {cfg.entry: []}
+
+    def run(self) -> None:
+        # Blocks are analyzed in reverse postorder, so that a block is
+        # usually analyzed after all of its predecessors.
+        position = {block: i for i, block in enumerate(self.cfg.reverse_postorder())}
+        worklist: list[tuple[int, BasicBlock]] = []
+        queued: set[BasicBlock] = set()
+
+        def enqueue(block: BasicBlock) -> None:
+            if block not in queued:
+                queued.add(block)
+                heapq.heappush(worklist, (position[block], block))
+
+        enqueue(self.cfg.entry)
+        while worklist:
+            _, block = heapq.heappop(worklist)
+            queued.remove(block)
+            state = self.entry_state(block)
+            for insn in block.instructions:
+                self.transfer(insn, state)
+
+            for var in self.changed:
+                for user in self.users.get(var, ()):
+                    if user in self.out_states:
+                        enqueue(user)
+            self.changed.clear()
+
+            state_changed = self.out_states.get(block) != state
+            self.out_states[block] = state
+            for succ in self.taken_successors(block, state):
+                preds = self.live_predecessors.setdefault(succ, [])
+                if block not in preds:
+                    preds.append(block)
+                    enqueue(succ)
+                elif state_changed:
+                    enqueue(succ)
+
+    def value(self, var: IRVar, state: State) -> Value:
+        if var in self.assigned_once:
+            return self.values.get(var, VARYING)
+        return state.get(var, VARYING)
+
+    def entry_state(self, block: BasicBlock) -> State:
+        # Predecessors that haven't been analyzed yet don't constrain the
+        # result: their constants are assumed to agree until shown otherwise.
+        incoming = [
+            self.out_states[pred]
+            for pred in self.live_predecessors[block]
+            if pred in self.out_states
+        ]
+        if not incoming:
+            return {}
+        first, *rest = incoming
+        return {
+            var: value
+            for var, value in first.items()
+            if all(other.get(var, VARYING) == value for other in rest)
+        }
+
+    def transfer(self, insn: Instruction, state: State) -> Constant | None:
+        """Updates `state` and `values` with the effect of `insn`.
+
+        Returns the value `insn` assigns if it is a constant, else None.
+        """
+        value: Value
+        match insn:
+            case LoadIntConst() | LoadBoolConst():
+                value = insn.value
+            case Copy():
+                value = self.value(insn.source, state)
+            case Call():
+                args = [self.value(arg, state) for arg in insn.args]
+                constants = [arg for arg in args if not isinstance(arg, _Varying)]
+                result = None
+                if len(constants) == len(args):
+                    result = fold_call(insn.fun.name, constants)
+                value = result if result is not None else VARYING
+            case _:
+                return None
+
+        if insn.dest in self.assigned_once:
+            old = self.values.get(insn.dest)
+            if old is None:
+                self.values[insn.dest] = value
+                self.changed.append(insn.dest)
+            elif not isinstance(old, _Varying) and _meet(old, value) is VARYING:
+                self.values[insn.dest] = VARYING
+                self.changed.append(insn.dest)
+        elif isinstance(value, _Varying):
+            state.pop(insn.dest, None)
+        else:
+            state[insn.dest] = value
+        return None if isinstance(value, _Varying) else value
+
+    def taken_successors(self, block: BasicBlock, state: State) -> list[BasicBlock]:
+        last = block.instructions[-1] if block.instructions else None
+        if isinstance(last, CondJump):
+            cond = self.value(last.cond, state)
+            if isinstance(cond, bool):
+                then, otherwise = _jump_targets(block, last)
+                return [then if cond else otherwise]
+        return block.successors
+
+
+def _jump_targets(block: BasicBlock, jump: CondJump) -> tuple[BasicBlock, BasicBlock]:
+    by_name = {succ.name: succ for succ in block.successors}
+    return by_name[jump.then_label.name], by_name[jump.else_label.name]
+
+
+# Built-ins without side effects. Division is not one of them: it traps
+# when dividing by zero.
+_PURE_FUNCTIONS = frozenset(
+    ["unary_-", "unary_not", "and", "or", "+", "-", "*"]
+    + ["==", "!=", "<", "<=", ">", ">="]
+)
+
+
+def _is_pure(insn: Instruction) -> bool:
+    """Returns whether `insn` does nothing but assign its destination."""
+    if isinstance(insn, Call):
+        return insn.fun.name in _PURE_FUNCTIONS
+    return isinstance(insn, (LoadIntConst, LoadBoolConst, Copy))
+
+
+def _assignment_counts(cfg: ControlFlowGraph) -> Counter[IRVar]:
+    """Counts the instructions that assign each variable."""
+    counts: Counter[IRVar] = Counter()
+    for block in cfg.blocks:
+        for insn in block.instructions:
+            dest = defined_variable(insn)
+            if dest is not None:
+                counts[dest] += 1
+    return counts
+
+
+class _Copies:
+    """The copies `dest = source` that are known to still hold.
+
+    `originals` are copies that hold everywhere the copy can be read,
+    and `source_of` the ones that hold at the current point.
+    """
+
+    def __init__(
+        self, originals: dict[IRVar, IRVar], source_of: dict[IRVar, IRVar]
+    ) -> None:
+        self.originals = originals
+        self.source_of = dict(source_of)
+        # The destinations of the copies of each source.
+        self.copies_of: dict[IRVar, set[IRVar]] = {}
+        for dest, source in source_of.items():
+            self.copies_of.setdefault(source, set()).add(dest)
+
+    def original(self, var: IRVar) -> IRVar:
+        var = self.originals.get(var, var)
+        return self.source_of.get(var, var)
+
+    def rewrite(self, insn: Instruction) -> Instruction:
+        """Returns `insn` with every use of a copy replaced by its source."""
+        match insn:
+            case Copy() if (source := self.original(insn.source)) != insn.source:
+                return replace(insn, source=source)
+            case Call():
+                args = [self.original(arg) for arg in insn.args]
+                if args != insn.args:
+                    return replace(insn, args=args)
+            case CondJump() if (cond := self.original(insn.cond)) != insn.cond:
+                return replace(insn, cond=cond)
+        return insn
+
+    def assign(self, insn: Instruction) -> None:
+        """Updates the copies after `insn` has run."""
+        dest = defined_variable(insn)
+        if dest is None:
+            return
+        # The old value of 'dest' is gone, and so are the copies it was in.
+        source = self.source_of.pop(dest, None)
+        if source is not None:
+            self.copies_of[source].discard(dest)
+        for copy in self.copies_of.pop(dest, ()):
+            del self.source_of[copy]
+        if (
+            isinstance(insn, Copy)
+            and insn.source != dest
+            and dest not in self.originals
+        ):
+            self.source_of[dest] = insn.source
+            self.copies_of.setdefault(insn.source, set()).add(dest)
+
+
+def propagate_copies(cfg: ControlFlowGraph) -> None:
+    """Makes instructions read the original of a copied value instead of
+    the copy, and removes copies of variables to themselves.
+
+    A copy `y = x` can stand in for `y` wherever it holds on every path
+    from the entry: until `x` or `y` is assigned again. The copy itself
+    is then often never read, and `eliminate_dead_code` removes it.
+
+    If `x` and `y` are both assigned only there, the copy holds wherever
+    `y` is read: generated IR assigns such variables before reading them
+    on every path. These copies aren't tracked per block, which keeps the
+    analysis fast when most variables are temporaries.
+    """
+    assignments = _assignment_counts(cfg)
+    originals: dict[IRVar, IRVar] = {}
+    for block in cfg.blocks:
+        for insn in block.instructions:
+            if (
+                isinstance(insn, Copy)
+                and assignments[insn.source] == 1
+                and assignments[insn.dest] == 1
+            ):
+                originals[insn.dest] = insn.source
+    for var in originals:
+        chain = []
+        while var in originals:
+            chain.append(var)
+            var = originals[var]
+        for copy in chain:
+            originals[copy] = var
+
+    out_copies: dict[BasicBlock, dict[IRVar, IRVar]] = {}
+    order = cfg.reverse_postorder()
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            copies = _Copies(originals, _copies_on_entry(block, cfg, out_copies))
+            for insn in block.instructions:
+                copies.assign(copies.rewrite(insn))
+            if out_copies.get(block) != copies.source_of:
+                out_copies[block] = copies.source_of
+                changed = True
+
+    for block in cfg.blocks:
+        copies = _Copies(originals, _copies_on_entry(block, cfg, out_copies))
+        rewritten: list[Instruction] = []
+        for insn in block.instructions:
+            insn = copies.rewrite(insn)
+            copies.assign(insn)
+            if not (isinstance(insn, Copy) and insn.source == insn.dest):
+                rewritten.append(insn)
+        block.instructions = rewritten
+
+
+def _copies_on_entry(
+    block: BasicBlock,
+    cfg: ControlFlowGraph,
+    out_copies: dict[BasicBlock, dict[IRVar, IRVar]],
+) -> dict[IRVar, IRVar]:
+    if block is cfg.entry:
+        return {}
+    # Predecessors that haven't been analyzed yet don't constrain the
+    # result: their copies are assumed to agree until shown otherwise.
+    incoming = [out_copies[pred] for pred in block.predecessors if pred in out_copies]
+    if not incoming:
+        return {}
+    first, *rest = incoming
+    return {
+        dest: source
+        for dest, source in first.items()
+        if all(other.get(dest) == source for other in rest)
+    }
+
+
+def eliminate_dead_code(cfg: ControlFlowGraph) -> None:
+    """Removes instructions without side effects whose results are never
+    read.
+
+    An instruction counts as reading a variable only if the instruction
+    is kept, so chains of computations that only feed each other (even
+    around a loop) are removed as a whole.
+    """
+    live_in: dict[BasicBlock, set[IRVar]] = {block: set() for block in cfg.blocks}
+    order = list(reversed(cfg.blocks))
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            live = _live_on_exit(block, live_in)
+            for insn in reversed(block.instructions):
+                _update_liveness(insn, live)
+            if live != live_in[block]:
+                live_in[block] = live
+                changed = True
+
+    for block in cfg.blocks:
+        live = _live_on_exit(block, live_in)
+        kept: list[Instruction] = []
+        for insn in reversed(block.instructions):
+            if _update_liveness(insn, live):
+                kept.append(insn)
+        kept.reverse()
+        block.instructions = kept
+
+
+def _live_on_exit(
+    block: BasicBlock, live_in: dict[BasicBlock, set[IRVar]]
+) -> set[IRVar]:
+    live: set[IRVar] = set()
+    for succ in block.successors:
+        live |= live_in[succ]
+    return live
+
+
+def _update_liveness(insn: Instruction, live: set[IRVar]) -> bool:
+    """Updates the variables that are `live` after `insn` to those live
+    before it. Returns False if `insn` is dead.
+    """
+    dest = defined_variable(insn)
+    if dest is not None:
+        if dest not in live and _is_pure(insn):
+            return False
+        live.discard(dest)
+    live.update(used_variables(insn))
+    return True
@@ -1,63 +1,74 @@
-from compiler.tokenizer import tokenize, Token, L, TokenType, Location
-import compiler.ast as ast
-
+from typing import Iterable
 
-def parse(tokens: list[Token]) -> ast.Expression:
-    pos: int = 0
+from compiler.tokenizer import tokenize, Token, L, TokenType, Location, TokenStream
+from compiler import trace
+from compiler.traversal import Visit, run
+import compiler.ast as ast
 
-    if len(tokens) == 0:
+# Precedence levels of binary operators, see 'ast.BinaryOp'.
+# '=' is right associative, all others are left associative.
+binary_precedence = {
+    "=": 1,
+    "or": 2,
+    "and": 3,
+    "==": 4,
+    "!=": 4,
+    "<": 5,
+    "<=": 5,
+    ">": 5,
+    ">=": 5,
+    "+": 6,
+    "-": 6,
+    "*": 7,
+    "/": 7,
+    "%": 7,
+}
+
+unary_operators = frozenset(["-", "not"])
+
+# Identifiers that start an expression other than a variable.
+expression_keywords = frozenset(["if", "while", "var", *unary_operators])
+
+# Tokens that may follow an expression that is not at the top level.
+# (An expression may also follow a block directly, see 'parse_block'.)
+expression_followers = frozenset(["", ",", ";", ")", "}", "then", "else", "do"])
+
+
+def parse(tokens: Iterable[Token]) -> ast.Expression:
+    # Tokens are pulled from 'tokens' as the parser needs them,
+    # so they may come straight from 'tokenize_stream'.
+    stream = TokenStream(tokens)
+
+    if stream.first is None:
         return ast.Block(Location(0, 0), expressions=[])
+    first_token: Token = stream.first
 
-    left_associative_binary = {
-        2: ["or"],
-        3: ["and"],
-        4: ["==", "!="],
-        5: ["<", "<=", ">", ">="],
-        6: ["+", "-"],
-        7: ["*", "/", "%"],
-    }
-
-    # 'peek()' returns the token at 'pos',
+    # 'peek()' returns the next token,
     # or a special 'end' token if we're past the end
-    # of the token list.
+    # of the tokens.
     # This way we don't have to worry about going past
     # the end elsewhere.
     def peek(lookahead: int = 0) -> Token:
-        if pos + lookahead < len(tokens) and len(tokens) != 0:
-            return tokens[pos + lookahead]
-        else:
-            return Token(
-                location=L,
-                type=TokenType.END,
-                text="",
-            )
+        return stream.peek(lookahead)
 
     def lookback(amount: int = 1) -> Token:
-        if pos - amount > 0:
-            return tokens[pos - amount]
-        else:
-            return Token(
-                location=L,
-                type=TokenType.END,
-                text="",
-            )
+        return stream.lookback(amount)
 
-    # 'consume(expected)' returns the token at 'pos'
-    # and moves 'pos' forward.
+    # 'consume(expected)' returns the next token
+    # and moves past it.
     #
     # If the optional parameter 'expected' is given,
     # it checks that the token being consumed has that text.
     # If 'expected' is a list, then the token must have
     # one of the texts in the list.
     def consume(expected: str | list[str] | None = None) -> Token:
-        nonlocal pos
-        token = peek()
+        token = stream.current
         if isinstance(expected, str) and token.text != expected:
             raise Exception(f'{token.location}: expected "{expected}"')
         if isinstance(expected, list) and token.text not in expected:
             comma_sep = ", ".join([f'"{e}"' for e in expected])
             raise Exception(f"{token.location}: expected one of : {comma_sep}")
-        pos += 1
+        stream.advance()
         return token
 
     def parse_int_lit() -> ast.Literal:
@@ -78,27 +89,34 @@ def parse(tokens: list[Token]) -> ast.Expression:
         token = consume()
         return ast.Identifier(location=token.location, name=token.text)
 
-    def parse_parenthesized() -> ast.Expression:
+    # The parsing functions for nested expressions are traversals driven
+    # by 'run' (see 'compiler.traversal'), so that deeply nested programs
+    # don't hit the recursion limit. Each nested expression is a step of
+    # its own: they yield 'parse_expression()' where they would call it.
+    # Their other calls nest only a few levels deep, through the
+    # precedence levels and kinds of expressions, and are made with
+    # 'yield from', which is cheaper.
+    def parse_parenthesized() -> Visit[ast.Expression]:
         consume("(")
         # print("Consumed (")
         # Recursively call the top level parsing function
         # to parse whatever is inside the parentheses.
-        expr = parse_expression()
+        expr = yield parse_expression()
         consume(")")
         # print("Consumed )")
         return expr
 
-    def parse_conditional() -> ast.Expression:
+    def parse_conditional() -> Visit[ast.Expression]:
         if_tok = consume("if")
-        condition = parse_expression()
+        condition = yield parse_expression()
         # print(f"\n###############\nParsed condition {condition}\n")
         consume("then")
-        then = parse_expression()
+        then = yield parse_expression()
         # print(f"\n#################\nparsed then {then}\n")
         otherwise = None
         if peek().text == "else":
             consume("else")
-            otherwise = parse_expression()
+            otherwise = yield parse_expression()
 
         return ast.Branch(
             location=if_tok.location,
@@ -107,27 +125,26 @@ def parse(tokens: list[Token]) -> ast.Expression:
             otherwise=otherwise,
         )
 
-    def parse_block(top_level_block: bool = False) -> ast.Expression:
+    def parse_block(top_level_block: bool = False) -> Visit[ast.Expression]:
         if not top_level_block:
             block_start = consume("{")
 
-        print(f"PARSING BLOCK")
+        if trace.on.parser:
+            trace.emit("parser", f"block at {peek().location}")
         statements: list[ast.Expression | None]
         if peek().text == "}":
             statements = [None]
         else:
-            statements = [parse_expression(block_call=True)]
+            statements = [(yield parse_expression(block_call=True))]
             breakpoint
             while peek().text == ";" or lookback().text == "}":
                 if peek().text == ";":
                     consume(";")
-                expr = parse_expression(block_call=True)
-                print(
-                    f"!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!! Block Expression that parsed is {expr}, exprs is not none? {expr is not None}"
-                )
+                expr = yield parse_expression(block_call=True)
+                if trace.on.parser:
+                    trace.emit("parser", f"block expression {expr}")
                 if expr != ast.Literal(L, None):
                     statements.append(expr)
-                    print(f"Appended expr to statements, now is {statements}")
                 else:
                     if lookback().text == ";" or peek().text != "}":
                         statements.append(ast.Literal(lookback().location, None))
@@ -135,179 +152,168 @@ def parse(tokens: list[Token]) -> ast.Expression:
 
         if not top_level_block:
             consume("}")
-        print(f"BLOCK PARSE FINISHED")
+        if trace.on.parser:
+            trace.emit("parser", f"block done, {len(statements)} expressions")
         return ast.Block(location=block_start.location, expressions=statements)
 
-    def parse_loop() -> ast.Expression:
+    def parse_loop() -> Visit[ast.Expression]:
         w = consume("while")
-        conditional = parse_expression()
+        conditional = yield parse_expression()
         consume("do")
-        loop = parse_expression()
+        loop = yield parse_expression()
         return ast.Loop(location=w.location, condition=conditional, loop=loop)
 
-    def parse_var() -> ast.Expression:
+    def parse_var() -> Visit[ast.Expression]:
         var = consume("var")
         ident = parse_identifier()
         consume("=")
-        expression = parse_expression()
+        expression = yield parse_expression()
 
         return ast.VarDeclaration(
             location=var.location, identifier=ident, expression=expression
         )
 
-    def parse_function(ident: ast.Identifier) -> ast.Expression:
+    def parse_function(ident: ast.Identifier) -> Visit[ast.Expression]:
         f = consume("(")
         if peek().text == ")":
             argList = []
         else:
-            argList = [parse_expression()]
+            argList = [(yield parse_expression())]
         while peek().text == ",":
             consume(",")
-            argList.append(parse_expression())
+            argList.append((yield parse_expression()))
 
         consume(")")
         return ast.FuncCall(location=f.location, identifier=ident, arguments=argList)
 
+    # Parses an expression, which at the top level or in a block may also be
+    # a sequence of ';'-separated expressions, and checks what follows it.
     def parse_expression(
-        precedence_level: int = 1,
         top_level_call: bool = False,
         block_call: bool = False,
-    ) -> ast.Expression:
-
-        right: ast.Expression | None = None
-        term: ast.Expression | None = None
-
-        toReturn: ast.Expression | None = None
-
-        match precedence_level:
-            case 1:
-                right = None
-                left = parse_expression(2, top_level_call, block_call)
-
-                # print(f'On level {precedence_level}, looking at "="')
-                # print(f"peek is: {peek().text}")
-
-                while peek().text in ["="]:
-
-                    operator = consume()
-
-                    # print(f"Operator consumed: {operator.text}")
-
-                    if isinstance(left, ast.Identifier):
-                        right = ast.Assignment(
-                            location=operator.location,
-                            identifier=left,
-                            expression=parse_expression(),
-                        )
-                    else:
-                        raise Exception(
-                            f"Failed to parse assignment, {left} not an identifier"
-                        )
-
-                term = right if right is not None else left
-
-                statements: list[ast.Expression | None] = [term]
-                while top_level_call and peek().text == ";":
-                    consume(";")
-                    statements.append(
-                        parse_expression(top_level_call=False, block_call=True)
-                    )
-
-                # #print(f'Term is currently {term}, \n statements are {statements}')
-
-                # #print(f"Current peek is: {peek()}")
-
-                # #print(f"In a toplevel call? {top_level_call}")
-                # #print(f"Peek is: {peek().text} it it not allowed in non-top-level call: {peek().text not in ["", ";", ")", "}", "then", "else", "do"]}")
-                if (
-                    peek().text not in ["", ",", ";", ")", "}", "then", "else", "do"]
-                    and not top_level_call
-                ):
-                    # #print("Wat")
-                    if lookback().text != "}":
-                        raise Exception(f"Trailing garbage at {peek().location}")
-
-                if peek().type != TokenType.END and top_level_call:
-                    # #print("wat2")
-                    raise Exception(f"Trailing garbage at {peek().location}")
-
-                if 1 < len(statements):
-                    toReturn = ast.Block(
-                        location=tokens[0].location, expressions=statements
-                    )
-                else:
-                    toReturn = term
-
-            case l if 2 <= l < 8:
-                left = parse_expression(l + 1, top_level_call, block_call)
-
-                # print(f"On level {l}, looking at {left_associative_binary[l]}")
-                # print(f"peek is: {peek().text}")
-                # print(
-                #    f"{peek().text} in {left_associative_binary[l]} == {peek().text in left_associative_binary[l]}"
-                # )
-                while peek().text in left_associative_binary[l]:
-                    operator = consume()
-
-                    # print(f"Operator consumed: {operator.text}")
-
-                    right = parse_expression(l + 1)
-
-                    left = ast.BinaryOp(
-                        location=operator.location,
-                        op=operator.text,
-                        left=left,
-                        right=right,
-                    )
-
-                toReturn = left
-            case 8:
-                while peek().text in ["-", "not"]:
-                    operator = consume()
-                    # print(f"Operator consumed: {operator.text}")
+    ) -> Visit[ast.Expression]:
+        term = yield from parse_binary(1, top_level_call or block_call)
+
+        statements: list[ast.Expression | None] = [term]
+        while top_level_call and stream.current.text == ";":
+            consume(";")
+            statements.append(
+                (yield parse_expression(top_level_call=False, block_call=True))
+            )
 
-                    term = ast.UnaryOp(
-                        location=operator.location,
-                        op=operator.text,
-                        parameter=parse_expression(l),
+        if stream.current.text not in expression_followers and not top_level_call:
+            if lookback().text != "}":
+                raise Exception(f"Trailing garbage at {stream.current.location}")
+
+        if stream.current.type != TokenType.END and top_level_call:
+            raise Exception(f"Trailing garbage at {stream.current.location}")
+
+        if 1 < len(statements):
+            return ast.Block(location=first_token.location, expressions=statements)
+        return term
+
+    # Precedence climbing: parses operands and binary operators
+    # binding at least as tightly as 'min_precedence', starting from the
+    # operand 'left' if it is already parsed.
+    # Left associative operators loop here, so only '=' (which is right
+    # associative) and nested operands recurse.
+    def parse_binary(
+        min_precedence: int, allow_var: bool, left: ast.Expression | None = None
+    ) -> Visit[ast.Expression]:
+        if left is None:
+            left = parse_simple_operand()
+        if left is None:
+            left = yield from parse_unary(allow_var)
+        while True:
+            precedence = binary_precedence.get(stream.current.text)
+            if precedence is None or precedence < min_precedence:
+                return left
+            operator = consume()
+            if operator.text == "=":
+                if not isinstance(left, ast.Identifier):
+                    raise Exception(
+                        f"Failed to parse assignment, {left} not an identifier"
                     )
+                expression = yield parse_expression()
+                return ast.Assignment(
+                    location=operator.location,
+                    identifier=left,
+                    expression=expression,
+                )
+            right = parse_simple_operand()
+            following = binary_precedence.get(stream.current.text)
+            if right is None or (following is not None and following > precedence):
+                right = yield from parse_binary(precedence + 1, False, right)
+            left = ast.BinaryOp(
+                location=operator.location,
+                op=operator.text,
+                left=left,
+                right=right,
+            )
 
-                if term is not None:
-                    toReturn = term
-                else:
-                    toReturn = parse_expression(l + 1, top_level_call, block_call)
-
-            case _:
-                match peek():
-                    case t if t.text == "if":
-                        toReturn = parse_conditional()
-                    case t if t.text == "while":
-                        toReturn = parse_loop()
-                    case t if t.text == "var":
-                        if not (top_level_call or block_call):
-                            raise Exception(
-                                f"Vars only supported in top level or blocks: {t.location}"
-                            )
-                        toReturn = parse_var()
-                    case t if t.text == "{":
-                        toReturn = parse_block()
-                    case t if t.text == "(":
-                        toReturn = parse_parenthesized()
-                    case t if t.type == TokenType.IDENTIFIER:
-                        toReturn = parse_identifier()
-                        if peek().text == "(":
-                            toReturn = parse_function(ident=toReturn)
-                    case t if t.type == TokenType.BOOL_LITERAL:
-                        toReturn = parse_bool_lit()
-                    case t if t.type == TokenType.INT_LITERAL:
-                        toReturn = parse_int_lit()
-
-        # print(
-        #    f"On level {precedence_level} and toplevel? = {top_level_call}. \n Returning {toReturn} \n\n\n"
-        # )
-        return (
-            toReturn if toReturn is not None else ast.Literal(lookback().location, None)
-        )
-
-    parsed = parse_expression(top_level_call=True)
+    # Parses an operand without nested expressions, or returns None if the
+    # next operand is not one. Most operands are literals and variables,
+    # and this saves running a traversal step for each of them.
+    def parse_simple_operand() -> ast.Expression | None:
+        t = stream.current
+        if t.type == TokenType.INT_LITERAL:
+            node: ast.Expression = ast.Literal(location=t.location, value=int(t.text))
+        elif t.type == TokenType.BOOL_LITERAL:
+            node = ast.Literal(location=t.location, value=t.text == "true")
+        elif (
+            t.type == TokenType.IDENTIFIER
+            and t.text not in expression_keywords
+            and stream.peek(1).text != "("
+        ):
+            node = ast.Identifier(location=t.location, name=t.text)
+        else:
+            return None
+        stream.advance()
+        return node
+
+    # Unary operators bind tighter than any binary operator.
+    def parse_unary(allow_var: bool) -> Visit[ast.Expression]:
+        operators: list[Token] = []
+        while stream.current.text in unary_operators:
+            operators.append(consume())
+        if not operators:
+            return (yield from parse_primary(allow_var))
+        term = yield from parse_primary(False)
+        for operator in reversed(operators):
+            term = ast.UnaryOp(
+                location=operator.location, op=operator.text, parameter=term
+            )
+        return term
+
+    def parse_primary(allow_var: bool) -> Visit[ast.Expression]:
+        t = stream.current
+        if t.text == "if":
+            return (yield from parse_conditional())
+        if t.text == "while":
+            return (yield from parse_loop())
+        if t.text == "var":
+            if not allow_var:
+                raise Exception(
+                    f"Vars only supported in top level or blocks: {t.location}"
+                )
+            return (yield from parse_var())
+        if t.text == "{":
+            return (yield from parse_block())
+        if t.text == "(":
+            return (yield from parse_parenthesized())
+        if t.type == TokenType.IDENTIFIER:
+            identifier = parse_identifier()
+            if stream.current.text == "(":
+                return (yield from parse_function(ident=identifier))
+            return identifier
+        if t.type == TokenType.BOOL_LITERAL:
+            return parse_bool_lit()
+        if t.type == TokenType.INT_LITERAL:
+            return parse_int_lit()
+        # Nothing to parse: an empty expression.
+        return ast.Literal(lookback().location, None)
+
+    parsed = run(parse_expression(top_level_call=True))
+    if trace.on.parser:
+        trace.emit("parser", f"parsed {parsed}")
     return parsed
@@ -0,0 +1,399 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import repeat
+import multiprocessing
+import os
+import signal
+from traceback import format_exception
+from typing import Iterable, Iterator
+
+from compiler import trace
+from compiler.cache import CompilationCache
+from compiler.instrumentation import CompileProfile, StageStats, stage
+from compiler.tokenizer import Token, tokenize, tokenize_stream
+from compiler.parser import parse
+from compiler.ir_generator import generate_ir, root_types
+from compiler.optimizer import optimize
+from compiler.assembly_generator import generate_assembly
+from compiler.assembler import assemble, assemble_and_get_executable, stdlib_object
+
+
+@dataclass(frozen=True)
+class CompilerOptions:
+    """Options that affect the generated executable.
+
+    All of these are part of the compilation cache key.
+    """
+
+    link_with_c: bool = False
+    extra_libraries: tuple[str, ...] = ()
+    # "binutils" runs 'as' and 'ld'. "builtin" encodes the program and writes
+    # the executable in-process, falling back to binutils when it can't.
+    assembler: str = "binutils"
+    # Run the IR optimization passes and keep variables in registers.
+    optimize: bool = True
+
+
+# The process-wide compilation cache, or None if caching is disabled.
+compilation_cache: CompilationCache | None = None
+
+
+# Process-wide timing histograms, or None if they are not collected.
+stage_stats: StageStats | None = None
+
+
+def configure_cache(cache: CompilationCache | None) -> None:
+    global compilation_cache
+    compilation_cache = cache
+
+
+def configure_stats(stats: StageStats | None) -> None:
+    global stage_stats
+    stage_stats = stats
+
+
+class CompilationContext:
+    """The state of one compilation.
+
+    The compiler keeps no per-compilation state anywhere else, so separate
+    contexts can compile at the same time on different threads. They share
+    the process-wide compilation cache and timing statistics (as they were
+    when the context was created), which are thread-safe.
+
+    If `profile` is given, the resources used by each stage are recorded
+    in it. Successful compilations are also added to the statistics.
+    Profiles are thread-safe too, and each one gets only its own thread's
+    CPU time. Memory can only be tracked for the whole process, though,
+    so a stage that overlaps with another profiled compilation's gets no
+    peak memory (see `CompileProfile`).
+    With `trace_channels`, those channels are traced during compilation,
+    and all trace output of the compilation is collected in `trace_lines`
+    instead of being written to stderr.
+    """
+
+    def __init__(
+        self,
+        options: CompilerOptions = CompilerOptions(),
+        profile: CompileProfile | None = None,
+        trace_channels: Iterable[str] = (),
+    ) -> None:
+        self.options = options
+        self.profile = profile
+        self.trace_channels = tuple(trace_channels)
+        self.trace_lines: list[str] = []
+        self.cache = compilation_cache
+        self.stats = stage_stats
+
+    def compile(self, source_code: str) -> bytes:
+        """Runs the whole compiler pipeline and returns the compiled executable.
+
+        Raises an exception on compilation error.
+        """
+        with self._profiling() as profile:
+            return self._cached_compile(source_code, profile)
+
+    def _cached_compile(
+        self, source_code: str, profile: CompileProfile | None
+    ) -> bytes:
+        if self.cache is None:
+            return _compile(source_code, self.options, profile)
+
+        key = self.cache.key(source_code, repr(self.options))
+        executable = self.cache.get(key)
+        if executable is None:
+            executable = _compile(source_code, self.options, profile)
+            self.cache.put(key, executable)
+        return executable
+
+    def compile_to_file(self, source_code: str, output_file: str) -> None:
+        """Like `compile`, but writes the executable to `output_file`.
+
+        Unless it comes from the compilation cache, the executable produced
+        by the linker is moved into place instead of being read into memory
+        and written out. It is added to the cache from there.
+        """
+        with self._profiling() as profile:
+            self._cached_compile_to_file(source_code, output_file, profile)
+
+    def _cached_compile_to_file(
+        self, source_code: str, output_file: str, profile: CompileProfile | None
+    ) -> None:
+        if self.cache is None:
+            self._assemble_to_file(source_code, output_file, profile)
+            return
+
+        key = self.cache.key(source_code, repr(self.options))
+        executable = self.cache.get(key)
+        if executable is not None:
+            _write_executable(output_file, executable)
+            return
+        self._assemble_to_file(source_code, output_file, profile)
+        with open(output_file, "rb") as f:
+            self.cache.put(key, f.read())
+
+    def compile_file(self, input_file: str, output_file: str) -> None:
+        """Compiles `input_file` into the executable `output_file`.
+
+        Without a compilation cache, the source is read in chunks and
+        tokenized as the parser consumes it, so it is never held in memory
+        as a whole. With a cache, the source is read once, to compute the
+        cache key and to compile it on a miss.
+        """
+        with self._profiling() as profile:
+            if self.cache is not None:
+                with open(input_file) as f:
+                    self._cached_compile_to_file(f.read(), output_file, profile)
+            else:
+                self._assemble_to_file(read_chunks(input_file), output_file, profile)
+
+    def _assemble_to_file(
+        self,
+        source_code: str | Iterable[str],
+        output_file: str,
+        profile: CompileProfile | None,
+    ) -> None:
+        assembly_gen = _generate_assembly(source_code, self.options, profile)
+        with stage(profile, "assemble"):
+            _assemble_to_file(assembly_gen, output_file, self.options)
+
+    @contextmanager
+    def _profiling(self) -> Iterator[CompileProfile | None]:
+        """Traces and measures the compilation run inside the `with` block.
+
+        Yields the profile to record its stages in, which is `self.profile`
+        or, if only statistics are collected, a new one. If the compilation
+        succeeds, the profile is added to the statistics.
+        """
+        profile = self.profile
+        if profile is None and self.stats is not None:
+            profile = CompileProfile()
+        with self._tracing(), stage(profile, "total"):
+            yield profile
+        if self.stats is not None and profile is not None:
+            self.stats.record(profile)
+
+    @contextmanager
+    def _tracing(self) -> Iterator[None]:
+        if not self.trace_channels:
+            yield
+            return
+        with trace.tracing(self.trace_channels) as lines:
+            try:
+                yield
+            finally:
+                self.trace_lines.extend(lines)
+
+
+def compile(source_code: str, options: CompilerOptions = CompilerOptions()) -> bytes:
+    """Compiles `source_code` into an executable.
+
+    Safe to call from several threads at once, see `CompilationContext`.
+    """
+    return CompilationContext(options).compile(source_code)
+
+
+def call_compiler(
+    source_code: str,
+    input_file_name: str,
+    options: CompilerOptions = CompilerOptions(),
+    profile: CompileProfile | None = None,
+) -> bytes:
+    """Runs the whole compiler pipeline and returns the compiled executable.
+
+    Raises an exception on compilation error.
+
+    The input file name is informational only: it may be included in
+    source locations and error messages, or ignored.
+
+    If `profile` is given, the resources used by each stage are recorded
+    in it. Successful compilations are also added to `stage_stats`.
+    """
+    return CompilationContext(options, profile).compile(source_code)
+
+
+def call_compiler_to_file(
+    source_code: str,
+    input_file_name: str,
+    output_file: str,
+    options: CompilerOptions = CompilerOptions(),
+    profile: CompileProfile | None = None,
+) -> None:
+    """See `CompilationContext.compile_to_file`."""
+    CompilationContext(options, profile).compile_to_file(source_code, output_file)
+
+
+def compile_file(
+    input_file: str,
+    output_file: str,
+    options: CompilerOptions = CompilerOptions(),
+    profile: CompileProfile | None = None,
+) -> None:
+    """See `CompilationContext.compile_file`."""
+    CompilationContext(options, profile).compile_file(input_file, output_file)
+
+
+def read_chunks(input_file: str, chunk_size: int = 1024 * 1024) -> Iterator[str]:
+    """Yields the contents of a text file in chunks of `chunk_size` characters."""
+    with open(input_file) as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+def _write_executable(output_file: str, executable: bytes) -> None:
+    with open(output_file, "wb") as f:
+        f.write(executable)
+    os.chmod(output_file, 0o755)
+
+
+def _generate_assembly(
+    source_code: str | Iterable[str],
+    options: CompilerOptions,
+    profile: CompileProfile | None,
+) -> str:
+    """Runs the compiler up to generating assembly.
+
+    The source code can also be given as chunks of text, in which case
+    tokenizing happens on demand inside the "parse" stage.
+    """
+    with stage(profile, "tokenize"):
+        if isinstance(source_code, str):
+            tokenized: Iterable[Token] = tokenize(source_code)
+        else:
+            tokenized = tokenize_stream(source_code)
+    with stage(profile, "parse"):
+        parsed = parse(tokenized)
+    with stage(profile, "ir"):
+        ir_gen = generate_ir(root_types, parsed, check_types=True)
+    if options.optimize:
+        with stage(profile, "optimize"):
+            ir_gen = optimize(ir_gen)
+    with stage(profile, "assembly"):
+        assembly_gen = generate_assembly(ir_gen, use_registers=options.optimize)
+
+    if trace.on.asm:
+        trace.emit("asm", assembly_gen)
+    return assembly_gen
+
+
+def _compile(
+    source_code: str, options: CompilerOptions, profile: CompileProfile | None
+) -> bytes:
+    assembly_gen = _generate_assembly(source_code, options, profile)
+    with stage(profile, "assemble"):
+        return _assemble(assembly_gen, options)
+
+
+def _assemble(assembly_code: str, options: CompilerOptions) -> bytes:
+    return assemble_and_get_executable(
+        assembly_code,
+        link_with_c=options.link_with_c,
+        extra_libraries=list(options.extra_libraries),
+        builtin=options.assembler == "builtin",
+    )
+
+
+def _assemble_to_file(
+    assembly_code: str, output_file: str, options: CompilerOptions
+) -> None:
+    assemble(
+        assembly_code,
+        output_file,
+        link_with_c=options.link_with_c,
+        extra_libraries=list(options.extra_libraries),
+        builtin=options.assembler == "builtin",
+    )
+
+
+@dataclass
+class CompileResult:
+    """The outcome of compiling one program of a batch."""
+
+    executable: bytes | None = None
+    error: str | None = None
+    profile: CompileProfile | None = None
+
+
+def compile_one(
+    source_code: str,
+    input_file_name: str,
+    options: CompilerOptions,
+    profile: bool = False,
+) -> CompileResult:
+    """Like `call_compiler`, but returns errors instead of raising them.
+
+    With `profile`, the result includes a profile with memory tracking.
+    On a thread executor, the stages that run at the same time as another
+    profiled compilation's have no peak memory (see `CompilationContext`).
+    """
+    compile_profile = CompileProfile(track_memory=True) if profile else None
+    try:
+        executable = call_compiler(
+            source_code, input_file_name, options, compile_profile
+        )
+        return CompileResult(executable=executable, profile=compile_profile)
+    except Exception as e:
+        return CompileResult(
+            error="".join(format_exception(e)), profile=compile_profile
+        )
+
+
+def compile_batch(
+    programs: list[tuple[str, str]],
+    options: CompilerOptions = CompilerOptions(),
+    executor: Executor | None = None,
+    jobs: int = 1,
+    profile: bool = False,
+) -> list[CompileResult]:
+    """Compiles many (source code, input file name) pairs.
+
+    The work is spread over `executor` if given, otherwise everything is
+    compiled in this process. Results are returned in input order, and an
+    error in one program does not affect the others.
+    """
+    if executor is None or len(programs) <= 1:
+        return [
+            compile_one(source, name, options, profile) for source, name in programs
+        ]
+    # Hand out work in chunks so that small programs don't drown in IPC.
+    chunksize = max(1, len(programs) // (4 * max(jobs, 1)))
+    return list(
+        executor.map(
+            compile_one,
+            [source for source, _ in programs],
+            [name for _, name in programs],
+            repeat(options),
+            repeat(profile),
+            chunksize=chunksize,
+        )
+    )
+
+
+def _init_pool_process(
+    cache: CompilationCache | None, stats: StageStats | None
+) -> None:
+    # Ctrl-C reaches the whole process group; let the parent process
+    # shut the pool down instead of every worker dying mid-compile.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_cache(cache)
+    configure_stats(stats)
+    stdlib_object()
+
+
+def make_process_pool(jobs: int) -> ProcessPoolExecutor:
+    """Creates a pool of `jobs` processes for running the compiler.
+
+    The processes are started from a fork server that has the compiler
+    preloaded, not forked from the caller: a forked process would inherit
+    whatever sockets and files the caller has open at that moment.
+    The pool processes share the current compilation cache's disk tier
+    and counters, and the timing statistics.
+    """
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload(["compiler.pipeline"])
+    return ProcessPoolExecutor(
+        max_workers=max(jobs, 1),
+        mp_context=mp_context,
+        initializer=_init_pool_process,
+        initargs=(compilation_cache, stage_stats),
+    )
@@ -0,0 +1,250 @@
+"""Register allocation for the assembly generator.
+
+`allocate_registers` decides which IR variables are kept in registers,
+using linear scan over live intervals (Poletto and Sarkar, "Linear Scan
+Register Allocation"). The variables that don't fit are spilled to
+stack slots. Spilled variables whose intervals don't overlap share a
+slot, so the stack frame only needs as many slots as there are spilled
+values live at the same time.
+
+%rax, %rdx and %rdi are never allocated. The generated code uses them
+as scratch registers: intrinsics compute a result that goes to memory
+into %rdi, and 'idivq', 'setcc' and operands that must be in a register
+use %rax and %rdx.
+"""
+
+from bisect import bisect_right, insort
+from collections.abc import Set
+from dataclasses import dataclass, field
+import heapq
+
+from compiler.intrinsics import all_intrinsics
+from compiler.ir import (
+    BasicBlock,
+    Call,
+    ControlFlowGraph,
+    Instruction,
+    IRVar,
+    defined_variable,
+    used_variables,
+)
+
+# Registers that called functions preserve. The program must preserve
+# them too, so the ones it uses are saved on entry and restored on exit.
+CALLEE_SAVED = ["%rbx", "%r12", "%r13", "%r14", "%r15"]
+
+# Registers that called functions may overwrite. A value in one of them
+# that is needed after a call is saved before the call and restored
+# after it.
+CALLER_SAVED = ["%rcx", "%rsi", "%r8", "%r9", "%r10", "%r11"]
+
+
+@dataclass
+class LiveInterval:
+    """The instructions from the first to the last one at which `var`
+    holds a value that may still be read, by index in the program.
+    """
+
+    var: IRVar
+    start: int
+    end: int
+    # The indices of the calls that `var` holds a value across.
+    calls: list[int] = field(default_factory=list)
+
+
+@dataclass
+class Allocation:
+    """Where the variables of a program live."""
+
+    registers: dict[IRVar, str]
+    # The stack slot of each spilled variable, numbered from 0.
+    stack_slots: dict[IRVar, int]
+    # The callee-saved registers the program uses.
+    callee_saved: list[str]
+    # The caller-saved registers that hold a value across each call,
+    # by the index of the call.
+    saved_across_call: dict[int, list[str]]
+
+    def slot_count(self) -> int:
+        return max(self.stack_slots.values(), default=-1) + 1
+
+    def caller_saved(self) -> list[str]:
+        """Returns the caller-saved registers saved across any call."""
+        used = {r for regs in self.saved_across_call.values() for r in regs}
+        return [r for r in CALLER_SAVED if r in used]
+
+
+def is_call(insn: Instruction) -> bool:
+    """Returns whether `insn` calls a function, as opposed to an intrinsic."""
+    return isinstance(insn, Call) and insn.fun.name not in all_intrinsics
+
+
+def live_intervals(
+    instructions: list[Instruction], unallocated: Set[IRVar] = frozenset()
+) -> list[LiveInterval]:
+    """Computes the live interval of every variable that `instructions`
+    read or assign, except those in `unallocated`, in order of their start.
+
+    An interval covers the whole range between the first and the last
+    instruction where its variable is live, including any holes.
+    """
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    live_in = _live_in(cfg)
+
+    bounds: dict[IRVar, list[int]] = {}
+
+    def extend(var: IRVar, index: int) -> None:
+        b = bounds.get(var)
+        if b is None:
+            if var in unallocated:
+                return
+            bounds[var] = [index, index]
+        elif index < b[0]:
+            b[0] = index
+        elif index > b[1]:
+            b[1] = index
+
+    calls: list[int] = []
+    index = 0
+    for block in cfg.blocks:
+        first = index
+        if block.label is not None:
+            index += 1
+        for insn in block.instructions:
+            for var in used_variables(insn):
+                extend(var, index)
+            dest = defined_variable(insn)
+            if dest is not None:
+                extend(dest, index)
+            if is_call(insn):
+                calls.append(index)
+            index += 1
+        last = max(index - 1, first)
+        for var in live_in[block]:
+            extend(var, first)
+        for succ in block.successors:
+            for var in live_in[succ]:
+                extend(var, last)
+
+    intervals = []
+    for var, (start, end) in bounds.items():
+        # The calls strictly inside the interval: a call's arguments are
+        # read before it and its result is written after it.
+        lo = bisect_right(calls, start)
+        hi = bisect_right(calls, end - 1)
+        intervals.append(LiveInterval(var, start, end, calls[lo:hi]))
+    intervals.sort(key=lambda i: i.start)
+    return intervals
+
+
+def _live_in(cfg: ControlFlowGraph) -> dict[BasicBlock, set[IRVar]]:
+    """Computes the variables live at the start of each block."""
+    uses: dict[BasicBlock, set[IRVar]] = {}
+    defs: dict[BasicBlock, set[IRVar]] = {}
+    for block in cfg.blocks:
+        block_uses: set[IRVar] = set()
+        block_defs: set[IRVar] = set()
+        for insn in block.instructions:
+            block_uses.update(v for v in used_variables(insn) if v not in block_defs)
+            dest = defined_variable(insn)
+            if dest is not None:
+                block_defs.add(dest)
+        uses[block] = block_uses
+        defs[block] = block_defs
+
+    live_in = {block: set(uses[block]) for block in cfg.blocks}
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(cfg.blocks):
+            live = set(uses[block])
+            for succ in block.successors:
+                live |= live_in[succ] - defs[block]
+            if live != live_in[block]:
+                live_in[block] = live
+                changed = True
+    return live_in
+
+
+def allocate_registers(
+    instructions: list[Instruction],
+    callee_saved: list[str] = CALLEE_SAVED,
+    caller_saved: list[str] = CALLER_SAVED,
+    unallocated: Set[IRVar] = frozenset(),
+) -> Allocation:
+    """Assigns registers to as many variables of `instructions` as fit.
+    The variables in `unallocated` are never stored, see
+    `instruction_selector`, and get no location.
+
+    Variables that hold a value across a call prefer callee-saved
+    registers, which cost one save for the whole program, and the rest
+    prefer caller-saved ones. When the registers run out, the variable
+    whose interval ends last is spilled.
+
+    With no registers, every variable is spilled.
+    """
+    registers: dict[IRVar, str] = {}
+    spilled: list[LiveInterval] = []
+    # Intervals that currently have a register, by increasing end.
+    active: list[tuple[int, int, LiveInterval]] = []
+    free = set(callee_saved) | set(caller_saved)
+    intervals = live_intervals(instructions, unallocated)
+
+    for n, interval in enumerate(intervals):
+        # An interval that ends where this one starts has had its last
+        # read by the time this one's variable is written.
+        while active and active[0][0] <= interval.start:
+            _, _, expired = active.pop(0)
+            free.add(registers[expired.var])
+
+        if interval.calls:
+            preferred = callee_saved + caller_saved
+        else:
+            preferred = caller_saved + callee_saved
+        register = next((r for r in preferred if r in free), None)
+        if register is None:
+            if not active or active[-1][0] <= interval.end:
+                spilled.append(interval)
+                continue
+            # Take the register of the interval that ends last.
+            _, _, last = active.pop()
+            register = registers.pop(last.var)
+            spilled.append(last)
+        else:
+            free.remove(register)
+        registers[interval.var] = register
+        insort(active, (interval.end, n, interval))
+
+    by_var = {interval.var: interval for interval in intervals}
+    saved_across_call: dict[int, list[str]] = {}
+    for var, register in registers.items():
+        if register in caller_saved:
+            for call in by_var[var].calls:
+                saved_across_call.setdefault(call, []).append(register)
+    used = set(registers.values())
+    return Allocation(
+        registers,
+        _assign_stack_slots(spilled),
+        [r for r in callee_saved if r in used],
+        saved_across_call,
+    )
+
+
+def _assign_stack_slots(intervals: list[LiveInterval]) -> dict[IRVar, int]:
+    """Gives each interval a stack slot that no overlapping interval has.
+
+    Handing out the lowest free slot in order of start uses as few slots
+    as possible, since intervals can be colored greedily.
+    """
+    slots: dict[IRVar, int] = {}
+    # (end, slot) of the intervals that hold a slot.
+    active: list[tuple[int, int]] = []
+    free: list[int] = []
+    for interval in sorted(intervals, key=lambda i: i.start):
+        while active and active[0][0] <= interval.start:
+            heapq.heappush(free, heapq.heappop(active)[1])
+        # The slots in use are numbered from 0, so a new one is next.
+        slot = heapq.heappop(free) if free else len(active)
+        slots[interval.var] = slot
+        heapq.heappush(active, (interval.end, slot))
+    return slots
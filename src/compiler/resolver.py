@@ -0,0 +1,89 @@
+"""Name resolution.
+
+`resolve` binds every variable name in the AST before type checking, so
+that later passes don't have to search through nested scopes.
+
+Each variable declaration gets a symbol: a number, counted from 0 in the
+order the declarations appear in the source. The declared `Identifier`
+and every `Identifier` that refers to the variable get that number in
+their `symbol` field, so passes can keep per-variable data in a list
+indexed by symbol.
+
+Names that the program doesn't declare, like 'print_int', refer to
+globals. Their identifiers keep the symbol GLOBAL and are looked up by
+name in a flat table of globals. Operators can't be declared, so they
+always refer to globals.
+"""
+
+from compiler import ast
+from compiler.traversal import Visit, run
+
+# The symbol of identifiers that don't refer to a declared variable.
+GLOBAL = -1
+
+
+def resolve(root: ast.Expression) -> int:
+    """Sets the symbol of every identifier in `root`.
+
+    Returns the number of declared variables.
+    """
+    # The symbols each name is bound to, innermost scope last.
+    bindings: dict[str, list[int]] = {}
+    # The names declared in each open block, innermost block last.
+    scopes: list[list[str]] = [[]]
+    symbol_count = 0
+
+    def bind(identifier: ast.Identifier) -> None:
+        nonlocal symbol_count
+        identifier.symbol = symbol_count
+        symbol_count += 1
+        bindings.setdefault(identifier.name, []).append(identifier.symbol)
+        scopes[-1].append(identifier.name)
+
+    def visit(node: ast.Expression) -> Visit[None]:
+        match node:
+            case ast.Identifier():
+                symbols = bindings.get(node.name)
+                node.symbol = symbols[-1] if symbols else GLOBAL
+
+            case ast.VarDeclaration() | ast.TypedVarDeclaration():
+                # The initializer can't see the variable it initializes.
+                yield visit(node.expression)
+                bind(node.identifier)
+
+            case ast.Block():
+                scopes.append([])
+                for expr in node.expressions:
+                    if expr is not None:
+                        yield visit(expr)
+                for name in scopes.pop():
+                    bindings[name].pop()
+
+            case ast.Assignment():
+                yield visit(node.identifier)
+                yield visit(node.expression)
+
+            case ast.UnaryOp():
+                yield visit(node.parameter)
+
+            case ast.BinaryOp():
+                yield visit(node.left)
+                yield visit(node.right)
+
+            case ast.Branch():
+                yield visit(node.condition)
+                yield visit(node.then)
+                if node.otherwise is not None:
+                    yield visit(node.otherwise)
+
+            case ast.Loop():
+                yield visit(node.condition)
+                yield visit(node.loop)
+
+            case ast.FuncCall():
+                yield visit(node.identifier)
+                for arg in node.arguments:
+                    yield visit(arg)
+
+    run(visit(root))
+    return symbol_count
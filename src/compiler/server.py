@@ -0,0 +1,537 @@
+import asyncio
+from base64 import b64encode
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from socketserver import StreamRequestHandler, TCPServer
+from traceback import format_exception
+from typing import Any, Callable, Iterator, TypeVar
+
+from compiler import pipeline, trace
+from compiler.assembler import stdlib_object
+from compiler.pipeline import (
+    CompileResult,
+    CompilerOptions,
+    compile_batch,
+    compile_one,
+)
+
+T = TypeVar("T")
+
+
+class RequestTooLarge(Exception):
+    def __init__(self, limit: int) -> None:
+        super().__init__(f"Request too large: more than {limit} bytes")
+
+
+@dataclass
+class ServerOptions:
+    """Tuning knobs for the `serve` command.
+
+    The "prefork" front end serves from a pool of worker processes.
+    Workers are recycled (exited and replaced by a fresh fork of the master)
+    after `max_requests` handled requests or `max_worker_age` seconds,
+    whichever comes first. Zero disables the respective limit.
+
+    The "async" front end accepts connections on an asyncio event loop and
+    compiles on a process pool. At most `max_inflight` compilations run at
+    once and at most `max_queued` more wait for a slot; requests beyond that
+    are rejected immediately with a "Server busy" error.
+
+    With either front end, clients that take longer than `read_timeout`
+    seconds to send their request are dropped. Zero disables the limit.
+    Requests larger than `max_request_size` bytes are rejected.
+
+    Every compile request is compiled with `compiler_options`.
+
+    The async front end spreads `compile_batch` requests over its executor.
+    A prefork worker uses its own pool of `batch_jobs` processes, created
+    on first use. The default of 0 divides the cores between the workers,
+    which means compiling in the worker itself when there are as many
+    workers as cores.
+
+    With `executor` "thread", those executors are thread pools instead of
+    process pools. The compiler is safe to run on threads, but only the
+    assembler and linker subprocesses run in parallel unless Python is a
+    free-threaded build.
+    """
+
+    frontend: str = "prefork"
+    workers: int = os.cpu_count() or 1
+    max_requests: int = 0
+    max_worker_age: float = 0.0
+    reuse_port: bool = False
+    request_queue_size: int = 32
+    max_inflight: int = os.cpu_count() or 1
+    max_queued: int = 64
+    read_timeout: float = 30.0
+    max_request_size: int = 64 * 1024 * 1024
+    batch_jobs: int = 0
+    executor: str = "process"
+    compiler_options: CompilerOptions = field(default_factory=CompilerOptions)
+
+    def effective_batch_jobs(self) -> int:
+        if self.batch_jobs > 0:
+            return self.batch_jobs
+        return max(1, (os.cpu_count() or 1) // max(self.workers, 1))
+
+
+def _make_executor(kind: str, jobs: int) -> Executor:
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max(jobs, 1))
+    # make_process_pool starts the executor processes from a fork server,
+    # so they don't inherit the sockets of open connections.
+    return pipeline.make_process_pool(jobs)
+
+
+def _batch_programs(input: dict[str, Any]) -> list[tuple[str, str]]:
+    return [(code, f"(program {i})") for i, code in enumerate(input["programs"])]
+
+
+def _result_object(result: CompileResult) -> dict[str, Any]:
+    obj: dict[str, Any]
+    if result.executable is not None:
+        obj = {"program": b64encode(result.executable).decode()}
+    else:
+        obj = {"error": result.error}
+    if result.profile is not None:
+        obj["profile"] = result.profile.to_json()
+    return obj
+
+
+def handle_command(
+    input: dict[str, Any],
+    options: CompilerOptions = CompilerOptions(),
+    batch_executor: Executor | None = None,
+    batch_jobs: int = 1,
+) -> dict[str, Any]:
+    """Executes one decoded server request and returns the response object.
+
+    The programs of a `compile_batch` request are compiled on
+    `batch_executor` if given, otherwise one after another.
+    Compile requests with `"profile": true` get a per-stage profile
+    in their response. A `compile` request with `"trace": [channels...]`
+    gets the output of those trace channels (unless the executable came
+    from the cache).
+    """
+    result: dict[str, Any] = {}
+    try:
+        if input["command"] == "compile":
+            with trace.tracing(input.get("trace", [])) as trace_lines:
+                compiled = compile_one(
+                    input["code"],
+                    "(source code)",
+                    options,
+                    input.get("profile", False),
+                )
+            result = _result_object(compiled)
+            if "trace" in input:
+                result["trace"] = trace_lines
+        elif input["command"] == "compile_batch":
+            results = compile_batch(
+                _batch_programs(input),
+                options,
+                batch_executor,
+                batch_jobs,
+                input.get("profile", False),
+            )
+            result["results"] = [_result_object(r) for r in results]
+        elif input["command"] == "ping":
+            pass
+        elif input["command"] == "cache_stats":
+            cache = pipeline.compilation_cache
+            result["cache"] = cache.stats() if cache is not None else None
+        elif input["command"] == "stats":
+            stats = pipeline.stage_stats
+            result["stats"] = stats.stats() if stats is not None else None
+        else:
+            result["error"] = "Unknown command: " + input["command"]
+    except Exception as e:
+        result["error"] = "".join(format_exception(e))
+    return result
+
+
+class Handler(StreamRequestHandler):
+    def handle(self) -> None:
+        result: dict[str, Any]
+        server = self.server
+        assert isinstance(server, WorkerServer)
+        # A worker serves one connection at a time, so a client that never
+        # finishes its request must not keep the worker forever.
+        timeout = server.options.read_timeout or None
+        try:
+            input_bytes = self._read_request(timeout, server.options.max_request_size)
+        except (TimeoutError, ConnectionError):
+            return
+        except RequestTooLarge as e:
+            result = {"error": str(e)}
+        else:
+            try:
+                result = handle_command(
+                    json.loads(input_bytes.decode()),
+                    server.options.compiler_options,
+                    server.batch_executor(),
+                    server.options.effective_batch_jobs(),
+                )
+            except Exception as e:
+                result = {"error": "".join(format_exception(e))}
+        result_str = json.dumps(result)
+        self.request.settimeout(timeout)
+        try:
+            self.request.sendall(str.encode(result_str))
+        except (TimeoutError, ConnectionError):
+            pass
+
+    def _read_request(self, timeout: float | None, max_size: int) -> bytes:
+        """Reads until the client shuts down its side of the connection.
+
+        Raises TimeoutError if that takes longer than `timeout` seconds,
+        and RequestTooLarge if the request has more than `max_size` bytes.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        chunks: list[bytes] = []
+        size = 0
+        while True:
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+                self.request.settimeout(remaining)
+            chunk = self.request.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            size += len(chunk)
+            if size > max_size:
+                raise RequestTooLarge(max_size)
+            chunks.append(chunk)
+
+
+class WorkerServer(TCPServer):
+    """A TCP server that handles requests inline, one at a time.
+
+    Several worker processes accept from the same listening socket
+    (or from their own SO_REUSEPORT sockets), so the listening socket
+    is non-blocking: a worker that loses the race for a connection
+    simply goes back to waiting instead of blocking in accept().
+    """
+
+    allow_reuse_address = True
+    handled = 0
+    options: ServerOptions
+    _batch_executor: Executor | None = None
+
+    def server_activate(self) -> None:
+        super().server_activate()
+        self.socket.setblocking(False)
+
+    def get_request(self) -> tuple[socket.socket, Any]:
+        request, client_address = self.socket.accept()
+        request.setblocking(True)
+        return request, client_address
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.handled += 1
+        super().process_request(request, client_address)
+
+    def batch_executor(self) -> Executor | None:
+        jobs = self.options.effective_batch_jobs()
+        if jobs <= 1:
+            return None
+        if self._batch_executor is None:
+            self._batch_executor = _make_executor(self.options.executor, jobs)
+        return self._batch_executor
+
+    def server_close(self) -> None:
+        super().server_close()
+        if self._batch_executor is not None:
+            self._batch_executor.shutdown()
+            self._batch_executor = None
+
+
+def _make_server(host: str, port: int, options: ServerOptions) -> WorkerServer:
+    server_options = options
+
+    class Server(WorkerServer):
+        allow_reuse_port = server_options.reuse_port
+        options = server_options
+        request_queue_size = server_options.request_queue_size
+
+    return Server((host, port), Handler)
+
+
+def _serve_worker(server: WorkerServer, options: ServerOptions) -> None:
+    deadline = (
+        time.monotonic() + options.max_worker_age if options.max_worker_age else None
+    )
+    # The poll interval bounds how late a worker notices its age limit.
+    server.timeout = 1.0
+    while options.max_requests == 0 or server.handled < options.max_requests:
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+        server.handle_request()
+
+
+# The signals that stop the server.
+_STOP_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
+
+@contextmanager
+def _stop_signals_blocked() -> Iterator[None]:
+    """Holds back the stop signals until the block ends.
+
+    A stop signal makes the master terminate all workers it knows of,
+    so it must not arrive between forking a worker and recording its pid.
+    Neither may it reach a new worker before it has reset the master's
+    signal handlers: Python would run the master's handler, or drop the
+    signal once the handler is reset.
+    """
+    signal.pthread_sigmask(signal.SIG_BLOCK, _STOP_SIGNALS)
+    try:
+        yield
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _STOP_SIGNALS)
+
+
+def _spawn_worker(
+    host: str, port: int, options: ServerOptions, server: WorkerServer | None
+) -> int:
+    """Forks a worker and returns its pid in the master.
+
+    Must be called with the stop signals blocked, see `_stop_signals_blocked`.
+    """
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    # Child process: let signals terminate us normally and never return
+    # into the master's code.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _STOP_SIGNALS)
+    exit_code = 0
+    try:
+        if server is None:
+            server = _make_server(host, port, options)
+        _serve_worker(server, options)
+        server.server_close()
+    except BaseException as e:
+        print("".join(format_exception(e)), file=sys.stderr)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def run_server(host: str, port: int, options: ServerOptions | None = None) -> None:
+    """Serves compile requests from a pool of pre-forked worker processes.
+
+    Without `reuse_port`, the master binds the listening socket once and all
+    workers accept from it. With `reuse_port`, every worker binds its own
+    SO_REUSEPORT socket and the kernel balances connections between them.
+    Note that connections still queued on a recycled worker's own socket are
+    reset when it exits, so prefer a shared socket when recycling often.
+    Workers that exit, whether recycled or crashed, are replaced.
+    """
+    if options is None:
+        options = ServerOptions()
+
+    def terminate(signum: int, frame: Any) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    shared_server = None if options.reuse_port else _make_server(host, port, options)
+
+    print(
+        f"Starting TCP server at {host}:{port} with {options.workers} workers"
+        + (" (SO_REUSEPORT)" if options.reuse_port else "")
+    )
+    sys.stdout.flush()
+
+    # Assemble the stdlib once here instead of once in every worker.
+    stdlib_object()
+
+    # Everything the master has allocated so far (most importantly the
+    # imported compiler modules) is shared with the workers. Freezing it
+    # keeps the garbage collector from touching those pages and
+    # triggering copy-on-write faults in every worker.
+    gc.collect()
+    gc.freeze()
+
+    workers: set[int] = set()
+    try:
+        for _ in range(max(options.workers, 1)):
+            with _stop_signals_blocked():
+                workers.add(_spawn_worker(host, port, options, shared_server))
+        while True:
+            pid, status = os.wait()
+            if pid not in workers:
+                continue
+            workers.remove(pid)
+            if os.waitstatus_to_exitcode(status) != 0:
+                # Avoid a tight fork loop if workers fail at startup.
+                time.sleep(0.1)
+            with _stop_signals_blocked():
+                workers.add(_spawn_worker(host, port, options, shared_server))
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        if shared_server is not None:
+            shared_server.server_close()
+
+
+class AsyncServer:
+    """Accepts connections on an event loop and compiles on a bounded executor.
+
+    Reading requests and writing responses happen on the event loop, so
+    slow clients only hold a cheap coroutine. Only the CPU-bound work is
+    handed to the executor, and admission control decides up front whether
+    a request may wait for an executor slot.
+    """
+
+    def __init__(self, options: ServerOptions, executor: Executor) -> None:
+        self.options = options
+        self.executor = executor
+        self.slots = asyncio.Semaphore(max(options.max_inflight, 1))
+        self.pending = 0
+
+    def capacity(self) -> int:
+        """Returns how many requests may be in flight or queued at once."""
+        return max(self.options.max_inflight, 1) + self.options.max_queued
+
+    def admit(self, count: int = 1) -> bool:
+        """Returns whether `count` more requests fit in flight or queued."""
+        return self.pending + count <= self.capacity()
+
+    async def dispatch(self, input: dict[str, Any]) -> dict[str, Any]:
+        if input.get("command") == "ping":
+            return {}
+        # Each program of a batch takes a place of its own.
+        programs = None
+        count = 1
+        if input.get("command") == "compile_batch":
+            programs = _batch_programs(input)
+            count = len(programs)
+        if count > self.capacity():
+            return {
+                "error": f"Batch too large: {count} programs,"
+                f" at most {self.capacity()} fit in flight or queued"
+            }
+        if not self.admit(count):
+            return {
+                "error": f"Server busy: {self.pending} requests in flight or queued"
+            }
+        self.pending += count
+        try:
+            if programs is None:
+                return await self.run(
+                    handle_command, input, self.options.compiler_options
+                )
+            results = await asyncio.gather(
+                *(
+                    self.run(
+                        compile_one,
+                        s,
+                        n,
+                        self.options.compiler_options,
+                        input.get("profile", False),
+                    )
+                    for s, n in programs
+                )
+            )
+            return {"results": [_result_object(r) for r in results]}
+        finally:
+            self.pending -= count
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """Runs `func` on the executor once a slot is free."""
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+
+    async def read_request(self, reader: asyncio.StreamReader) -> bytes:
+        """Reads until the client shuts down its side of the connection.
+
+        Raises RequestTooLarge if the request has more than
+        `max_request_size` bytes.
+        """
+        data = bytearray()
+        while chunk := await reader.read(65536):
+            data += chunk
+            if len(data) > self.options.max_request_size:
+                raise RequestTooLarge(self.options.max_request_size)
+        return bytes(data)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        result: dict[str, Any]
+        try:
+            input_bytes = await asyncio.wait_for(
+                self.read_request(reader), self.options.read_timeout or None
+            )
+        except (TimeoutError, ConnectionError):
+            writer.close()
+            return
+        except RequestTooLarge as e:
+            result = {"error": str(e)}
+        else:
+            try:
+                result = await self.dispatch(json.loads(input_bytes.decode()))
+            except Exception as e:
+                result = {"error": "".join(format_exception(e))}
+        writer.write(json.dumps(result).encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(
+            self.handle_connection,
+            host,
+            port,
+            backlog=self.options.request_queue_size,
+            reuse_address=True,
+            reuse_port=self.options.reuse_port or None,
+        )
+        async with server:
+            await server.serve_forever()
+
+
+def run_async_server(
+    host: str, port: int, options: ServerOptions | None = None
+) -> None:
+    """Serves compile requests from an asyncio front end.
+
+    See `ServerOptions` for the concurrency and backpressure settings.
+    """
+    if options is None:
+        options = ServerOptions(frontend="async")
+
+    print(
+        f"Starting asyncio TCP server at {host}:{port}"
+        f" ({options.max_inflight} in flight, {options.max_queued} queued)"
+    )
+    sys.stdout.flush()
+
+    with _make_executor(options.executor, options.max_inflight) as executor:
+        asyncio.run(AsyncServer(options, executor).serve(host, port))
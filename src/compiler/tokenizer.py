@@ -1,10 +1,11 @@
-from typing import Optional
-
 import re
 
+from collections import deque
 from dataclasses import dataclass
+from typing import Iterable, Iterator
 from enum import Enum
-from functools import partial
+
+from compiler import trace
 
 
 class TokenType(Enum):
@@ -17,7 +18,7 @@ class TokenType(Enum):
     OTHER = 9
 
 
-@dataclass
+@dataclass(slots=True)
 class Location:
     line: int
     column: int
@@ -41,7 +42,7 @@ class Location:
 L: Location = Location(-1, -1)
 
 
-@dataclass
+@dataclass(slots=True)
 class Token:
     """Class for language tokens"""
 
@@ -50,60 +51,144 @@ class Token:
     location: Location
 
 
-identifierR = r"(?P<identifier>(?:_|[a-z]|[A-Z])(?:_|[a-z]|[A-Z]|[0-9])*)"
+identifierR = r"(?P<identifier>[_a-zA-Z][_a-zA-Z0-9]*)"
 int_lit = r"(?P<int_lit>[0-9]+)"
 bool_lit = r"(?P<bool_lit>true|false)"
-operator = r"(?P<operator>==|!=|<=|>=|\+|\-|\*|\/|=|<|>|%|or|and|not)"
-punctuation = r"(?P<punctuation>\(|\)|\{|\}|,|\.|;)"
+operator = r"(?P<operator>==|!=|<=|>=|[-+*/=<>%]|or|and|not)"
+punctuation = r"(?P<punctuation>[(){},.;])"
 comment = r"\/\/.*|#.*"
 
 
-def tupleToToken(
-    row: int, line: str, tuple: tuple[str, str, str, str, str]
-) -> Optional[Token]:
-    (bool, oper, ident, int, punct) = tuple
-
-    if tuple == ("", "", "", "", ""):
-        return None
-
-    if ident != "":
-        tokenType = TokenType.IDENTIFIER
-        tok = ident
-
-    if int != "":
-        tokenType = TokenType.INT_LITERAL
-        tok = int
-
-    if bool != "":
-        tokenType = TokenType.BOOL_LITERAL
-        tok = bool
-
-    if oper != "":
-        tokenType = TokenType.OPERATOR
-        tok = oper
+# The alternatives are tried in this order at every position, so e.g.
+# "true" is a bool literal and "or" an operator rather than identifiers.
+_matcher = re.compile(
+    "|".join([comment, bool_lit, operator, identifierR, int_lit, punctuation])
+)
 
-    if punct != "":
-        tokenType = TokenType.PUNCTUATION
-        tok = punct
-
-    col = line.find(tok) + 1  # Adding one to get first column to be one.
-
-    return Token(tokenType, tok, Location(row, col))
+# Token type of each named group. Comments have no group and are dropped.
+_group_types = {
+    "bool_lit": TokenType.BOOL_LITERAL,
+    "operator": TokenType.OPERATOR,
+    "identifier": TokenType.IDENTIFIER,
+    "int_lit": TokenType.INT_LITERAL,
+    "punctuation": TokenType.PUNCTUATION,
+}
 
 
 def tokenize(source_code: str) -> list[Token]:
-    regexStringList = [comment, bool_lit, operator, identifierR, int_lit, punctuation]
-
-    codeLines = source_code.splitlines()
-
-    matcher = re.compile("|".join(regexStringList))
+    """Splits the source code into tokens.
+
+    Characters that don't start any token, such as whitespace, are skipped.
+    The source is scanned once, and line and column numbers are derived
+    from the match offsets, so this takes linear time.
+    """
+    tokens = list(_scan(source_code, len(source_code), 1))
+    if trace.on.tokenizer:
+        for token in tokens:
+            _trace_token(token)
+    return tokens
 
-    tokens: list[Token] = []
-    row = 1
-    for line in codeLines:
-        tokenTuples = matcher.findall(line)
-        tupToToken = partial(tupleToToken, row, line)
-        tokens += filter(None, map(tupToToken, tokenTuples))
-        row += 1
 
-    return tokens
+def tokenize_stream(chunks: Iterable[str]) -> Iterator[Token]:
+    """Like `tokenize`, but takes the source code as consecutive chunks of
+    text and yields the tokens as they are found.
+
+    Tokens never span lines, so each chunk is scanned up to its last line
+    break, and only the incomplete line after that is carried over to the
+    next chunk. Memory use is bounded by the chunk size and the longest line.
+    """
+    tracing = trace.on.tokenizer
+    line = 1
+    pending = ""
+    for chunk in chunks:
+        text = pending + chunk
+        end = text.rfind("\n") + 1
+        for token in _scan(text, end, line):
+            if tracing:
+                _trace_token(token)
+            yield token
+        line += text.count("\n", 0, end)
+        pending = text[end:]
+    for token in _scan(pending, len(pending), line):
+        if tracing:
+            _trace_token(token)
+        yield token
+
+
+def _scan(text: str, end: int, first_line: int) -> Iterator[Token]:
+    """Yields the tokens in `text[:end]`, which starts at line `first_line`."""
+    line = first_line
+    line_start = 0  # Offset of the first character of `line`.
+    scanned = 0  # Offset up to which newlines have been counted.
+    count_newlines = text.count
+    for match in _matcher.finditer(text, 0, end):
+        group = match.lastgroup
+        if group is None:
+            continue
+        start = match.start()
+        if count_newlines("\n", scanned, start):
+            line += count_newlines("\n", scanned, start)
+            line_start = text.rindex("\n", scanned, start) + 1
+        scanned = start
+        yield Token(
+            _group_types[group], match[0], Location(line, start - line_start + 1)
+        )
+
+
+def _trace_token(token: Token) -> None:
+    trace.emit("tokenizer", f"{token.location}: {token.type.name} {token.text!r}")
+
+
+# Tokens that `TokenStream.lookback` can return.
+LOOKBACK = 2
+
+
+class TokenStream:
+    """Tokens pulled on demand from an iterator, for the parser.
+
+    `current` is the next token to consume. Only that, the tokens the
+    parser has peeked at beyond it, and the last `LOOKBACK` consumed
+    tokens are kept in memory. Past the end, an END token is returned.
+    """
+
+    def __init__(self, tokens: Iterable[Token]) -> None:
+        self._tokens = iter(tokens)
+        self._ahead: deque[Token] = deque()
+        self._behind: deque[Token] = deque(maxlen=LOOKBACK)
+        self.position = 0
+        self.current: Token = next(self._tokens, END_TOKEN)
+        self.first = self.current if self.current.type != TokenType.END else None
+
+    def peek(self, lookahead: int = 0) -> Token:
+        if lookahead == 0:
+            return self.current
+        while len(self._ahead) < lookahead:
+            token = next(self._tokens, None)
+            if token is None:
+                return END_TOKEN
+            self._ahead.append(token)
+        return self._ahead[lookahead - 1]
+
+    def lookback(self, amount: int = 1) -> Token:
+        """Returns the token consumed `amount` tokens ago.
+
+        Like the list-based parser did, this never returns the very first
+        token; it returns an END token instead.
+        """
+        if amount > LOOKBACK:
+            raise ValueError(f"Can't look back more than {LOOKBACK} tokens")
+        if self.position - amount > 0:
+            return self._behind[-amount]
+        return END_TOKEN
+
+    def advance(self) -> None:
+        self._behind.append(self.current)
+        self.position += 1
+        if self._ahead:
+            self.current = self._ahead.popleft()
+        else:
+            self.current = next(self._tokens, END_TOKEN)
+
+
+# Returned for every position past the last token. Must not be modified.
+END_TOKEN = Token(location=L, type=TokenType.END, text="")
@@ -0,0 +1,99 @@
+"""Debug tracing with named channels.
+
+All channels are off by default. Call sites check the channel's flag
+before building the message, so a disabled channel costs one attribute
+lookup:
+
+    if trace.on.parser:
+        trace.emit("parser", f"parsed {expr}")
+
+Channels are enabled for the whole process with the environment variable
+`COMPILER_TRACE` (a comma-separated list of channel names, or "all") or
+`enable()`, or temporarily for the current thread with `tracing()`.
+
+The channel flags and the output are per thread, so threads compiling at
+the same time can trace into separate lists.
+"""
+
+from contextlib import contextmanager
+import os
+import sys
+import threading
+from typing import Callable, Iterable, Iterator
+
+CHANNELS = ("tokenizer", "parser", "ir", "asm")
+
+
+# The channels enabled in threads that start using `on`.
+_default_channels: set[str] = set()
+
+
+class _Channels(threading.local):
+    tokenizer: bool
+    parser: bool
+    ir: bool
+    asm: bool
+
+    def __init__(self) -> None:
+        # Runs in each thread the first time it uses `on`.
+        self.disable_all()
+        self.enable(_default_channels)
+        self.sink: Callable[[str], None] = _write_stderr
+
+    def disable_all(self) -> None:
+        for channel in CHANNELS:
+            setattr(self, channel, False)
+
+    def enable(self, channels: Iterable[str]) -> None:
+        for channel in channels:
+            if channel == "all":
+                self.enable(CHANNELS)
+            elif channel in CHANNELS:
+                setattr(self, channel, True)
+            elif channel != "":
+                raise ValueError(f"Unknown trace channel: {channel}")
+
+    def enabled(self) -> list[str]:
+        return [c for c in CHANNELS if getattr(self, c)]
+
+
+def _write_stderr(line: str) -> None:
+    print(line, file=sys.stderr)
+
+
+# Flags of the channels enabled in the current thread, e.g. `on.parser`.
+on = _Channels()
+
+
+def enable(channels: Iterable[str]) -> None:
+    """Enables `channels` in the current thread and in every thread that
+    hasn't traced anything yet.
+    """
+    on.enable(channels)
+    _default_channels.update(on.enabled())
+
+
+def emit(channel: str, message: str) -> None:
+    on.sink(f"[{channel}] {message}")
+
+
+@contextmanager
+def tracing(channels: Iterable[str]) -> Iterator[list[str]]:
+    """Enables `channels` in the current thread on top of the already
+    enabled ones, and collects everything the thread traces inside the
+    `with` block into the yielded list instead of writing it to stderr.
+    """
+    previous_channels = on.enabled()
+    previous_sink = on.sink
+    lines: list[str] = []
+    on.enable(channels)
+    on.sink = lines.append
+    try:
+        yield lines
+    finally:
+        on.sink = previous_sink
+        on.disable_all()
+        on.enable(previous_channels)
+
+
+enable(os.environ.get("COMPILER_TRACE", "").split(","))
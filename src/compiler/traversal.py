@@ -0,0 +1,56 @@
+"""Runs recursive tree traversals without Python recursion.
+
+A traversal is written as a generator function. Where it would call
+itself recursively, it yields the generator for the recursive call
+instead, and receives that call's result as the value of the yield:
+
+    def visit(node: Node) -> Visit[int]:
+        if node.children == []:
+            return 1
+        total = 1
+        for child in node.children:
+            total += yield visit(child)
+        return total
+
+    size = run(visit(root))
+
+`run` keeps the pending calls on an explicit stack, so the depth of the
+tree is limited only by memory. Exceptions propagate up through the
+pending calls as they would through ordinary recursion.
+"""
+
+from typing import Any, Generator, TypeVar
+
+T = TypeVar("T")
+
+# A traversal step that yields recursive calls and returns a T.
+Visit = Generator["Visit[Any]", Any, T]
+
+
+def run(root: Visit[T]) -> T:
+    """Runs the traversal `root` to completion and returns its result."""
+    stack: list[Visit[Any]] = [root]
+    value: Any = None
+    error: BaseException | None = None
+    while True:
+        top = stack[-1]
+        try:
+            if error is not None:
+                e, error = error, None
+                child = top.throw(e)
+            else:
+                child = top.send(value)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value  # type: ignore[no-any-return]
+            value = stop.value
+            continue
+        except BaseException as e:
+            stack.pop()
+            if not stack:
+                raise
+            error = e
+            continue
+        stack.append(child)
+        value = None
@@ -1,4 +1,6 @@
 import compiler.ast as ast
+from compiler.resolver import GLOBAL, resolve
+from compiler.traversal import Visit, run
 from compiler.types import Int, Bool, Unit, SymTab, Type, FunType, Any
 
 "<=", ">=", "<", ">"
@@ -14,6 +16,7 @@ top_level_SymTab = SymTab(
         "-": FunType([Int(), Int()], Int()),
         "/": FunType([Int(), Int()], Int()),
         "*": FunType([Int(), Int()], Int()),
+        "%": FunType([Int(), Int()], Int()),
         "<=": FunType([Int(), Int()], Bool()),
         ">=": FunType([Int(), Int()], Bool()),
         "<": FunType([Int(), Int()], Bool()),
@@ -27,148 +30,185 @@ top_level_SymTab = SymTab(
 )
 
 
-def mkSym(symtab: SymTab) -> SymTab:
-    return SymTab(symtab, {})
-
-
 def typecheck(node: ast.Expression, symtab: SymTab = top_level_SymTab) -> Type:
+    """Sets the type of every node in `node` and returns the type of `node`.
+
+    `symtab` gives the types of the globals. Names are resolved first, see
+    compiler.resolver.
+    """
+    variable_count = resolve(node)
+    global_types: dict[str, Type] = {}
+    scope: SymTab | None = symtab
+    while scope is not None:
+        global_types = scope.locals | global_types
+        scope = scope.parent
+    return run(check(node, TypeEnv(global_types, [Unit()] * variable_count)))
+
+
+class TypeEnv:
+    """The types of the globals by name, and of the variables by symbol."""
+
+    def __init__(self, globals: dict[str, Type], variables: list[Type]) -> None:
+        self.globals = globals
+        self.variables = variables
+
+    def lookup(self, identifier: ast.Identifier) -> Type | None:
+        if identifier.symbol == GLOBAL:
+            return self.globals.get(identifier.name)
+        return self.variables[identifier.symbol]
+
+    def declare(self, identifier: ast.Identifier, t: Type) -> None:
+        symbol = identifier.symbol
+        if symbol >= len(self.variables):
+            self.variables.extend([Unit()] * (symbol + 1 - len(self.variables)))
+        self.variables[symbol] = t
+
+
+# The type checker proper. It's a generator so that 'run' can drive it
+# without recursion: the type of a child node is '(yield check(...))'.
+#
+# The rules for each kind of node are in the functions below, which the
+# IR generator also uses when it checks types itself.
+def check(node: ast.Expression, env: TypeEnv) -> Visit[Type]:
     retVal: Type = Unit()
     match node:
         case ast.Literal():
-            # print(type(node.value))
-            if isinstance(node.value, bool):
-                retVal = Bool()
-            elif isinstance(node.value, int):
-                retVal = Int()
-            else:
-                retVal = Unit()
+            retVal = literal_type(node)
 
         case ast.Identifier():
-            ident_type = symtab.locals.get(node.name, None)
-            parent = symtab.parent
-            while ident_type is None and parent is not None:
-                ident_type = parent.locals.get(node.name)
-                parent = parent.parent
-
-            if ident_type is None:
-                raise Exception(
-                    f"Type error at {node.location}: identifier {node.name} not found in symbolic table"
-                )
-
-            retVal = ident_type if ident_type is not None else Unit()
+            retVal = identifier_type(node, env.lookup(node))
 
         case ast.Assignment():
-            ident_type = typecheck(node.identifier, symtab)
-            expr_type = typecheck(node.expression, symtab)
-
-            if ident_type != expr_type:
-                raise Exception(
-                    f"Type Error at {node.location}: Trying to assign type {expr_type} to variable with type {ident_type}"
-                )
-
-            retVal = expr_type
+            ident_type = yield check(node.identifier, env)
+            expr_type = yield check(node.expression, env)
+            retVal = assignment_type(node, ident_type, expr_type)
 
         case ast.VarDeclaration():
-            expr_type = typecheck(node.expression, symtab)
-            symtab.locals[node.identifier.name] = expr_type
-            ident_type = typecheck(node.identifier, symtab)
+            expr_type = yield check(node.expression, env)
+            env.declare(node.identifier, expr_type)
+            yield check(node.identifier, env)
             retVal = expr_type
 
         case ast.Branch():
-            localSymtab = mkSym(symtab)
-            t1 = typecheck(node.condition, localSymtab)
-            if t1 != Bool():
-                raise Exception(
-                    f"Type error at {node.condition.location}, Branch condition must be of type Bool() not {t1}"
-                )
-
-            t2 = typecheck(node.then, symtab)
-            t3 = (
-                typecheck(node.otherwise, localSymtab)
+            check_branch_condition(node, (yield check(node.condition, env)))
+            then_type = yield check(node.then, env)
+            otherwise_type = (
+                (yield check(node.otherwise, env))
                 if node.otherwise is not None
-                else t2
+                else then_type
             )
-            if t2 != t3:
-                raise Exception(
-                    f"Type error at {node.location}, branch types differ: then is {t2} and otherwise is {t3}"
-                )
-            retVal = t2
+            retVal = branch_type(node, then_type, otherwise_type)
 
         case ast.Block():
-            localSymtab = mkSym(symtab)
             finalType: Type = Unit()
             for expr in node.expressions:
-                finalType = typecheck(expr, localSymtab) if expr is not None else Unit()
+                finalType = (yield check(expr, env)) if expr is not None else Unit()
             retVal = finalType
 
         case ast.UnaryOp():
-            expr_type = typecheck(node.parameter, symtab)
-            if node.op == "-" and expr_type != Int():
-                raise Exception(
-                    f"Type Error at {node.location}, unary - expecting Int(), got {expr_type}"
-                )
-            elif node.op == "not" and expr_type != Bool():
-                raise Exception(
-                    f"Type Error at {node.location}, unary not expecting Bool(), got {expr_type}"
-                )
-
-            retVal = expr_type
+            retVal = unary_type(node, (yield check(node.parameter, env)))
 
         case ast.BinaryOp():
-
-            op_type: Type | None = symtab.locals.get(node.op, None)
-            parent = symtab.parent
-            while op_type is None and parent is not None:
-                op_type = parent.locals.get(node.op, None)
-                parent = parent.parent
-
-            left_type = typecheck(node.left, symtab)
-            right_type = typecheck(node.right, symtab)
-
-            if op_type is None or not isinstance(op_type, FunType):
-                raise Exception(
-                    f"Type Error at {node.location}: Could not find operator type in Symbolic table"
-                )
-
-            if [left_type, right_type] != op_type.arguments:
-                raise Exception(
-                    f"Type Error at {node.location}: Operator types don't match arguments, expected {op_type.arguments}, got {[left_type, right_type]}"
-                )
-
-            retVal = op_type.return_value
+            left_type = yield check(node.left, env)
+            right_type = yield check(node.right, env)
+            retVal = binary_type(node, env.globals.get(node.op), left_type, right_type)
 
         case ast.Loop():
-            cond_type = typecheck(node.condition, symtab)
-            if cond_type != Bool:
-                raise Exception(f"Type Error at {node.location}")
-
-            typecheck(node.loop, symtab)
-
+            check_loop_condition(node, (yield check(node.condition, env)))
+            yield check(node.loop, env)
             retVal = Unit()
 
         case ast.FuncCall():
             arg_types: list[Type] = []
             for arg in node.arguments:
-                arg_types.append(typecheck(arg, symtab))
+                arg_types.append((yield check(arg, env)))
+            retVal = call_type(node, env.lookup(node.identifier), arg_types)
 
-            supposed_type: Type | None = symtab.locals.get(node.identifier.name, None)
-            parent = symtab.parent
-            while supposed_type is None and parent is not None:
-                supposed_type = parent.locals.get(node.identifier.name, None)
-                parent = parent.parent
+    node.type = retVal
+    return retVal
 
-            if supposed_type is None or not isinstance(supposed_type, FunType):
-                raise Exception(
-                    f"Type Error at {node.location}, could not find function type"
-                )
 
-            if supposed_type.arguments != arg_types:
-                raise Exception(f"Type Error at {node.location}")
+def literal_type(node: ast.Literal) -> Type:
+    if isinstance(node.value, bool):
+        return Bool()
+    elif isinstance(node.value, int):
+        return Int()
+    return Unit()
+
+
+def identifier_type(node: ast.Identifier, ident_type: Type | None) -> Type:
+    if ident_type is None:
+        raise Exception(
+            f"Type error at {node.location}: identifier {node.name} not found in symbolic table"
+        )
+    return ident_type
+
+
+def assignment_type(node: ast.Assignment, ident_type: Type, expr_type: Type) -> Type:
+    if ident_type is not expr_type:
+        raise Exception(
+            f"Type Error at {node.location}: Trying to assign type {expr_type} to variable with type {ident_type}"
+        )
+    return expr_type
+
+
+def check_branch_condition(node: ast.Branch, cond_type: Type) -> None:
+    if cond_type is not Bool():
+        raise Exception(
+            f"Type error at {node.condition.location}, Branch condition must be of type Bool() not {cond_type}"
+        )
+
+
+def branch_type(node: ast.Branch, then_type: Type, otherwise_type: Type) -> Type:
+    if then_type is not otherwise_type:
+        raise Exception(
+            f"Type error at {node.location}, branch types differ: then is {then_type} and otherwise is {otherwise_type}"
+        )
+    return then_type
+
+
+def unary_type(node: ast.UnaryOp, expr_type: Type) -> Type:
+    if node.op == "-" and expr_type is not Int():
+        raise Exception(
+            f"Type Error at {node.location}, unary - expecting Int(), got {expr_type}"
+        )
+    elif node.op == "not" and expr_type is not Bool():
+        raise Exception(
+            f"Type Error at {node.location}, unary not expecting Bool(), got {expr_type}"
+        )
+    return expr_type
+
+
+def binary_type(
+    node: ast.BinaryOp, op_type: Type | None, left_type: Type, right_type: Type
+) -> Type:
+    if op_type is None or not isinstance(op_type, FunType):
+        raise Exception(
+            f"Type Error at {node.location}: Could not find operator type in Symbolic table"
+        )
+
+    if node.op in ("==", "!="):
+        # Any type can be compared, but only with itself.
+        if left_type is not right_type:
+            raise Exception(
+                f"Type Error at {node.location}: Can't compare {left_type} with {right_type}"
+            )
+    elif (left_type, right_type) != op_type.arguments:
+        raise Exception(
+            f"Type Error at {node.location}: Operator types don't match arguments, expected {op_type.arguments}, got {(left_type, right_type)}"
+        )
+    return op_type.return_value
 
-            retVal = supposed_type.return_value
 
-    node.type = retVal
+def check_loop_condition(node: ast.Loop, cond_type: Type) -> None:
+    if cond_type is not Bool():
+        raise Exception(f"Type Error at {node.location}")
 
-    # print(f"node was {node}, returning {retVal}")
 
-    return retVal
+def call_type(node: ast.FuncCall, fun_type: Type | None, arg_types: list[Type]) -> Type:
+    if fun_type is None or not isinstance(fun_type, FunType):
+        raise Exception(f"Type Error at {node.location}, could not find function type")
+
+    if fun_type.arguments != tuple(arg_types):
+        raise Exception(f"Type Error at {node.location}")
+    return fun_type.return_value
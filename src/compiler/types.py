@@ -1,50 +1,73 @@
 from dataclasses import dataclass
-from typing import Self
+from typing import Iterable, Self
 
+# The one instance of every type constructed so far, keyed by its class
+# and, for function types, its argument and return types.
+_interned: dict[object, "Type"] = {}
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Type:
-    """Base class for types"""
+    """Base class for types
+
+    Types are interned: constructing a type that already exists returns
+    the existing instance. Two types are equal only if they are the same
+    object, so they can be compared with `is` and used as dict keys.
+    """
+
+    def __new__(cls) -> Self:
+        instance = _interned.get(cls)
+        if instance is None:
+            instance = _interned.setdefault(cls, super().__new__(cls))
+        return instance  # type: ignore[return-value]
 
+    def __reduce__(self) -> tuple[object, ...]:
+        return (type(self), ())
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, eq=False)
 class Any(Type):
     """Base class for types"""
 
-    def __eq__(self, other: object) -> bool:
-        return isinstance(other, type(self))
-
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Int(Any):
     """Int type"""
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Bool(Any):
     """Bool type"""
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Unit(Any):
     """Unit type"""
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False, init=False)
 class FunType(Any):
     """Function type"""
 
-    arguments: list[Type]
+    arguments: tuple[Type, ...]
     return_value: Type
 
-    def __eq__(self, other: object) -> bool:
-        if not isinstance(other, FunType):
-            return False
-
-        return (
-            self.arguments == other.arguments
-            and self.return_value == other.return_value
-        )
+    def __new__(cls, arguments: Iterable[Type], return_value: Type) -> Self:
+        key = (cls, tuple(arguments), return_value)
+        instance = _interned.get(key)
+        if instance is None:
+            instance = object.__new__(cls)
+            object.__setattr__(instance, "arguments", key[1])
+            object.__setattr__(instance, "return_value", return_value)
+            instance = _interned.setdefault(key, instance)
+        return instance  # type: ignore[return-value]
+
+    def __init__(self, arguments: Iterable[Type], return_value: Type) -> None:
+        # The fields were set by __new__ when the instance was created.
+        pass
+
+    def __reduce__(self) -> tuple[object, ...]:
+        return (type(self), (self.arguments, self.return_value))
 
 
 @dataclass
@@ -0,0 +1,168 @@
+import errno
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Any
+
+import pytest
+
+from compiler import assembler
+from compiler.instrumentation import CompileProfile
+
+needs_binutils = pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+
+
+def count_assembler_runs(monkeypatch: pytest.MonkeyPatch) -> list[int]:
+    runs = [0]
+    run_tool = assembler._run_tool
+
+    def counting_run_tool(args: list[str], **kwargs: Any) -> None:
+        if args[0] == "as":
+            runs[0] += 1
+        run_tool(args, **kwargs)
+
+    monkeypatch.setattr(assembler, "_run_tool", counting_run_tool)
+    # Forget the objects this process has already assembled.
+    monkeypatch.setattr(assembler, "_stdlib_objects", {})
+    return runs
+
+
+@needs_binutils
+def test_stdlib_is_assembled_once_and_reused(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("COMPILER_STDLIB_CACHE", str(tmp_path / "cache"))
+    runs = count_assembler_runs(monkeypatch)
+    obj = assembler.stdlib_object()
+    assert assembler.stdlib_object() == obj
+    assert Path(obj).parent == tmp_path / "cache"
+    assert (tmp_path / "cache").stat().st_mode & 0o777 == 0o700
+    # Another process finds the object in the cache directory.
+    monkeypatch.setattr(assembler, "_stdlib_objects", {})
+    assert assembler.stdlib_object() == obj
+    assert runs == [1]
+
+
+@needs_binutils
+def test_stdlib_cache_writable_by_others_is_not_used(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    monkeypatch.setenv("COMPILER_STDLIB_CACHE", str(shared))
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    runs = count_assembler_runs(monkeypatch)
+    obj = assembler.stdlib_object()
+    # It was assembled in a new directory instead.
+    assert Path(obj).parent.parent == tmp_path
+    assert Path(obj).parent != shared
+    assert list(shared.iterdir()) == []
+    assert runs == [1]
+
+
+def scratch_directory_with(monkeypatch: pytest.MonkeyPatch, workdir: str) -> str | None:
+    monkeypatch.setenv("COMPILER_WORKDIR", workdir)
+    assembler.scratch_directory.cache_clear()
+    try:
+        return assembler.scratch_directory()
+    finally:
+        # Don't leave the result for this environment in the cache.
+        assembler.scratch_directory.cache_clear()
+
+
+def test_scratch_directory_is_compiler_workdir(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    assert scratch_directory_with(monkeypatch, str(tmp_path)) == str(tmp_path)
+
+
+def test_scratch_directory_falls_back_to_shared_memory(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    shm_usable = os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK)
+    expected = "/dev/shm" if shm_usable else None
+    assert scratch_directory_with(monkeypatch, str(tmp_path / "missing")) == expected
+
+
+def cross_device_replace(source: str, destination: str) -> None:
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+
+def make_executable(path: Path) -> None:
+    path.write_bytes(b"executable")
+    os.chmod(path, 0o755)
+
+
+def test_move_file_renames(tmp_path: Path) -> None:
+    make_executable(tmp_path / "a")
+    assembler._move_file(str(tmp_path / "a"), str(tmp_path / "b"))
+    assert not (tmp_path / "a").exists()
+    assert (tmp_path / "b").read_bytes() == b"executable"
+    assert (tmp_path / "b").stat().st_mode & 0o777 == 0o755
+
+
+def test_move_file_across_file_systems_uses_copy_file_range(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    copies: list[int] = []
+
+    # Copies a few bytes at a time, like a partial copy_file_range would.
+    # os.copy_file_range is not available on every platform.
+    def copy_file_range(src: int, dst: int, count: int) -> int:
+        copies.append(count)
+        return os.write(dst, os.read(src, min(count, 4)))
+
+    make_executable(tmp_path / "a")
+    monkeypatch.setattr(os, "replace", cross_device_replace)
+    monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+    assembler._move_file(str(tmp_path / "a"), str(tmp_path / "b"))
+    assert copies == [10, 6, 2]
+    assert not (tmp_path / "a").exists()
+    assert (tmp_path / "b").read_bytes() == b"executable"
+    assert (tmp_path / "b").stat().st_mode & 0o777 == 0o755
+
+
+def test_move_file_falls_back_to_a_copy(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def unsupported_copy_file_range(src: int, dst: int, count: int) -> int:
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+    make_executable(tmp_path / "a")
+    monkeypatch.setattr(os, "replace", cross_device_replace)
+    monkeypatch.setattr(
+        os, "copy_file_range", unsupported_copy_file_range, raising=False
+    )
+    assembler._move_file(str(tmp_path / "a"), str(tmp_path / "b"))
+    assert not (tmp_path / "a").exists()
+    assert (tmp_path / "b").read_bytes() == b"executable"
+    assert (tmp_path / "b").stat().st_mode & 0o777 == 0o755
+    # Also without copy_file_range at all.
+    make_executable(tmp_path / "c")
+    monkeypatch.delattr(os, "copy_file_range", raising=False)
+    assembler._move_file(str(tmp_path / "c"), str(tmp_path / "d"))
+    assert (tmp_path / "d").read_bytes() == b"executable"
+
+
+def test_run_tool_counts_cpu_time_of_its_own_commands_only() -> None:
+    busy = [sys.executable, "-c", "import time\nwhile time.process_time() < 0.3: pass"]
+    profile = CompileProfile()
+    with profile.stage("assemble"):
+        assembler._run_tool(busy)
+    with profile.stage("parse"):
+        # Another thread's command finishes during this stage.
+        thread = threading.Thread(target=assembler._run_tool, args=(busy,))
+        thread.start()
+        thread.join()
+    assemble, parse = profile.timings
+    assert assemble.cpu_time >= 0.3
+    assert parse.cpu_time < 0.1
+    with pytest.raises(subprocess.CalledProcessError):
+        assembler._run_tool(
+            [sys.executable, "-c", "import sys; sys.exit(input())"], "3"
+        )
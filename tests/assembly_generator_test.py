@@ -0,0 +1,65 @@
+import re
+
+from compiler.assembly_generator import generate_assembly
+from tests.helpers import ir_of
+
+
+def frame_size(code: str, use_registers: bool) -> int:
+    instructions = ir_of(code)
+    assembly = generate_assembly(instructions, use_registers=use_registers)
+    m = re.search(r"^subq \$(\d+), %rsp$", assembly, re.MULTILINE)
+    assert m is not None
+    return int(m[1])
+
+
+def test_frame_is_aligned_and_does_not_grow_with_program_length() -> None:
+    statement = "var x = read_int(); print_int(x * 2 + 1);"
+    for use_registers in (False, True):
+        small = frame_size(statement * 3, use_registers)
+        large = frame_size(statement * 300, use_registers)
+        assert small % 16 == 0
+        assert large == small
+
+
+def code_lines(assembly: str) -> list[str]:
+    return [
+        line
+        for line in assembly.splitlines()
+        if line and not line.startswith("#") and not line.startswith(".")
+    ]
+
+
+def test_comparison_feeding_a_branch_is_fused_into_a_conditional_jump() -> None:
+    code = "var i = read_int(); while i < 10 do i = i + 1; print_int(i)"
+    instructions = ir_of(code)
+    lines = code_lines(generate_assembly(instructions))
+    assert not any(line.startswith("set") for line in lines)
+    # The loop body follows the condition, so only the exit needs a jump.
+    compare = next(i for i, line in enumerate(lines) if line.startswith("cmpq"))
+    assert lines[compare + 1].startswith("jge ")
+    assert not lines[compare + 2].startswith("jmp ")
+
+
+def test_comparison_whose_result_is_used_elsewhere_is_not_fused() -> None:
+    code = "var b = read_int() < 10; if b then print_int(1); print_bool(b)"
+    # After copy propagation, both the branch and the call read the result
+    # of the comparison directly.
+    instructions = ir_of(code, optimized=True)
+    lines = code_lines(generate_assembly(instructions))
+    assert any(line.startswith("setl") for line in lines)
+
+
+def test_constants_are_immediate_operands() -> None:
+    code = "var x = read_int(); print_int(x * 7 - 3)"
+    instructions = ir_of(code, optimized=True)
+    lines = code_lines(generate_assembly(instructions))
+    assert not any(line.startswith("movq $") for line in lines)
+    assert any(line.startswith("imulq $7, ") for line in lines)
+    assert any(re.match(r"subq \$3, |leaq -3\(", line) for line in lines)
+
+
+def test_variable_in_memory_is_updated_in_place() -> None:
+    code = "var x = read_int(); x = x + 3; print_int(x)"
+    instructions = ir_of(code)
+    lines = code_lines(generate_assembly(instructions, use_registers=False))
+    assert any(re.fullmatch(r"addq \$3, -\d+\(%rbp\)", line) for line in lines)
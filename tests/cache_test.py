@@ -0,0 +1,41 @@
+from pathlib import Path
+
+from compiler.cache import CompilationCache
+
+
+def test_cache_memory_tier_evicts_least_recently_used() -> None:
+    cache = CompilationCache(memory_budget=10)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.get("c") == b"12345"
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["memory_bytes"] == 10
+
+
+def test_cache_disk_tier_is_shared(tmp_path: Path) -> None:
+    writer = CompilationCache(directory=str(tmp_path))
+    reader = CompilationCache(directory=str(tmp_path))
+    key = CompilationCache.key("print_int(1)", "options")
+
+    assert reader.get(key) is None
+    writer.put(key, b"executable")
+    assert reader.get(key) == b"executable"
+    assert reader.stats()["disk_hits"] == 1
+    # The disk hit was promoted to the memory tier.
+    assert reader.get(key) == b"executable"
+    assert reader.stats()["memory_hits"] == 1
+
+
+def test_cache_key_depends_on_source_and_options() -> None:
+    assert CompilationCache.key("1", "a") == CompilationCache.key("1", "a")
+    assert CompilationCache.key("1", "a") != CompilationCache.key("1", "b")
+    assert CompilationCache.key("1", "a") != CompilationCache.key("2", "a")
@@ -0,0 +1,84 @@
+import os
+import platform
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from compiler.assembler import stdlib_asm_code
+from compiler.encoder import EncodingError, assemble_executable, link, parse_unit
+
+
+def encode(code: str) -> bytes:
+    machine_code, _ = link([parse_unit(code)], 0)
+    return machine_code
+
+
+def test_encoder_matches_gnu_as() -> None:
+    # Expected bytes are from GNU as.
+    testPairs = [
+        ("movq $60, %rax", "48c7c03c000000"),
+        ("xorq %rdi, %rdi", "4831ff"),
+        ("movb $10, (%rsp)", "c604240a"),
+        ("movb %dl, (%rsp)", "881424"),
+        ("movq -800(%rbp), %rdi", "488bbde0fcffff"),
+        ("or %rdi, -16(%rbp)", "48097df0"),
+        ("imulq $10, %r10", "4d6bd20a"),
+        ("idivq -24(%rbp)", "48f77de8"),
+        ("setl %sil", "400f9cc6"),
+        ("setg %r9b", "410f9fc1"),
+        ("movabsq $-123456789012, %r11", "49bbece56641e3ffffff"),
+        ("leaq 16(%r12,%r13,4), %r14", "4f8d74ac10"),
+        ("movq 0(%rbp), %rax", "488b4500"),
+        ("imulq $1000, %r15, %r8", "4d69c7e8030000"),
+        ("pushq %r12", "4154"),
+        ("pushq $0", "6a00"),
+        ("cqto", "4899"),
+    ]
+    for code, expected in testPairs:
+        assert encode(code).hex() == expected, code
+
+
+def test_encoder_resolves_labels_and_assignments() -> None:
+    code = """
+    start:
+        jmp .Lend
+        .ascii "ab\\n"
+    len = . - start
+    .Lend:
+        movq $len, %rax
+    """
+    # jmp rel32 (5 bytes) + 3 bytes of data, then 'len' = 8.
+    assert encode(code).hex() == "e903000000" + "61620a" + "48c7c008000000"
+
+
+def test_encoder_rejects_unsupported_code() -> None:
+    for code in ["jmp *%rax", "movl $1, %eax", ".section .data", "frobq %rax"]:
+        with pytest.raises(EncodingError):
+            encode(code)
+
+
+@pytest.mark.skipif(
+    platform.system() != "Linux" or platform.machine() != "x86_64",
+    reason="needs x86-64 Linux to run the executable",
+)
+def test_builtin_executable_runs(tmp_path: Path) -> None:
+    program = """
+    .global main
+    main:
+        pushq %rbp
+        movq %rsp, %rbp
+        movq $-42, %rdi
+        callq print_int
+        movq $1, %rdi
+        callq print_bool
+        movq %rbp, %rsp
+        popq %rbp
+        ret
+    """
+    executable = tmp_path / "a.out"
+    executable.write_bytes(assemble_executable([stdlib_asm_code, program]))
+    os.chmod(executable, 0o755)
+    result = subprocess.run([executable], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert result.stdout == "-42\ntrue\n"
@@ -0,0 +1,11 @@
+from compiler.ir import Instruction
+from compiler.ir_generator import generate_ir, root_types
+from compiler.optimizer import optimize
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def ir_of(code: str, optimized: bool = False) -> list[Instruction]:
+    """Returns the IR of the type checked program `code`."""
+    instructions = generate_ir(root_types, parse(tokenize(code)), check_types=True)
+    return optimize(instructions) if optimized else instructions
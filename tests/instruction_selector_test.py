@@ -0,0 +1,113 @@
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+import pytest
+
+from compiler.instruction_selector import select_instructions
+from compiler.ir import Call, Copy, Instruction, IRVar, LoadIntConst
+from compiler.pipeline import CompilerOptions, compile
+from tests.helpers import ir_of
+
+
+def constant(value: int, instructions: list[Instruction]) -> IRVar:
+    [var] = [
+        insn.dest
+        for insn in instructions
+        if isinstance(insn, LoadIntConst) and insn.value == value
+    ]
+    return var
+
+
+def index_of_call(name: str, instructions: list[Instruction]) -> int:
+    [i] = [
+        i
+        for i, insn in enumerate(instructions)
+        if isinstance(insn, Call) and insn.fun.name == name
+    ]
+    return i
+
+
+def test_constants_are_immediates_except_as_divisors() -> None:
+    instructions = ir_of("var x = read_int(); print_int(x * 7 + x / 3)", optimized=True)
+    selection = select_instructions(instructions)
+    assert selection.immediates == {constant(7, instructions): 7}
+    assert constant(3, instructions) not in selection.unallocated
+
+
+def test_large_constants_are_not_immediates() -> None:
+    instructions = ir_of(
+        "var x = read_int(); print_int(x + 4294967296)", optimized=True
+    )
+    assert select_instructions(instructions).immediates == {}
+
+
+def test_comparison_of_two_immediates_keeps_one_loaded() -> None:
+    instructions = ir_of("if 1 < 2 then print_int(3)")
+    selection = select_instructions(instructions)
+    assert constant(1, instructions) not in selection.immediates
+    assert constant(2, instructions) in selection.immediates
+    assert selection.fused_comparisons == {index_of_call("<", instructions)}
+
+
+def test_scaled_index_is_folded_into_an_address() -> None:
+    instructions = ir_of(
+        "var a = read_int(); var b = read_int(); print_int(a + b * 4)", optimized=True
+    )
+    selection = select_instructions(instructions)
+    plus = index_of_call("+", instructions)
+    times = index_of_call("*", instructions)
+    a, b = [insn.dest for insn in instructions if isinstance(insn, Call)][:2]
+    address = selection.addresses[plus]
+    assert (address.base, address.index, address.scale) == (a, b, 4)
+    assert selection.folded == {times}
+    product = instructions[times]
+    assert isinstance(product, Call)
+    assert product.dest in selection.unallocated
+
+
+def test_index_assigned_before_the_addition_is_not_folded() -> None:
+    instructions = ir_of("var a = read_int(); print_int(a * 4 + (a = 5))")
+    selection = select_instructions(instructions)
+    assert selection.addresses == {}
+    assert selection.folded == set()
+
+
+def test_result_that_is_only_copied_goes_to_the_copy() -> None:
+    instructions = ir_of("var x = read_int(); x = x + 1; print_int(x)")
+    plus = index_of_call("+", instructions)
+    copy = instructions[plus + 1]
+    assert isinstance(copy, Copy)
+    selection = select_instructions(instructions)
+    assert selection.results[plus] == copy.dest
+    assert copy.source in selection.unallocated
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_selected_instructions_compute_the_same_values(tmp_path: Path) -> None:
+    code = """
+        var a = read_int();
+        var b = read_int();
+        print_int(a + b * 4);
+        print_int(8 * b + 7);
+        print_int(a * 3 - 5);
+        print_int(5 - a * 9);
+        print_int(a - -2147483648);
+        print_int(100 / b + 100 % a);
+        var i = 0;
+        while 3 > i do i = i + 1;
+        print_int(i);
+        print_bool(a <= 7)
+        """
+    expected = [-22 + 3 * 4, 8 * 3 + 7, -22 * 3 - 5, 5 + 22 * 9]
+    expected += [-22 + 2**31, 100 // 3 + 12, 3]
+    for optimized in (False, True):
+        executable = compile(code, CompilerOptions(optimize=optimized))
+        program = tmp_path / "program"
+        program.write_bytes(executable)
+        os.chmod(program, 0o755)
+        stdout = subprocess.run(
+            [program], input=b"-22\n3\n", capture_output=True, check=True
+        ).stdout
+        assert stdout.decode().split() == [str(n) for n in expected] + ["true"]
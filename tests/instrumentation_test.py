@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import tracemalloc
+
+from compiler.instrumentation import CompileProfile, StageStats, StageTiming
+
+
+def test_profile_records_nested_stages() -> None:
+    profile = CompileProfile(track_memory=True)
+    with profile.stage("total"):
+        with profile.stage("parse"):
+            data = [0] * 100_000
+        del data
+        with profile.stage("ir"):
+            pass
+
+    assert [t.stage for t in profile.timings] == ["parse", "ir", "total"]
+    parse, ir, total = profile.timings
+    assert parse.peak_memory is not None and parse.peak_memory >= 700_000
+    assert ir.peak_memory is not None and ir.peak_memory < 100_000
+    assert total.peak_memory is not None and total.peak_memory >= parse.peak_memory
+    assert total.wall_time >= parse.wall_time + ir.wall_time
+
+
+def test_profiles_on_threads_share_tracemalloc() -> None:
+    both_open = threading.Barrier(2)
+    first_done = threading.Event()
+    tracing: list[bool] = []
+
+    def first() -> CompileProfile:
+        profile = CompileProfile(track_memory=True)
+        with profile.stage("total"):
+            both_open.wait()
+        first_done.set()
+        return profile
+
+    def second() -> CompileProfile:
+        profile = CompileProfile(track_memory=True)
+        with profile.stage("total"):
+            both_open.wait()
+            first_done.wait()
+            # The first profile finishing doesn't stop tracemalloc.
+            tracing.append(tracemalloc.is_tracing())
+            with profile.stage("parse"):
+                data = [0] * 100_000
+            del data
+        return profile
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first_profile = executor.submit(first)
+        second_profile = executor.submit(second)
+        [first_total] = first_profile.result().timings
+        parse, second_total = second_profile.result().timings
+
+    assert tracing == [True]
+    assert not tracemalloc.is_tracing()
+    # Stages that were open at the same time can't tell whose
+    # allocations were whose.
+    assert first_total.peak_memory is None
+    assert second_total.peak_memory is None
+    assert parse.peak_memory is not None and parse.peak_memory >= 700_000
+
+
+def test_stage_stats_histograms() -> None:
+    stats = StageStats()
+    for wall_time in [0.0001, 0.0001, 0.0001, 0.5]:
+        profile = CompileProfile()
+        profile.timings.append(StageTiming("total", wall_time, wall_time / 2))
+        stats.record(profile)
+
+    total = stats.stats()["total"]
+    assert total["count"] == 4
+    assert abs(total["wall_time"] - 0.5003) < 1e-6
+    # 100 µs falls into the bucket below 128 µs, 0.5 s below 2**19 µs.
+    assert total["histogram"] == [[0.000128, 3], [0.524288, 1]]
+    assert total["p50"] == 0.000128
+    assert total["p99"] == 0.524288
+    assert "parse" not in stats.stats()
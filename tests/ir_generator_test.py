@@ -0,0 +1,54 @@
+import pytest
+
+from compiler.ir_generator import generate_ir, root_types
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import typecheck
+
+
+def separate(code: str) -> list[str]:
+    expr = parse(tokenize(code))
+    typecheck(expr)
+    return [str(i) for i in generate_ir(root_types, expr)]
+
+
+def fused(code: str) -> list[str]:
+    expr = parse(tokenize(code))
+    return [str(i) for i in generate_ir(root_types, expr, check_types=True)]
+
+
+def test_fused_type_checking_generates_the_same_ir() -> None:
+    programs = [
+        "1 + 2 * 3",
+        """
+        var x = read_int();
+        { var x = x % 7; print_int(x) };
+        while x > 0 do { x = x - 1; if x == 3 then print_bool(true) };
+        var b = if x < 0 then true or false else not (x != 1);
+        b
+        """,
+        "{ var a = 1; var b = a; b = 2; true and a == b }",
+    ]
+    for code in programs:
+        assert fused(code) == separate(code), code
+
+
+def test_fused_type_checking_raises_the_same_errors() -> None:
+    programs = [
+        "1 + true",
+        "if 1 then 2 else 3",
+        "if true then 1 else false",
+        "{ var x = 1; x = true }",
+        "while 1 do 2",
+        "{ { var y = 1 }; y }",
+        "print_int(1, 2)",
+        "-true",
+        "1 == false",
+        "true or 1",
+    ]
+    for code in programs:
+        with pytest.raises(Exception) as separate_error:
+            separate(code)
+        with pytest.raises(Exception) as fused_error:
+            fused(code)
+        assert str(fused_error.value) == str(separate_error.value), code
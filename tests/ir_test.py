@@ -0,0 +1,51 @@
+from compiler.ir import BasicBlock, ControlFlowGraph
+from tests.helpers import ir_of
+
+
+def names(blocks: list[BasicBlock]) -> list[str]:
+    return [b.name for b in blocks]
+
+
+def test_cfg_round_trips_and_links_blocks() -> None:
+    instructions = ir_of("{ var x = read_int(); if x > 0 then x = 1 else x = 2; x }")
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    assert cfg.to_instructions() == instructions
+
+    # entry -> then/else -> end
+    entry, then, otherwise, end = cfg.blocks
+    assert entry.label is None
+    assert names(entry.successors) == names([then, otherwise])
+    assert names(then.successors) == names(otherwise.successors) == names([end])
+    assert names(end.predecessors) == names([then, otherwise])
+    assert end.successors == []
+
+
+def test_cfg_dominators_and_loops() -> None:
+    instructions = ir_of("""
+        var i = 0;
+        while i < 3 do {
+            var j = 0;
+            while j < i do j = j + 1;
+            i = i + 1
+        };
+        if true then print_int(i)
+        """)
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    assert cfg.to_instructions() == instructions
+
+    idom = cfg.immediate_dominators()
+    dominators = cfg.dominators()
+    assert idom[cfg.entry] is cfg.entry
+    for block, dom in dominators.items():
+        assert cfg.entry in dom and block in dom
+        if block is not cfg.entry:
+            assert idom[block] in dom
+
+    outer, inner = cfg.loops()
+    assert inner.blocks < outer.blocks
+    assert outer.header in dominators[inner.header]
+    for loop in (outer, inner):
+        assert all(loop.header in dominators[b] for b in loop.blocks)
+        assert all(loop.header in latch.successors for latch in loop.latches)
+        # The exit of the loop is the else branch of its header's CondJump.
+        assert len([s for s in loop.header.successors if s not in loop.blocks]) == 1
@@ -0,0 +1,136 @@
+from compiler.assembly_generator import get_all_ir_variables
+from compiler.ir import (
+    Call,
+    CondJump,
+    ControlFlowGraph,
+    Copy,
+    Instruction,
+    LoadBoolConst,
+    LoadIntConst,
+)
+from compiler.optimizer import (
+    eliminate_dead_code,
+    fold_call,
+    optimize,
+    propagate_constants,
+    propagate_copies,
+)
+from tests.helpers import ir_of
+
+
+def printed_constants(instructions: list[Instruction]) -> list[int | bool]:
+    constants = {
+        insn.dest: insn.value
+        for insn in instructions
+        if isinstance(insn, (LoadIntConst, LoadBoolConst))
+    }
+    return [
+        constants[insn.args[0]]
+        for insn in instructions
+        if isinstance(insn, Call) and insn.fun.name.startswith("print_")
+    ]
+
+
+def test_fold_call_follows_machine_arithmetic() -> None:
+    assert fold_call("+", [2**63 - 1, 1]) == -(2**63)
+    assert fold_call("/", [-7, 2]) == -3
+    assert fold_call("%", [-7, 2]) == -1
+    assert fold_call("/", [1, 0]) is None
+    assert fold_call("/", [-(2**63), -1]) is None
+    assert fold_call("unary_not", [True]) is False
+    assert fold_call("==", [True, True]) is True
+    assert fold_call("print_int", [1]) is None
+
+
+def test_constants_propagate_through_variables_and_branches() -> None:
+    instructions = optimize(ir_of("""
+        var x = 3;
+        var y = if x < 5 then x * 2 else read_int();
+        print_int(y + 1);
+        print_bool(not (y == 6) or x > 0)
+        """))
+    assert printed_constants(instructions) == [7, True]
+    assert not any(isinstance(insn, CondJump) for insn in instructions)
+    assert not any(
+        isinstance(insn, Call) and insn.fun.name == "read_int" for insn in instructions
+    )
+
+
+def test_branches_on_unknown_values_are_kept() -> None:
+    instructions = ir_of("""
+        var x = 0;
+        while x < read_int() do x = x + 1;
+        print_int(x)
+        """)
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    propagate_constants(cfg)
+    assert len(cfg.blocks) == len(
+        ControlFlowGraph.from_instructions(instructions).blocks
+    )
+    assert any(isinstance(insn, CondJump) for insn in cfg.to_instructions())
+
+
+def test_loop_that_never_runs_is_removed() -> None:
+    instructions = optimize(ir_of("""
+        var x = 1;
+        while x > 1 do x = read_int();
+        print_int(x)
+        """))
+    assert printed_constants(instructions) == [1]
+    assert not any(
+        isinstance(insn, Call) and insn.fun.name == "read_int" for insn in instructions
+    )
+
+
+def test_copies_are_propagated_and_dead_code_removed() -> None:
+    instructions = ir_of("""
+        var n = read_int();
+        var unused = n * 2;
+        var m = n;
+        print_int(if m > 0 then m else -m)
+        """)
+    optimized = optimize(instructions)
+    assert len(get_all_ir_variables(optimized)) < len(
+        get_all_ir_variables(instructions)
+    )
+    read = next(insn for insn in optimized if isinstance(insn, Call))
+    assert read.fun.name == "read_int"
+    assert not any(
+        isinstance(insn, Call) and insn.fun.name == "*" for insn in optimized
+    )
+    # Only the copies of the branches' results into the 'if' are left,
+    # and 'm' is replaced by 'n'.
+    copies = [insn for insn in optimized if isinstance(insn, Copy)]
+    assert len(copies) == 2
+    assert copies[0].source == read.dest
+
+
+def test_copy_is_not_propagated_past_reassignment() -> None:
+    instructions = ir_of("""
+        var x = read_int();
+        var y = x;
+        x = read_int();
+        print_int(y)
+        """)
+    cfg = ControlFlowGraph.from_instructions(instructions)
+    propagate_copies(cfg)
+    eliminate_dead_code(cfg)
+    optimized = cfg.to_instructions()
+    first_read, second_read, printed = [
+        insn for insn in optimized if isinstance(insn, Call)
+    ]
+    assert printed.args == [first_read.dest]
+    assert second_read.fun.name == "read_int"
+
+
+def test_dead_code_keeps_side_effects_and_division() -> None:
+    instructions = optimize(ir_of("""
+        var x = read_int();
+        var y = x / 0;
+        var z = x + 1;
+        while z > 0 do z = z - 1;
+        print_bool(true)
+        """))
+    called = [insn.fun.name for insn in instructions if isinstance(insn, Call)]
+    # The loop is kept: it decides whether the program terminates.
+    assert called == ["read_int", "/", "+", ">", "-", "print_bool"]
@@ -1,3 +1,5 @@
+import sys
+
 from compiler.tokenizer import tokenize, Token, TokenType, L, Location
 from compiler.parser import parse
 import compiler.ast as ast
@@ -424,3 +426,46 @@ def test_parser_basics() -> None:
     # ])]
 
     # assert block == block2
+
+
+def test_parser_unary_and_binary_minus() -> None:
+    # -x - y == (-x) - y
+    assert parse(tokenize("-x - y")) == ast.BinaryOp(
+        L,
+        "-",
+        ast.UnaryOp(L, "-", ast.Identifier(L, "x")),
+        ast.Identifier(L, "y"),
+    )
+    # not not a and b == (not (not a)) and b
+    assert parse(tokenize("not not a and b")) == ast.BinaryOp(
+        L,
+        "and",
+        ast.UnaryOp(L, "not", ast.UnaryOp(L, "not", ast.Identifier(L, "a"))),
+        ast.Identifier(L, "b"),
+    )
+
+
+def test_parser_deep_nesting() -> None:
+    depth = 50_000
+    limit = sys.getrecursionlimit()
+    expr = parse(tokenize("(" * depth + "1" + ")" * depth))
+    assert expr == ast.Literal(L, 1)
+    for source in [
+        "{" * depth + "1" + "}" * depth,
+        "if true then " * depth + "1",
+        "f(" * depth + ")" * depth,
+        "x = " * depth + "1",
+    ]:
+        parse(tokenize(source))
+    # Nesting doesn't need a higher recursion limit.
+    assert sys.getrecursionlimit() == limit
+
+
+def test_parser_nodes_have_no_instance_dict() -> None:
+    tokens = tokenize("{ var x = 1; if x < 2 then f(x) else -x }")
+    assert not hasattr(tokens[0], "__dict__")
+    assert not hasattr(tokens[0].location, "__dict__")
+    expr = parse(tokens)
+    assert isinstance(expr, ast.Block)
+    for node in [expr, *expr.expressions]:
+        assert not hasattr(node, "__dict__")
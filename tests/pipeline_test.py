@@ -0,0 +1,87 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+import pytest
+
+from compiler import assembler, pipeline
+from compiler.cache import CompilationCache
+from compiler.instrumentation import StageStats
+from compiler.pipeline import CompilationContext, compile, compile_batch
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_compile_batch_keeps_order_and_isolates_errors() -> None:
+    results = compile_batch(
+        [("print_int(1)", "a"), ("print_int(", "b"), ("print_int(2)", "c")]
+    )
+    assert [r.executable is not None for r in results] == [True, False, True]
+    assert results[1].error is not None
+    assert 'expected ")"' in results[1].error
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_compilation_contexts_run_concurrently_on_threads() -> None:
+    programs = [
+        f"{{ var x = {i}; while x > 0 do x = x - 1; print_int({i}) }}"
+        for i in range(16)
+    ]
+    expected = [compile(p) for p in programs]
+
+    def run(i: int) -> tuple[bytes, list[str]]:
+        context = CompilationContext(trace_channels=["parser"])
+        return context.compile(programs[i]), context.trace_lines
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(run, range(len(programs))))
+
+    assert [executable for executable, _ in results] == expected
+    # Each context gets the trace of its own compilation only.
+    for _, lines in results:
+        assert len(lines) == len(results[0][1]) > 0
+        assert all(line.startswith("[parser] ") for line in lines)
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_compile_to_file_moves_the_executable_and_caches_it(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    moves: list[str] = []
+    move_file = assembler._move_file
+
+    def counting_move_file(source: str, destination: str) -> None:
+        moves.append(destination)
+        move_file(source, destination)
+
+    monkeypatch.setattr(assembler, "_move_file", counting_move_file)
+    monkeypatch.setattr(pipeline, "compilation_cache", CompilationCache())
+    first, second = str(tmp_path / "first"), str(tmp_path / "second")
+    CompilationContext().compile_to_file("print_int(1)", first)
+    CompilationContext().compile_to_file("print_int(1)", second)
+    # The second executable came from the cache.
+    assert moves == [first]
+    assert Path(second).read_bytes() == Path(first).read_bytes()
+    assert os.access(second, os.X_OK)
+    stdout = subprocess.run([second], capture_output=True, check=True).stdout
+    assert stdout == b"1\n"
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_every_entry_point_records_statistics(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    stats = StageStats()
+    monkeypatch.setattr(pipeline, "stage_stats", stats)
+    source = tmp_path / "program.src"
+    source.write_text("print_int(1)")
+    for cache in [None, CompilationCache()]:
+        monkeypatch.setattr(pipeline, "compilation_cache", cache)
+        CompilationContext().compile("print_int(1)")
+        CompilationContext().compile_to_file("print_int(1)", str(tmp_path / "a"))
+        CompilationContext().compile_file(str(source), str(tmp_path / "b"))
+    recorded = stats.stats()
+    assert recorded["total"]["count"] == 6
+    # With the cache, only the first compilation assembles.
+    assert recorded["assemble"]["count"] == 4
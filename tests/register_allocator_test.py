@@ -0,0 +1,149 @@
+import os
+from pathlib import Path
+import shutil
+import subprocess
+
+import pytest
+
+from compiler.ir import Call, Instruction, IRVar, Jump
+from compiler.pipeline import CompilerOptions, compile
+from compiler.register_allocator import (
+    CALLEE_SAVED,
+    CALLER_SAVED,
+    LiveInterval,
+    allocate_registers,
+    live_intervals,
+)
+from tests.helpers import ir_of
+
+
+def calls_to(name: str, instructions: list[Instruction]) -> list[tuple[int, Call]]:
+    return [
+        (i, insn)
+        for i, insn in enumerate(instructions)
+        if isinstance(insn, Call) and insn.fun.name == name
+    ]
+
+
+def read_variables(instructions: list[Instruction]) -> list[IRVar]:
+    return [call.dest for _, call in calls_to("read_int", instructions)]
+
+
+def overlap(a: LiveInterval, b: LiveInterval) -> bool:
+    # Intervals that only touch can share a register.
+    return a.start < b.end and b.start < a.end
+
+
+# Many values that are live at the same time, across calls and a loop.
+PRESSURE = "\n".join(
+    [f"var a{i} = read_int() * {i + 1};" for i in range(16)]
+    + ["var s = 0; var i = 0;"]
+    + ["while i < 3 do {"]
+    + [f"s = s + a{i} * i;" for i in range(16)]
+    + ["i = i + 1 };"]
+    + ["print_int(s + " + " + ".join(f"a{i}" for i in range(16)) + ")"]
+)
+
+
+def test_interval_of_variable_used_in_loop_covers_the_loop() -> None:
+    instructions = ir_of(
+        """
+        var n = read_int();
+        var i = 0;
+        while i < n do i = i + 1;
+        print_int(i)
+        """,
+        optimized=True,
+    )
+    intervals = {interval.var: interval for interval in live_intervals(instructions)}
+    [n] = [intervals[var] for var in read_variables(instructions)]
+    jump_back = max(i for i, insn in enumerate(instructions) if isinstance(insn, Jump))
+    assert n.end >= jump_back
+    # 'n' is read in the loop but no call happens while it is live.
+    assert n.calls == []
+
+
+def test_registers_are_not_shared_by_overlapping_intervals() -> None:
+    instructions = ir_of(PRESSURE, optimized=True)
+    allocation = allocate_registers(instructions)
+    intervals = [
+        interval
+        for interval in live_intervals(instructions)
+        if interval.var in allocation.registers
+    ]
+    for a in intervals:
+        for b in intervals:
+            if a is not b and overlap(a, b):
+                assert allocation.registers[a.var] != allocation.registers[b.var]
+
+
+def test_values_live_across_calls_prefer_callee_saved_registers() -> None:
+    instructions = ir_of(
+        "var x = read_int(); var y = read_int(); print_int(x); print_int(y)",
+        optimized=True,
+    )
+    allocation = allocate_registers(instructions)
+    x, y = read_variables(instructions)
+    assert allocation.registers[x] in CALLEE_SAVED
+    assert allocation.registers[y] in CALLEE_SAVED
+    assert allocation.registers[x] != allocation.registers[y]
+    assert set(allocation.callee_saved) == {
+        allocation.registers[x],
+        allocation.registers[y],
+    }
+    assert allocation.saved_across_call == {}
+
+
+def test_caller_saved_registers_are_saved_across_calls() -> None:
+    instructions = ir_of(
+        "var x = read_int(); print_int(1); print_int(x)", optimized=True
+    )
+    allocation = allocate_registers(instructions, callee_saved=[])
+    [x] = read_variables(instructions)
+    (call, _), _ = calls_to("print_int", instructions)
+    assert allocation.saved_across_call == {call: [allocation.registers[x]]}
+    assert allocation.caller_saved() == [allocation.registers[x]]
+
+
+def test_spills_under_pressure() -> None:
+    instructions = ir_of(PRESSURE, optimized=True)
+    allocation = allocate_registers(
+        instructions, callee_saved=[], caller_saved=CALLER_SAVED[:3]
+    )
+    assert len(set(allocation.registers.values())) <= 3
+    spilled = [
+        interval.var
+        for interval in live_intervals(instructions)
+        if interval.var not in allocation.registers
+    ]
+    assert spilled
+
+
+@pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+def test_allocated_program_behaves_like_unallocated_one(tmp_path: Path) -> None:
+    stdin = "".join(f"{i * 3 - 20}\n" for i in range(16)).encode()
+
+    def run(optimize: bool) -> bytes:
+        executable = compile(PRESSURE, CompilerOptions(optimize=optimize))
+        program = tmp_path / "program"
+        program.write_bytes(executable)
+        os.chmod(program, 0o755)
+        return subprocess.run(
+            [program], input=stdin, capture_output=True, check=True
+        ).stdout
+
+    assert run(optimize=True) == run(optimize=False)
+
+
+def test_spilled_variables_with_disjoint_intervals_share_slots() -> None:
+    instructions = ir_of(PRESSURE, optimized=True)
+    allocation = allocate_registers(instructions, callee_saved=[], caller_saved=[])
+    intervals = live_intervals(instructions)
+    assert allocation.registers == {}
+    assert allocation.stack_slots.keys() == {interval.var for interval in intervals}
+    assert allocation.slot_count() < len(intervals) // 2
+    slots = allocation.stack_slots
+    for a in intervals:
+        for b in intervals:
+            if a is not b and overlap(a, b):
+                assert slots[a.var] != slots[b.var]
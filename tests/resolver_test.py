@@ -0,0 +1,51 @@
+from compiler import ast
+from compiler.parser import parse
+from compiler.resolver import GLOBAL, resolve
+from compiler.tokenizer import tokenize
+
+
+def identifiers(expr: ast.Expression) -> list[tuple[str, int]]:
+    found: list[tuple[str, int]] = []
+    stack: list[object] = [expr]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+        elif isinstance(node, ast.Identifier):
+            found.append((node.name, node.symbol))
+        elif isinstance(node, ast.Expression):
+            stack.extend(
+                reversed([getattr(node, f) for f in node.__dataclass_fields__])
+            )
+    return found
+
+
+def test_resolve_binds_names_to_innermost_declaration() -> None:
+    expr = parse(
+        tokenize(
+            """
+            var x = 1;
+            { var x = x + 1; print_int(x) };
+            { var y = x; y = 2 };
+            x
+            """
+        )
+    )
+    assert resolve(expr) == 3
+    assert identifiers(expr) == [
+        ("x", 0),
+        ("x", 1),
+        ("x", 0),
+        ("print_int", GLOBAL),
+        ("x", 1),
+        ("y", 2),
+        ("x", 0),
+        ("y", 2),
+        ("x", 0),
+    ]
+
+
+def test_resolve_leaves_undeclared_names_global() -> None:
+    expr = parse(tokenize("{ { var a = 1 }; a }"))
+    assert resolve(expr) == 1
+    assert identifiers(expr) == [("a", 0), ("a", GLOBAL)]
@@ -0,0 +1,173 @@
+import asyncio
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any
+
+import pytest
+
+import compiler
+from compiler.server import AsyncServer, ServerOptions
+
+needs_binutils = pytest.mark.skipif(shutil.which("as") is None, reason="needs binutils")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def request(port: int, input: dict[str, Any], timeout: float = 10.0) -> Any:
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as s:
+        s.sendall(json.dumps(input).encode())
+        s.shutdown(socket.SHUT_WR)
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+    return json.loads(data)
+
+
+@contextmanager
+def server(*args: str) -> Iterator[int]:
+    """Runs `serve` with `args` in a subprocess and yields its port."""
+    port = free_port()
+    src = str(Path(compiler.__file__).parent.parent)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "compiler", "serve", f"--port={port}", *args],
+        env={**os.environ, "PYTHONPATH": src},
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                request(port, {"command": "ping"}, timeout=1.0)
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise
+                time.sleep(0.1)
+        yield port
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@needs_binutils
+def test_worker_pool_serves_requests() -> None:
+    with server("--workers=2") as port:
+        response = request(port, {"command": "compile", "code": "print_int(1)"})
+        assert "program" in response
+        response = request(port, {"command": "compile", "code": "print_int("})
+        assert 'expected ")"' in response["error"]
+
+
+@needs_binutils
+def test_worker_is_replaced_after_max_requests() -> None:
+    # The only worker exits after every request, so each of these is
+    # served by a new one.
+    with server("--workers=1", "--max-requests=1") as port:
+        for _ in range(3):
+            assert request(port, {"command": "ping"}) == {}
+
+
+@needs_binutils
+def test_idle_client_does_not_block_a_worker() -> None:
+    with server("--workers=1", "--read-timeout=0.5") as port:
+        with socket.create_connection(("127.0.0.1", port)) as idle:
+            # The worker drops the idle client after the read timeout.
+            assert request(port, {"command": "ping"}, timeout=5.0) == {}
+            assert idle.recv(1) == b""
+
+
+async def exchange(async_server: AsyncServer, request_bytes: bytes | None) -> bytes:
+    """Sends `request_bytes` to `async_server`, or nothing if None, and
+    returns the response.
+    """
+    tcp_server = await asyncio.start_server(
+        async_server.handle_connection, "127.0.0.1", 0
+    )
+    port = tcp_server.sockets[0].getsockname()[1]
+    async with tcp_server:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        if request_bytes is not None:
+            writer.write(request_bytes)
+            writer.write_eof()
+        response = await asyncio.wait_for(reader.read(), 5.0)
+        writer.close()
+    return response
+
+
+def test_async_server_rejects_requests_beyond_its_capacity() -> None:
+    options = ServerOptions(max_inflight=1, max_queued=0)
+    release = threading.Event()
+
+    async def main() -> tuple[dict[str, Any], dict[str, Any]]:
+        async_server = AsyncServer(options, executor)
+        # Keep the only executor thread busy, so the request stays in flight.
+        executor.submit(release.wait)
+        first = asyncio.create_task(async_server.dispatch({"command": "stats"}))
+        while async_server.admit():
+            await asyncio.sleep(0.01)
+        busy = await async_server.dispatch({"command": "compile", "code": "1"})
+        ping = await async_server.dispatch({"command": "ping"})
+        release.set()
+        await first
+        assert async_server.admit()
+        return busy, ping
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        busy, ping = asyncio.run(main())
+    assert busy["error"].startswith("Server busy")
+    assert ping == {}
+
+
+def test_async_server_admits_batches_by_their_program_count() -> None:
+    options = ServerOptions(max_inflight=1, max_queued=1)
+    release = threading.Event()
+
+    def batch(n: int) -> dict[str, Any]:
+        return {"command": "compile_batch", "programs": ["print_int("] * n}
+
+    async def main() -> list[dict[str, Any]]:
+        async_server = AsyncServer(options, executor)
+        too_large = await async_server.dispatch(batch(20))
+        fits = await async_server.dispatch(batch(2))
+        executor.submit(release.wait)
+        first = asyncio.create_task(async_server.dispatch({"command": "stats"}))
+        while async_server.pending == 0:
+            await asyncio.sleep(0.01)
+        busy = await async_server.dispatch(batch(2))
+        release.set()
+        await first
+        return [too_large, fits, busy]
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        too_large, fits, busy = asyncio.run(main())
+    assert too_large["error"].startswith("Batch too large: 20 programs")
+    assert [r["error"] is not None for r in fits["results"]] == [True, True]
+    assert busy["error"].startswith("Server busy")
+
+
+def test_async_server_drops_clients_after_read_timeout() -> None:
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        async_server = AsyncServer(ServerOptions(read_timeout=0.2), executor)
+        assert asyncio.run(exchange(async_server, None)) == b""
+
+
+def test_async_server_rejects_large_requests() -> None:
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        async_server = AsyncServer(ServerOptions(max_request_size=100), executor)
+        response = asyncio.run(exchange(async_server, b" " * 1000))
+    assert json.loads(response) == {"error": "Request too large: more than 100 bytes"}
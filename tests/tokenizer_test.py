@@ -1,4 +1,4 @@
-from compiler.tokenizer import tokenize, Token, L, Location, TokenType
+from compiler.tokenizer import tokenize, tokenize_stream, Token, L, Location, TokenType
 
 # Shorthand for TT identifiers
 ident = TokenType.IDENTIFIER
@@ -25,3 +25,24 @@ def test_tokenizer_basics() -> None:
     ]
     for testPair in basicTestPairs:
         assert tokenize(testPair[0]) == testPair[1]
+
+
+def test_tokenizer_locations() -> None:
+    tokens = tokenize("a + a # a\n  // b\n\tb * a")
+    assert [(t.text, t.location.line, t.location.column) for t in tokens] == [
+        ("a", 1, 1),
+        ("+", 1, 3),
+        ("a", 1, 5),
+        ("b", 3, 2),
+        ("*", 3, 4),
+        ("a", 3, 6),
+    ]
+
+
+def test_tokenize_stream_matches_tokenize() -> None:
+    source = "var x = 10;\n# comment\nwhile x > 0 do {\n  x = x - 1\n}\n" * 5
+    expected = [(t.text, t.location) for t in tokenize(source)]
+    for chunk_size in [1, 2, 5, 1000]:
+        chunks = [source[i : i + chunk_size] for i in range(0, len(source), chunk_size)]
+        tokens = [(t.text, t.location) for t in tokenize_stream(chunks)]
+        assert tokens == expected
@@ -0,0 +1,14 @@
+from compiler import trace
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+
+
+def test_tracing_collects_enabled_channels_only() -> None:
+    assert not trace.on.parser
+    with trace.tracing(["parser"]) as lines:
+        assert trace.on.parser and not trace.on.tokenizer
+        parse(tokenize("{ 1; 2 }"))
+    assert not trace.on.parser
+
+    assert lines != []
+    assert all(line.startswith("[parser] ") for line in lines)
@@ -0,0 +1,39 @@
+import pytest
+
+from compiler.ir_generator import generate_ir, root_types
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.traversal import Visit, run
+from compiler.type_checker import typecheck
+from compiler.types import Int
+
+
+def test_run_returns_results_and_propagates_exceptions() -> None:
+    def depth(n: int) -> Visit[int]:
+        if n == 0:
+            return 0
+        return 1 + (yield depth(n - 1))
+
+    assert run(depth(100_000)) == 100_000
+
+    def fail(n: int) -> Visit[int]:
+        if n == 0:
+            raise ValueError("bottom")
+        try:
+            return (yield fail(n - 1))
+        except ValueError:
+            if n == 3:
+                return -1
+            raise
+
+    assert run(fail(10)) == -1
+    with pytest.raises(ValueError):
+        run(fail(2))
+
+
+def test_deep_programs_typecheck_and_generate_ir() -> None:
+    n = 20_000
+    for source in ["var a = 1; " + " + ".join(["a"] * n), "{" * n + "1" + "}" * n]:
+        expr = parse(tokenize(source))
+        assert typecheck(expr) == Int()
+        assert len(generate_ir(root_types, expr)) >= 2
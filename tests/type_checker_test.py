@@ -0,0 +1,34 @@
+import pickle
+
+import pytest
+
+from compiler.tokenizer import tokenize
+from compiler.parser import parse
+from compiler.type_checker import typecheck
+from compiler.types import Bool, FunType, Int, Unit
+
+
+def check(code: str) -> object:
+    return typecheck(parse(tokenize(code)))
+
+
+def test_types_are_interned() -> None:
+    assert Int() is Int()
+    assert Int() is not Bool()
+    assert FunType([Int(), Int()], Bool()) is FunType((Int(), Int()), Bool())
+    assert FunType([Int()], Int()) is not FunType([Int()], Bool())
+    assert {FunType([], Unit()): 1}[FunType([], Unit())] == 1
+    assert pickle.loads(pickle.dumps(FunType([Bool()], Int()))) is FunType(
+        [Bool()], Int()
+    )
+
+
+def test_typecheck_operators_and_loops() -> None:
+    assert check("1 + 2 * 3 % 4") is Int()
+    assert check("1 < 2 and not false") is Bool()
+    assert check("1 == 2") is Bool()
+    assert check("true != false") is Bool()
+    assert check("{ var x = 0; while x < 10 do x = x + 1 }") is Unit()
+    for code in ["1 == true", "1 + true", "while 1 do 2", "print_int(true)"]:
+        with pytest.raises(Exception):
+            check(code)